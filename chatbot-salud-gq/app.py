@@ -8,11 +8,13 @@ Descripción: Chatbot de IA que actúa como orientador médico,
              directorio de centros de salud y soporte bilingüe.
 """
 
+import atexit
 import logging
 import os
+import time
 from datetime import datetime
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 
 from config.settings import (
     FLASK_HOST,
@@ -25,11 +27,20 @@ from config.settings import (
 )
 from services.knowledge_memory import KnowledgeMemory
 from services.ai_service import AIService
+from services.escritor_aprendizaje import EscritorAprendizaje
+from services.procesador_mensajes import ProcesadorMensajes
+from services.metricas import LATENCIA_MENSAJE, registro as registro_metricas
 from services.whatsapp_service import WhatsAppService
 from services.session_manager import SessionManager
 from knowledge.idioma_fang import obtener_frase, obtener_saludo
 from knowledge.enfermedades import listar_enfermedades
-from knowledge.centros_salud import formatear_emergencias, listar_regiones
+from knowledge.centros_salud import (
+    centros_cercanos,
+    detectar_servicio,
+    formatear_centros_cercanos,
+    formatear_emergencias,
+    listar_regiones,
+)
 from knowledge.constitucion_gq import formatear_resumen_constitucion
 from knowledge.ohada import formatear_resumen_ohada
 from knowledge.historia_gq import formatear_resumen_historia
@@ -50,25 +61,99 @@ app = Flask(__name__)
 app.secret_key = SECRET_KEY
 
 memory = KnowledgeMemory()
-ai_service = AIService(memory=memory)
+bandeja_salida = memory.bandeja_salida
+escritor = EscritorAprendizaje(memory)
+escritor.iniciar()
+ai_service = AIService(memory=memory, escritor=escritor)
 whatsapp_service = WhatsAppService()
 session_manager = SessionManager(memory=memory)
+session_manager.iniciar()
+memory.archivo.iniciar()
+memory.iniciar_vectores()
+bandeja_salida.iniciar(whatsapp_service)
+
+# Cerrar las conexiones SQLite de forma ordenada al apagar el proceso.
+# atexit ejecuta en orden inverso: primero se vacía el escritor.
+atexit.register(memory.cerrar)
+atexit.register(memory.archivo.detener)
+atexit.register(memory.detener_vectores)
+atexit.register(whatsapp_service.cerrar)
+atexit.register(bandeja_salida.detener)
+atexit.register(escritor.detener)
+atexit.register(session_manager.detener)
 
 
 # ==================== Procesador de mensajes ====================
-def procesar_mensaje(telefono, texto, tipo_mensaje="text"):
+def procesar_ubicacion(telefono, texto, enviar=False, sesion=None):
+    """
+    Responde a una ubicación compartida con los centros más cercanos.
+    Si el usuario pidió antes un servicio (maternidad, urgencias...) solo
+    se muestran los centros que lo ofrecen. Al enviarla por WhatsApp, el
+    más cercano va detrás como ubicación en el mapa.
+    """
+    sesion = sesion or session_manager.obtener_sesion(telefono)
+    idioma = sesion.idioma
+    coordenadas = WhatsAppService.parsear_ubicacion(texto)
+    if coordenadas is None:
+        respuesta = obtener_frase("pidiendo_ubicacion", idioma)
+        memory.registrar_consulta(telefono, texto, respuesta, "menu", idioma, "centros_salud", enviar=enviar)
+        return respuesta
+
+    servicio = sesion.contexto.pop("servicio", None) if sesion.contexto else None
+    cercanos = centros_cercanos(*coordenadas, k=3, servicio=servicio)
+    if not cercanos and servicio:
+        servicio = None
+        cercanos = centros_cercanos(*coordenadas, k=3)
+    respuesta = formatear_centros_cercanos(cercanos, idioma, servicio)
+    sesion.estado = "inicio"
+    adjuntos = []
+    if cercanos and cercanos[0][2].get("coordenadas"):
+        centro = cercanos[0][2]
+        adjuntos.append(WhatsAppService.payload_ubicacion(
+            telefono, *centro["coordenadas"], centro["nombre"], centro["direccion"]
+        ))
+    memory.registrar_consulta(
+        telefono, texto, respuesta, "local", idioma, "centros_salud", enviar=enviar, adjuntos=adjuntos
+    )
+    logger.info(f"Ubicación de {telefono}: {len(cercanos)} centros cercanos (servicio={servicio})")
+    return respuesta
+
+
+def procesar_mensaje(telefono, texto, tipo_mensaje="text", enviar=False):
     """
     Procesa un mensaje entrante y genera la respuesta apropiada.
-    Este es el cerebro del chatbot.
+    Este es el cerebro del chatbot. Con `enviar`, la respuesta se encola
+    para WhatsApp en la misma transacción que su fila del historial.
     """
+    inicio = time.perf_counter()
+    try:
+        return _responder_mensaje(telefono, texto, tipo_mensaje, enviar)
+    finally:
+        LATENCIA_MENSAJE.observar(time.perf_counter() - inicio)
+
+
+def _responder_mensaje(telefono, texto, tipo_mensaje, enviar):
+    # La sesión se obtiene una vez por mensaje; las ramas la modifican directamente
     sesion = session_manager.obtener_sesion(telefono)
-    idioma = sesion["idioma"]
+    idioma = sesion.idioma
+
+    # === Mensajes no soportados (audio, imagen...) ===
+    if tipo_mensaje == "unsupported":
+        respuesta_no_soportado = obtener_frase("no_entiendo", idioma)
+        if enviar:
+            bandeja_salida.encolar(telefono, respuesta_no_soportado)
+        return respuesta_no_soportado
+
     texto_lower = texto.lower().strip()
-    session_manager.incrementar_mensajes(telefono)
+    sesion.mensajes_count += 1
+
+    # === Ubicación compartida: centros más cercanos ===
+    if tipo_mensaje == "location":
+        return procesar_ubicacion(telefono, texto, enviar, sesion)
 
     # === Mensaje de bienvenida para nuevos usuarios ===
-    if session_manager.es_primera_vez(telefono):
-        session_manager.marcar_bienvenida_enviada(telefono)
+    if sesion.primera_vez:
+        sesion.primera_vez = False
         hora = datetime.now().hour
         saludo = obtener_saludo(hora, idioma)
         bienvenida = (
@@ -76,50 +161,57 @@ def procesar_mensaje(telefono, texto, tipo_mensaje="text"):
             f"{obtener_frase('saludo', idioma)}\n\n"
             f"{obtener_frase('menu_principal', idioma)}"
         )
-        memory.registrar_consulta(telefono, texto, bienvenida, "menu", idioma, "bienvenida")
+        memory.registrar_consulta(telefono, texto, bienvenida, "menu", idioma, "bienvenida", enviar=enviar)
         return bienvenida
 
+    # Recordar el servicio pedido por si después comparte su ubicación
+    servicio = detectar_servicio(texto_lower)
+    if servicio:
+        if sesion.contexto is None:
+            sesion.contexto = {}
+        sesion.contexto["servicio"] = servicio
+
     # === Comandos de navegación ===
     if texto_lower in ("menu", "menú", "inicio", "ayuda", "help", "hola", "hi"):
         respuesta_menu = obtener_frase("menu_principal", idioma)
-        memory.registrar_consulta(telefono, texto, respuesta_menu, "menu", idioma, "menu")
+        memory.registrar_consulta(telefono, texto, respuesta_menu, "menu", idioma, "menu", enviar=enviar)
         return respuesta_menu
 
     # Cambio de idioma
     if texto_lower in ("fang", "lengua fang", "en fang", "habla fang", "fang language"):
-        session_manager.actualizar_idioma(telefono, "fang")
+        session_manager.actualizar_idioma(telefono, "fang", sesion)
         respuesta_idioma = (
             obtener_frase("cambio_idioma_fang", "fang")
             + "\n\n"
             + obtener_frase("menu_principal", "fang")
         )
-        memory.registrar_consulta(telefono, texto, respuesta_idioma, "menu", "fang", "idioma")
+        memory.registrar_consulta(telefono, texto, respuesta_idioma, "menu", "fang", "idioma", enviar=enviar)
         return respuesta_idioma
 
     if texto_lower in (
         "español", "espanol", "castellano", "en español",
         "habla español", "spanish",
     ):
-        session_manager.actualizar_idioma(telefono, "es")
+        session_manager.actualizar_idioma(telefono, "es", sesion)
         respuesta_idioma = (
             obtener_frase("cambio_idioma_es", "es")
             + "\n\n"
             + obtener_frase("menu_principal", "es")
         )
-        memory.registrar_consulta(telefono, texto, respuesta_idioma, "menu", "es", "idioma")
+        memory.registrar_consulta(telefono, texto, respuesta_idioma, "menu", "es", "idioma", enviar=enviar)
         return respuesta_idioma
 
     # === Opciones del menú por número ===
     if texto_lower == "1" or texto_lower == "sintomas" or texto_lower == "síntomas":
-        session_manager.actualizar_estado(telefono, "esperando_sintomas")
+        sesion.estado = "esperando_sintomas"
         respuesta_sintomas = obtener_frase("pregunta_sintomas", idioma)
-        memory.registrar_consulta(telefono, texto, respuesta_sintomas, "menu", idioma, "sintomas")
+        memory.registrar_consulta(telefono, texto, respuesta_sintomas, "menu", idioma, "sintomas", enviar=enviar)
         return respuesta_sintomas
 
     if texto_lower == "2" or texto_lower == "centros" or texto_lower == "hospital":
-        session_manager.actualizar_estado(telefono, "esperando_ubicacion")
+        sesion.estado = "esperando_ubicacion"
         respuesta_centros = obtener_frase("pidiendo_ubicacion", idioma)
-        memory.registrar_consulta(telefono, texto, respuesta_centros, "menu", idioma, "centros_salud")
+        memory.registrar_consulta(telefono, texto, respuesta_centros, "menu", idioma, "centros_salud", enviar=enviar)
         return respuesta_centros
 
     if texto_lower == "3" or texto_lower == "enfermedades" or texto_lower == "lista":
@@ -131,12 +223,12 @@ def procesar_mensaje(telefono, texto, tipo_mensaje="text"):
             encabezado = "*Enfermedades comunes en Guinea Ecuatorial:*\n\n"
             pie = "\n\nEscribe el nombre de la enfermedad para más información."
         respuesta_enf = encabezado + lista + pie
-        memory.registrar_consulta(telefono, texto, respuesta_enf, "menu", idioma, "enfermedad")
+        memory.registrar_consulta(telefono, texto, respuesta_enf, "menu", idioma, "enfermedad", enviar=enviar)
         return respuesta_enf
 
     if texto_lower == "4" or texto_lower == "emergencia" or texto_lower == "emergencias":
         respuesta_emerg = formatear_emergencias()
-        memory.registrar_consulta(telefono, texto, respuesta_emerg, "menu", idioma, "emergencia")
+        memory.registrar_consulta(telefono, texto, respuesta_emerg, "menu", idioma, "emergencia", enviar=enviar)
         return respuesta_emerg
 
     if texto_lower == "5" or texto_lower == "idioma":
@@ -158,7 +250,7 @@ def procesar_mensaje(telefono, texto, tipo_mensaje="text"):
                 "- Escribe *español* para español\n"
                 "- Escribe *fang* para fang"
             )
-        memory.registrar_consulta(telefono, texto, respuesta_idioma_menu, "menu", idioma, "idioma")
+        memory.registrar_consulta(telefono, texto, respuesta_idioma_menu, "menu", idioma, "idioma", enviar=enviar)
         return respuesta_idioma_menu
 
     if texto_lower == "6" or texto_lower == "primeros auxilios":
@@ -178,30 +270,30 @@ def procesar_mensaje(telefono, texto, tipo_mensaje="text"):
                 + "\n\n*Diarrea:*\n"
                 + obtener_frase("primeros_auxilios_diarrea", "es")
             )
-        memory.registrar_consulta(telefono, texto, respuesta_pa, "menu", idioma, "primeros_auxilios")
+        memory.registrar_consulta(telefono, texto, respuesta_pa, "menu", idioma, "primeros_auxilios", enviar=enviar)
         return respuesta_pa
 
     if texto_lower == "7" or texto_lower == "constitucion" or texto_lower == "constitución":
         respuesta_const = formatear_resumen_constitucion(idioma)
-        memory.registrar_consulta(telefono, texto, respuesta_const, "menu", idioma, "constitucion")
+        memory.registrar_consulta(telefono, texto, respuesta_const, "menu", idioma, "constitucion", enviar=enviar)
         return respuesta_const
 
     if texto_lower == "8" or texto_lower == "ohada":
         respuesta_ohada = formatear_resumen_ohada(idioma)
-        memory.registrar_consulta(telefono, texto, respuesta_ohada, "menu", idioma, "ohada")
+        memory.registrar_consulta(telefono, texto, respuesta_ohada, "menu", idioma, "ohada", enviar=enviar)
         return respuesta_ohada
 
     if texto_lower == "9" or texto_lower == "historia" or texto_lower == "historia de guinea ecuatorial":
         respuesta_hist = formatear_resumen_historia(idioma)
-        memory.registrar_consulta(telefono, texto, respuesta_hist, "menu", idioma, "historia")
+        memory.registrar_consulta(telefono, texto, respuesta_hist, "menu", idioma, "historia", enviar=enviar)
         return respuesta_hist
 
     # === Consejos periódicos ===
-    if sesion["mensajes_count"] % 5 == 0:
+    if sesion.mensajes_count % 5 == 0:
         consejo = ""
-        if sesion["mensajes_count"] % 10 == 0:
+        if sesion.mensajes_count % 10 == 0:
             consejo = "\n\n---\n" + obtener_frase("consejo_mosquitero", idioma)
-        elif sesion["mensajes_count"] % 15 == 0:
+        elif sesion.mensajes_count % 15 == 0:
             consejo = "\n\n---\n" + obtener_frase("consejo_agua", idioma)
 
     # === Despedida ===
@@ -210,14 +302,99 @@ def procesar_mensaje(telefono, texto, tipo_mensaje="text"):
         "hasta luego", "akeva", "mbolo",
     ):
         respuesta_despedida = obtener_frase("despedida", idioma)
-        memory.registrar_consulta(telefono, texto, respuesta_despedida, "menu", idioma, "despedida")
+        memory.registrar_consulta(telefono, texto, respuesta_despedida, "menu", idioma, "despedida", enviar=enviar)
         return respuesta_despedida
 
     # === Consulta a la IA para todo lo demás ===
-    respuesta = ai_service.generar_respuesta(telefono, texto, idioma)
+    respuesta = ai_service.generar_respuesta(telefono, texto, idioma, enviar)
     return respuesta
 
 
+def atender_mensaje(mensaje_info):
+    """
+    Atiende un mensaje de WhatsApp ya encolado: lo marca como leído,
+    genera la respuesta y la deja en la bandeja de salida, de donde la
+    envía su propio hilo. Se ejecuta en un carril del procesador.
+    """
+    telefono = mensaje_info["telefono"]
+    texto = mensaje_info["texto"]
+    tipo = mensaje_info["tipo"]
+
+    # Marcar como leído
+    whatsapp_service.marcar_como_leido(mensaje_info["message_id"])
+
+    # Procesar y responder (los no soportados reciben el aviso de siempre)
+    procesar_mensaje(telefono, texto, tipo, enviar=True)
+    logger.info(f"Respuesta encolada para {telefono}")
+
+
+procesador = ProcesadorMensajes(atender_mensaje)
+procesador.iniciar()
+# Registrado el último: al apagar se drenan primero los mensajes pendientes
+atexit.register(procesador.detener)
+
+
+def _metricas_servicios():
+    """Contadores que ya llevan los servicios, leídos al consultar /metrics."""
+    cache = ai_service.cache.metricas()
+    coalescencia = ai_service.coalescedor.metricas()
+    cola = procesador.metricas()
+    escritor_datos = escritor.metricas()
+    correccion = ai_service.metricas_correccion()
+    dedup = memory.mensajes_recibidos.metricas()
+    bandeja = bandeja_salida.metricas()
+    return [
+        ("chatbot_cache_respuestas_consultas_total", "counter",
+         "Consultas a la caché de respuestas de OpenAI",
+         [((("resultado", "acierto"),), cache["aciertos"]),
+          ((("resultado", "fallo"),), cache["fallos"])]),
+        ("chatbot_cache_respuestas_tasa_aciertos", "gauge",
+         "Fracción de consultas a la caché de respuestas que acertaron",
+         [((), cache["tasa_aciertos"])]),
+        ("chatbot_cache_respuestas_bytes", "gauge",
+         "Bytes ocupados por la caché de respuestas",
+         [((), cache["bytes"])]),
+        ("chatbot_openai_llamadas_total", "counter",
+         "Llamadas a OpenAI hechas y ahorradas por coalescencia",
+         [((("resultado", "realizada"),), coalescencia["llamadas"]),
+          ((("resultado", "compartida"),), coalescencia["llamadas_ahorradas"])]),
+        ("chatbot_correccion_mensajes_total", "counter",
+         "Mensajes corregidos y resueltos localmente tras corregirlos",
+         [((("resultado", "corregido"),), correccion["mensajes_corregidos"]),
+          ((("resultado", "resuelto_localmente"),), correccion["resueltos_localmente"])]),
+        ("chatbot_webhooks_total", "counter",
+         "Webhooks recibidos: nuevos y reenvíos descartados",
+         [((("resultado", "nuevo"),), dedup["nuevos"]),
+          ((("resultado", "duplicado_memoria"),), dedup["duplicados_memoria"]),
+          ((("resultado", "duplicado_sqlite"),), dedup["duplicados_sqlite"])]),
+        ("chatbot_mensajes_pendientes", "gauge",
+         "Mensajes en cola esperando un carril del procesador",
+         [((), cola["pendientes_total"])]),
+        ("chatbot_bandeja_salida_pendientes", "gauge",
+         "Mensajes de WhatsApp en la bandeja de salida según su estado",
+         [((("estado", "pendiente"),), bandeja["pendientes"]),
+          ((("estado", "enviando"),), bandeja["enviando"]),
+          ((("estado", "fallido"),), bandeja["fallidos_guardados"])]),
+        ("chatbot_bandeja_salida_antiguedad_segundos", "gauge",
+         "Antigüedad del mensaje más viejo aún sin enviar",
+         [((), bandeja["antiguedad_segundos"])]),
+        ("chatbot_bandeja_salida_envios_total", "counter",
+         "Intentos de envío de la bandeja de salida según su resultado",
+         [((("resultado", "enviado"),), bandeja["enviados"]),
+          ((("resultado", "reintento"),), bandeja["reintentos"]),
+          ((("resultado", "fallido"),), bandeja["fallidos"])]),
+        ("chatbot_escritor_cola", "gauge",
+         "Escrituras de aprendizaje pendientes en la cola del escritor",
+         [((), escritor_datos["profundidad_cola"])]),
+        ("chatbot_sesiones_activas", "gauge",
+         "Sesiones de usuario en memoria",
+         [((), session_manager.metricas()["sesiones_activas"])]),
+    ]
+
+
+registro_metricas.agregar_colector(_metricas_servicios)
+
+
 # ==================== Rutas de Flask ====================
 @app.route("/", methods=["GET"])
 def index():
@@ -250,9 +427,11 @@ def recibir_mensaje():
     """
     Recibe mensajes de WhatsApp via webhook de Green API.
     Green API envía JSON con la estructura de notificación.
+    Solo valida y encola: la respuesta se genera en segundo plano para
+    contestar 200 de inmediato y evitar reintentos del proveedor.
     """
     try:
-        data = request.get_json()
+        data = request.get_json(silent=True)
 
         if not data:
             return jsonify({"status": "no data"}), 200
@@ -263,31 +442,21 @@ def recibir_mensaje():
         if not mensaje_info:
             return jsonify({"status": "no message"}), 200
 
-        telefono = mensaje_info["telefono"]
-        texto = mensaje_info["texto"]
+        # Reenvío de un mensaje ya reclamado: 200 sin volver a procesarlo
         message_id = mensaje_info["message_id"]
-        tipo = mensaje_info["tipo"]
-
-        logger.info(f"Mensaje recibido de {telefono}: {texto[:50]}...")
+        if not memory.mensajes_recibidos.reclamar(message_id):
+            return jsonify({"status": "duplicate"}), 200
 
-        # Marcar como leído
-        whatsapp_service.marcar_como_leido(telefono, message_id)
-
-        # No procesar mensajes no soportados
-        if tipo == "unsupported":
-            idioma = session_manager.obtener_idioma(telefono)
-            whatsapp_service.enviar_mensaje(
-                telefono,
-                obtener_frase("no_entiendo", idioma),
-            )
-            return jsonify({"status": "ok"}), 200
+        telefono = mensaje_info["telefono"]
+        logger.info(f"Mensaje recibido de {telefono}: {mensaje_info['texto'][:50]}...")
 
-        # Procesar y responder
-        respuesta = procesar_mensaje(telefono, texto, tipo)
-        whatsapp_service.enviar_mensaje(telefono, respuesta)
+        if not procesador.encolar(telefono, mensaje_info):
+            # Sin capacidad: 503 para que el proveedor reintente más tarde,
+            # y el reenvío no debe tomarse por duplicado
+            memory.mensajes_recibidos.liberar(message_id)
+            return jsonify({"status": "busy"}), 503
 
-        logger.info(f"Respuesta enviada a {telefono}")
-        return jsonify({"status": "ok"}), 200
+        return jsonify({"status": "queued"}), 200
 
     except Exception as e:
         logger.error(f"Error procesando webhook: {e}", exc_info=True)
@@ -758,12 +927,54 @@ def api_stats():
     """Endpoint para ver estadísticas del sistema de aprendizaje."""
     try:
         stats = memory.obtener_estadisticas()
-        return jsonify({"status": "ok", "estadisticas": stats})
+        return jsonify({
+            "status": "ok",
+            "estadisticas": stats,
+            "escritor_aprendizaje": escritor.metricas(),
+            "procesador_mensajes": procesador.metricas(),
+            "cache_respuestas": ai_service.cache.metricas(),
+            "coalescencia_openai": ai_service.coalescedor.metricas(),
+            "historial_conversacion": ai_service.historial.metricas(),
+            "sesiones": session_manager.metricas(),
+            "archivo_historial": memory.archivo.metricas(),
+            "indices_memoria": memory.metricas_indices(),
+            "correccion_ortografica": ai_service.metricas_correccion(),
+            "webhooks_duplicados": memory.mensajes_recibidos.metricas(),
+            "bandeja_salida": bandeja_salida.metricas(),
+        })
     except Exception as e:
         logger.error(f"Error en API stats: {e}", exc_info=True)
         return jsonify({"error": str(e)}), 500
 
 
+@app.route("/metrics", methods=["GET"])
+def metricas_prometheus():
+    """Latencias por etapa, origen de las respuestas y cachés para Prometheus."""
+    try:
+        return Response(
+            registro_metricas.exponer(),
+            content_type="text/plain; version=0.0.4; charset=utf-8",
+        )
+    except Exception as e:
+        logger.error(f"Error generando métricas: {e}", exc_info=True)
+        return Response(f"# error: {e}\n", status=500, mimetype="text/plain")
+
+
+# ==================== Comandos de mantenimiento ====================
+@app.cli.command("reconstruir-estadisticas")
+def reconstruir_estadisticas():
+    """Recalcula los resúmenes de /api/stats desde el historial (flask reconstruir-estadisticas)."""
+    total = memory.reconstruir_estadisticas()
+    print(f"Resúmenes reconstruidos: {total} consultas")
+
+
+@app.cli.command("compactar-vectores")
+def compactar_vectores():
+    """Reescribe los índices vectoriales de la memoria sin filas huérfanas (flask compactar-vectores)."""
+    eliminadas = memory.compactar_vectores()
+    print(f"Índices vectoriales compactados: {eliminadas} filas eliminadas")
+
+
 # ==================== Punto de entrada ====================
 if __name__ == "__main__":
     # Crear directorio data/ para la base de datos de memoria
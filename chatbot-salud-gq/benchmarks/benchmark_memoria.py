@@ -0,0 +1,167 @@
+"""
+Benchmark de la búsqueda en memoria aprendida (KnowledgeMemory.buscar).
+
+Llena una base de datos temporal con preguntas sintéticas y mide, a
+distintos tamaños, cada parte de la búsqueda por separado:
+
+- bm25: recuperación por el índice invertido persistido en SQLite, con su
+  filtro por prefijo y el límite de candidatos por palabra. Su latencia
+  deja de crecer cuando las listas de las palabras frecuentes llegan al
+  límite.
+- exacta: consultas con respuesta cuya mejor coincidencia tiene la misma
+  similitud que la de una búsqueda exhaustiva (sin límite de candidatos).
+- respaldo: la corrección de faltas con el índice vectorial, solo en las
+  consultas sin resultado por BM25 (la mayoría la descarta el filtro de
+  palabras a una falta sin recorrer el índice).
+- buscar: la llamada completa de KnowledgeMemory.buscar().
+
+Uso:
+    python benchmarks/benchmark_memoria.py
+    python benchmarks/benchmark_memoria.py --tamanos 1000,10000,100000
+    python benchmarks/benchmark_memoria.py --candidatos 0   # exhaustiva
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config.settings import MEMORIA_CANDIDATOS_POR_PALABRA  # noqa: E402
+from services.knowledge_memory import KnowledgeMemory, _tokenizar  # noqa: E402
+
+PALABRAS_SALUD = [
+    "malaria", "paludismo", "fiebre", "dolor", "cabeza", "tos", "diarrea",
+    "vomito", "tifoidea", "colera", "dengue", "vih", "sida", "tuberculosis",
+    "anemia", "diabetes", "hipertension", "embarazo", "niño", "bebe",
+    "hospital", "malabo", "bata", "mosquitero", "agua", "vacuna", "tratamiento",
+    "sintomas", "prevenir", "medicina", "pastilla", "sangre", "estomago",
+]
+
+
+def _vocabulario(tamano, semilla):
+    """Vocabulario sintético con palabras de salud y términos aleatorios."""
+    rnd = random.Random(semilla)
+    letras = "abcdefghijklmnopqrstuvwxyz"
+    extra = {
+        "".join(rnd.choice(letras) for _ in range(rnd.randint(4, 10)))
+        for _ in range(tamano)
+    }
+    return PALABRAS_SALUD + sorted(extra)
+
+
+def _pregunta(rnd, vocabulario):
+    """
+    Genera una pregunta de 3 a 7 palabras. El rango de cada palabra sigue
+    una ley de Zipf (exponente 1), como en el lenguaje natural sin stopwords.
+    """
+    palabras = []
+    for _ in range(rnd.randint(3, 7)):
+        # Muestreo inverso de Zipf: rango ~ N ** U
+        indice = min(int(len(vocabulario) ** rnd.random()) - 1, len(vocabulario) - 1)
+        palabras.append(vocabulario[indice])
+    return "¿" + " ".join(palabras) + "?"
+
+
+def _llenar(memoria, desde, hasta, rnd, vocabulario):
+    """Inserta preguntas en bloque usando el mismo camino de indexado que guardar()."""
+    ahora = datetime.now().isoformat()
+    for bloque in range(desde, hasta, 50000):
+        with memoria._db.transaccion() as conn:
+            cursor = conn.cursor()
+            for i in range(bloque, min(bloque + 50000, hasta)):
+                pregunta = _pregunta(rnd, vocabulario)
+                memoria._insertar_conocimiento(
+                    cursor, pregunta, f"Respuesta {i}", "es", "general", ahora, _tokenizar(pregunta)
+                )
+
+
+def _medir(funcion, argumentos):
+    """(latencias en milisegundos, resultados) de llamar a funcion con cada argumento."""
+    tiempos = []
+    resultados = []
+    for argumento in argumentos:
+        inicio = time.perf_counter()
+        resultados.append(funcion(argumento))
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+    return tiempos, resultados
+
+
+def _resumen(tiempos):
+    """media, p50 y p95 en milisegundos (ceros si no hay medidas)."""
+    if not tiempos:
+        return 0.0, 0.0, 0.0
+    tiempos = sorted(tiempos)
+    p95 = tiempos[max(int(len(tiempos) * 0.95) - 1, 0)]
+    return statistics.mean(tiempos), statistics.median(tiempos), p95
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--tamanos", default="1000,10000,100000,1000000")
+    parser.add_argument("--consultas", type=int, default=300)
+    parser.add_argument("--vocabulario", type=int, default=200000)
+    parser.add_argument(
+        "--candidatos", type=int, default=MEMORIA_CANDIDATOS_POR_PALABRA,
+        help="candidatos por palabra (0 = sin límite)",
+    )
+    args = parser.parse_args()
+
+    tamanos = sorted(int(t) for t in args.tamanos.split(","))
+    rnd = random.Random(42)
+    vocabulario = _vocabulario(args.vocabulario, 7)
+
+    with tempfile.TemporaryDirectory() as directorio:
+        ruta = os.path.join(directorio, "benchmark.db")
+        memoria = KnowledgeMemory(db_path=ruta, candidatos_por_palabra=args.candidatos)
+        exhaustiva = KnowledgeMemory(db_path=ruta, candidatos_por_palabra=0)
+        consultas = [_pregunta(random.Random(1000 + i), vocabulario) for i in range(args.consultas)]
+        palabras = [_tokenizar(consulta) for consulta in consultas]
+
+        print(
+            f"{'entradas':>10} | {'bm25 media':>10} {'p50':>6} {'p95':>7} | {'exacta':>7} | "
+            f"{'respaldo n':>10} {'media':>6} {'p95':>6} | {'buscar media':>12} {'p95':>7} | "
+            f"{'llenado s':>9} {'vectores s':>10}"
+        )
+        actual = 0
+        for tamano in tamanos:
+            inicio = time.perf_counter()
+            _llenar(memoria, actual, tamano, rnd, vocabulario)
+            llenado = time.perf_counter() - inicio
+            inicio = time.perf_counter()
+            memoria.actualizar_vectores()
+            vectorizado = time.perf_counter() - inicio
+            actual = tamano
+
+            tiempos_bm25, resultados = _medir(
+                lambda p: memoria._recuperar("conocimiento", p, 0.6, "es"), palabras
+            )
+            _, exactos = _medir(lambda p: exhaustiva._recuperar("conocimiento", p, 0.6, "es"), palabras)
+            con_respuesta = [(r, e) for r, e in zip(resultados, exactos) if e]
+            iguales = sum(bool(r) and r[0][0] >= e[0][0] - 1e-9 for r, e in con_respuesta)
+            sin_resultado = [p for p, r in zip(palabras, resultados) if not r]
+            tiempos_respaldo, _ = _medir(
+                lambda p: memoria._recuperar_vectorial("conocimiento", p, 0.6, "es"), sin_resultado
+            )
+            tiempos_buscar, _ = _medir(lambda c: memoria.buscar(c, "es"), consultas)
+
+            media, p50, p95 = _resumen(tiempos_bm25)
+            media_respaldo, _, p95_respaldo = _resumen(tiempos_respaldo)
+            media_buscar, _, p95_buscar = _resumen(tiempos_buscar)
+            exacta = f"{iguales / len(con_respuesta):.0%}" if con_respuesta else "-"
+            print(
+                f"{tamano:>10} | {media:>10.2f} {p50:>6.2f} {p95:>7.2f} | {exacta:>7} | "
+                f"{len(sin_resultado):>10} {media_respaldo:>6.2f} {p95_respaldo:>6.2f} | "
+                f"{media_buscar:>12.2f} {p95_buscar:>7.2f} | {llenado:>9.1f} {vectorizado:>10.1f}"
+            )
+        exhaustiva.cerrar()
+        memoria.cerrar()
+
+
+if __name__ == "__main__":
+    main()
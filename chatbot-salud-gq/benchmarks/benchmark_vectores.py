@@ -0,0 +1,170 @@
+"""
+Benchmark del índice vectorial de la memoria (IndiceVectorial).
+
+Vectoriza preguntas sintéticas, las añade a un índice en un directorio
+temporal y mide, a distintos tamaños, la latencia de búsqueda (producto
+matriz-vector sobre el mmap + selección de los k mejores) y cuántas
+preguntas con una falta de ortografía recuperan la original en primer lugar.
+
+Antes comprueba, con KnowledgeMemory.buscar() sobre bases temporales, que
+una pregunta sobre otra enfermedad nunca recibe la respuesta guardada
+(hipertensión/hipotensión, anemia/neumonía...) aunque sus n-gramas se
+parezcan, y que las preguntas con una falta sí la reciben. Si algún par
+distinto recibe respuesta, termina con código 1.
+
+Uso:
+    python benchmarks/benchmark_vectores.py
+    python benchmarks/benchmark_vectores.py --tamanos 100000 --dimension 256
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.benchmark_memoria import _pregunta, _vocabulario  # noqa: E402
+from services.indice_vectorial import IndiceVectorial  # noqa: E402
+from services.knowledge_memory import KnowledgeMemory, _tokenizar  # noqa: E402
+from utils.vectores_hash import vectorizar  # noqa: E402
+
+
+# (pregunta guardada, consulta sobre otra enfermedad): nunca deben coincidir
+PARES_DISTINTOS = [
+    ("tratamiento de la gripe", "tratamiento de la vih"),
+    ("sintomas de la hipotension", "sintomas de hipertension"),
+    ("tratamiento de la anemia", "tratamiento de la leucemia"),
+    ("sintomas del hipotiroidismo", "sintomas del hipertiroidismo"),
+    ("sintomas del hipertiroidismo", "sintomas del hipotiroidismo"),
+    ("sintomas de la neumonia", "sintomas de la anemia"),
+    ("sintomas de la anemia", "sintomas de la neumonia"),
+    ("como prevenir el dengue", "como prevenir la tifoidea"),
+    ("como prevenir la tifoidea", "como prevenir el dengue"),
+    ("tratamiento de la neumonia", "tratamiento de la anemia"),
+    ("tratamiento del dengue", "tratamiento de la tifoidea"),
+]
+
+# (pregunta guardada, la misma con una falta): deben coincidir
+PARES_FALTAS = [
+    ("sintomas de la malaria", "sintomas de la malria"),
+    ("como prevenir el paludismo", "como prevenir el paludsmo"),
+    ("tratamiento de la diabetes", "tratamiento de la diabetis"),
+    ("donde esta el hospital de bata", "donde esta el ospital de bata"),
+    ("sintomas de la hipertension", "sintomas de la hipertenson"),
+]
+
+
+def _regresiones():
+    """Busca cada consulta en una memoria que solo contiene su pregunta guardada."""
+    errores = 0
+    print(f"{'guardada':<32} {'consulta':<32} {'esperado':>9} {'obtenido':>9}")
+    for pares, esperado in ((PARES_DISTINTOS, False), (PARES_FALTAS, True)):
+        for guardada, consulta in pares:
+            with tempfile.TemporaryDirectory() as directorio:
+                memoria = KnowledgeMemory(db_path=os.path.join(directorio, "regresion.db"))
+                memoria.guardar(guardada, f"Respuesta sobre: {guardada}")
+                memoria.actualizar_vectores()
+                respuesta, similitud = memoria.buscar(consulta)
+                memoria.cerrar()
+            obtenido = respuesta is not None
+            errores += obtenido and not esperado
+            print(
+                f"{guardada:<32} {consulta:<32} {'sí' if esperado else 'no':>9} "
+                f"{f'sí {similitud:.2f}' if obtenido else 'no':>9}"
+                f"{'' if obtenido == esperado else '   <-'}"
+            )
+    return errores
+
+
+def _con_falta(rnd, pregunta):
+    """Cambia, quita o duplica una letra de una palabra de la pregunta."""
+    palabras = sorted(_tokenizar(pregunta))
+    i = rnd.randrange(len(palabras))
+    palabra = palabras[i]
+    j = rnd.randrange(len(palabra))
+    operacion = rnd.choice(("cambiar", "quitar", "duplicar"))
+    if operacion == "cambiar":
+        palabra = palabra[:j] + rnd.choice("abcdefghijklmnopqrstuvwxyz") + palabra[j + 1:]
+    elif operacion == "quitar" and len(palabra) > 3:
+        palabra = palabra[:j] + palabra[j + 1:]
+    else:
+        palabra = palabra[:j] + palabra[j] + palabra[j:]
+    palabras[i] = palabra
+    return set(palabras)
+
+
+def _llenar(indice, desde, hasta, rnd, vocabulario, preguntas):
+    """Añade preguntas en bloques, igual que la sincronización de KnowledgeMemory."""
+    vacio = np.zeros(indice.dimension, dtype=np.float32)
+    for bloque in range(desde, hasta, 5000):
+        ids = list(range(bloque + 1, min(bloque + 5000, hasta) + 1))
+        vectores = []
+        for _ in ids:
+            pregunta = _pregunta(rnd, vocabulario)
+            preguntas.append(pregunta)
+            vector = vectorizar(_tokenizar(pregunta), indice.dimension)
+            vectores.append(vacio if vector is None else vector)
+        indice.agregar(ids, np.vstack(vectores))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--tamanos", default="100000,1000000")
+    parser.add_argument("--consultas", type=int, default=200)
+    parser.add_argument("--dimension", type=int, default=128)
+    parser.add_argument("--vocabulario", type=int, default=200000)
+    args = parser.parse_args()
+
+    errores = _regresiones()
+    if errores:
+        print(f"\n{errores} preguntas sobre otra enfermedad recibieron la respuesta guardada")
+        sys.exit(1)
+    print()
+
+    tamanos = sorted(int(t) for t in args.tamanos.split(","))
+    rnd = random.Random(42)
+    vocabulario = _vocabulario(args.vocabulario, 7)
+    preguntas = []
+
+    with tempfile.TemporaryDirectory() as directorio:
+        indice = IndiceVectorial(directorio, "benchmark", args.dimension)
+        print(
+            f"{'vectores':>10} {'MB disco':>9} {'media ms':>9} {'p50 ms':>8} "
+            f"{'p95 ms':>8} {'top1 faltas':>12} {'llenado s':>10}"
+        )
+        actual = 0
+        for tamano in tamanos:
+            inicio = time.perf_counter()
+            _llenar(indice, actual, tamano, rnd, vocabulario, preguntas)
+            llenado = time.perf_counter() - inicio
+            actual = tamano
+
+            rnd_consultas = random.Random(tamano)
+            tiempos = []
+            aciertos = 0
+            for _ in range(args.consultas):
+                reg_id = rnd_consultas.randrange(tamano) + 1
+                vector = vectorizar(_con_falta(rnd_consultas, preguntas[reg_id - 1]), args.dimension)
+                inicio = time.perf_counter()
+                resultados = indice.buscar(vector, 10)
+                tiempos.append((time.perf_counter() - inicio) * 1000)
+                aciertos += bool(resultados) and resultados[0][0] == reg_id
+
+            tiempos.sort()
+            p95 = tiempos[int(len(tiempos) * 0.95) - 1]
+            megas = indice.metricas()["bytes_disco"] / 1e6
+            print(
+                f"{tamano:>10} {megas:>9.0f} {statistics.mean(tiempos):>9.2f} "
+                f"{statistics.median(tiempos):>8.2f} {p95:>8.2f} "
+                f"{aciertos / args.consultas:>12.1%} {llenado:>10.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Benchmark de envío a WhatsApp contra el proveedor simulado (sin red).
+
+Compara mensajes por segundo entre `requests.post` sin sesión (una conexión
+nueva por envío, como antes), el transporte compartido síncrono y, si `httpx`
+está instalado, el transporte asíncrono.
+
+Uso:
+    python benchmarks/benchmark_whatsapp.py --mensajes 2000 --hilos 16
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests  # noqa: E402
+
+from benchmarks.stub_whatsapp import iniciar_proveedor  # noqa: E402
+from services.transporte_http import (  # noqa: E402
+    LimitadorTokens,
+    TransporteHTTP,
+    TransporteHTTPAsync,
+    httpx,
+)
+from services.whatsapp_service import WhatsAppService  # noqa: E402
+
+
+def _payload(i):
+    return {
+        "messaging_product": "whatsapp",
+        "recipient_type": "individual",
+        "to": f"240222{i % 1000:06d}",
+        "type": "text",
+        "text": {"preview_url": False, "body": f"Mensaje de prueba {i}"},
+    }
+
+
+def _medir_hilos(enviar, mensajes, hilos):
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=hilos) as pool:
+        list(pool.map(enviar, range(mensajes)))
+    return mensajes / (time.perf_counter() - inicio)
+
+
+async def _medir_async(transporte, url, mensajes, concurrencia):
+    semaforo = asyncio.Semaphore(concurrencia)
+
+    async def enviar(i):
+        async with semaforo:
+            response = await transporte.post(url, _payload(i))
+            response.raise_for_status()
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(enviar(i) for i in range(mensajes)))
+    await transporte.cerrar()
+    return mensajes / (time.perf_counter() - inicio)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de envío a WhatsApp")
+    parser.add_argument("--mensajes", type=int, default=2000)
+    parser.add_argument("--hilos", type=int, default=16)
+    parser.add_argument("--latencia-ms", type=float, default=5)
+    parser.add_argument("--latencia-conexion-ms", type=float, default=50,
+                        help="coste simulado de abrir conexión (handshake TLS)")
+    parser.add_argument("--tasa-error", type=float, default=0.0)
+    parser.add_argument("--limite", type=float, default=0, help="mensajes/s del limitador (0 = sin límite)")
+    args = parser.parse_args()
+
+    proveedor = iniciar_proveedor(
+        latencia=args.latencia_ms / 1000,
+        tasa_error=args.tasa_error,
+        latencia_conexion=args.latencia_conexion_ms / 1000,
+    )
+    url = f"{proveedor.url}/123456/messages"
+    print(f"Proveedor simulado en {proveedor.url} "
+          f"(latencia {args.latencia_ms} ms, conexión {args.latencia_conexion_ms} ms)")
+
+    def medir(nombre, tasa):
+        print(f"{nombre:<30}{tasa:8.0f} mensajes/s  ({proveedor.conexiones} conexiones)")
+        proveedor.conexiones = 0
+
+    def sin_pool(i):
+        requests.post(url, json=_payload(i), timeout=30)
+
+    medir("requests.post sin sesión:", _medir_hilos(sin_pool, args.mensajes, args.hilos))
+
+    servicio = WhatsAppService(
+        transporte=TransporteHTTP(limitador=LimitadorTokens(args.limite), backoff=0.01),
+        api_url=url,
+    )
+    medir("WhatsAppService + transporte:", _medir_hilos(
+        lambda i: servicio.enviar_mensaje(_payload(i)["to"], f"Mensaje {i}"),
+        args.mensajes, args.hilos,
+    ))
+    servicio.cerrar()
+
+    if httpx is not None:
+        transporte = TransporteHTTPAsync(limitador=LimitadorTokens(args.limite), backoff=0.01)
+        medir("Transporte asíncrono (httpx):",
+              asyncio.run(_medir_async(transporte, url, args.mensajes, args.hilos)))
+    else:
+        print("Transporte asíncrono: omitido (instalar httpx)")
+
+    print(f"Errores simulados y reintentados: {proveedor.errores_simulados}")
+    proveedor.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,424 @@
+"""
+Prueba de carga del chatbot completo sin conexión.
+
+Genera conversaciones realistas (menú, síntomas, enfermedades, texto libre,
+botones, listas y ubicaciones, en español y en fang) con la forma de los
+webhooks que procesa `WhatsAppService.extraer_mensaje`, y las envía con la
+concurrencia indicada contra `/webhook` y `/api/chat` de la aplicación
+real, servida en este mismo proceso. OpenAI y la API de WhatsApp se
+sustituyen por los simuladores de benchmarks/ (latencia configurable) y la
+base de datos es temporal.
+
+Cada usuario simulado espera la respuesta antes de enviar su siguiente
+mensaje. En /webhook la latencia va desde el POST hasta que el proveedor
+simulado recibe el primer mensaje de respuesta para ese teléfono (cola,
+procesamiento y envío; con streaming, el primer párrafo), y el usuario no
+escribe de nuevo hasta que la respuesta está completa: registrada en el
+historial y sin partes pendientes en la bandeja de salida. En /api/chat es
+la duración de la petición.
+
+El informe da p50/p95/p99, mensajes por segundo, tiempo de SQLite, la
+mezcla de fuentes de las respuestas y la media por etapa. Con --max-p95-ms
+el script termina con código 1 si algún modo supera ese p95.
+
+Uso:
+    python benchmarks/carga_webhook.py
+    python benchmarks/carga_webhook.py --mensajes 5000 --concurrencia 32 --latencia-openai-ms 600
+    python benchmarks/carga_webhook.py --modo chat --max-p95-ms 800
+    OPENAI_STREAMING=false python benchmarks/carga_webhook.py --por-token-openai-ms 20
+"""
+
+import argparse
+import atexit
+import logging
+import math
+import os
+import queue
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests  # noqa: E402
+
+from benchmarks.stub_openai import iniciar_openai  # noqa: E402
+from benchmarks.stub_whatsapp import iniciar_proveedor  # noqa: E402
+
+# ==================== Mensajes de los usuarios simulados ====================
+
+MENU = ["hola", "menu", "1", "2", "3", "4", "6", "7", "8", "9", "gracias"]
+SINTOMAS = {
+    "es": [
+        "tengo fiebre y dolor de cabeza",
+        "mi hijo tiene diarrea y vomito desde ayer",
+        "tos con sangre y cansancio",
+        "dolor de barriga y fiebre alta",
+        "tengo mareo y mucha debilidad",
+    ],
+    "fang": [
+        "efie ne a yem nlo",
+        "moan a ne nsus nnam",
+        "ekos ne meyon",
+        "evu a yem, efie",
+    ],
+}
+ENFERMEDADES = ["paludismo", "malaria", "tifoidea", "dengue", "colera", "tuberculosis", "vih"]
+TEXTO_LIBRE = {
+    "es": [
+        "que puedo comer si estoy embarazada",
+        "cada cuanto hay que vacunar a un bebe",
+        "es normal dormir mal despues de la malaria",
+        "como se lava bien el agua para beber",
+        "puedo tomar paracetamol con el estomago vacio",
+        "que hago si me pica un mosquito de noche",
+        "cuanto dura la recuperacion de una operacion",
+    ],
+    "fang": [
+        "me ne minga a ne evu, ye me dia bikalá",
+        "moan a ke elan ya",
+        "biyón bi ne mbemba",
+    ],
+}
+CIUDADES = [(3.752, 8.774), (1.864, 9.766), (2.160, 11.330), (1.627, 11.316), (3.456, 8.554)]
+BOTONES = ["1", "2", "3", "4"]
+LISTAS = ["5", "6", "7", "8", "9"]
+
+
+def _mensaje(rnd, idioma):
+    """(tipo, contenido) de un mensaje con la mezcla de un día normal."""
+    tirada = rnd.random()
+    if tirada < 0.25:
+        return "text", rnd.choice(MENU)
+    if tirada < 0.45:
+        return "text", rnd.choice(SINTOMAS[idioma])
+    if tirada < 0.60:
+        return "text", rnd.choice(["que es el ", "sintomas del ", ""]) + rnd.choice(ENFERMEDADES)
+    if tirada < 0.85:
+        return "text", rnd.choice(TEXTO_LIBRE[idioma])
+    if tirada < 0.90:
+        return "button", rnd.choice(BOTONES)
+    if tirada < 0.94:
+        return "list", rnd.choice(LISTAS)
+    latitud, longitud = rnd.choice(CIUDADES)
+    return "location", (latitud + rnd.uniform(-0.05, 0.05), longitud + rnd.uniform(-0.05, 0.05))
+
+
+def generar_conversaciones(usuarios, mensajes, semilla, prefijo):
+    """[(telefono, [(tipo, contenido)])]: un 20% de los usuarios habla fang."""
+    rnd = random.Random(semilla)
+    conversaciones = []
+    por_usuario = max(1, mensajes // usuarios)
+    for i in range(usuarios):
+        idioma = "fang" if rnd.random() < 0.2 else "es"
+        lista = [("text", "fang")] if idioma == "fang" else []
+        while len(lista) < por_usuario:
+            lista.append(_mensaje(rnd, idioma))
+        conversaciones.append((f"{prefijo}{i:06d}", lista))
+    return conversaciones
+
+
+def payload_webhook(telefono, numero, tipo, contenido):
+    """Notificación de la Cloud API con un mensaje del tipo indicado."""
+    mensaje = {"from": telefono, "id": f"wamid.carga.{telefono}.{numero}", "type": "text"}
+    if tipo == "text":
+        mensaje["text"] = {"body": contenido}
+    elif tipo == "button":
+        mensaje["type"] = "interactive"
+        mensaje["interactive"] = {"type": "button_reply", "button_reply": {"id": contenido, "title": contenido}}
+    elif tipo == "list":
+        mensaje["type"] = "interactive"
+        mensaje["interactive"] = {"type": "list_reply", "list_reply": {"id": contenido, "title": contenido}}
+    else:
+        latitud, longitud = contenido
+        mensaje["type"] = "location"
+        mensaje["location"] = {"latitude": latitud, "longitude": longitud}
+    return {"entry": [{"changes": [{"value": {"messages": [mensaje]}}]}]}
+
+
+# ==================== Ejecución ====================
+
+def servir(aplicacion, hilos):
+    """
+    Sirve la app con un grupo fijo de hilos, como el worker gthread de
+    gunicorn. El servidor de desarrollo con threaded=True crea un hilo por
+    petición, y cada hilo nuevo abre su propia conexión SQLite.
+    """
+    from werkzeug.serving import BaseWSGIServer
+
+    class ServidorConPool(BaseWSGIServer):
+        multithread = True  # HTTP/1.1 con keep-alive
+
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.pool = ThreadPoolExecutor(hilos, thread_name_prefix="app")
+
+        def process_request(self, request, client_address):
+            self.pool.submit(self._atender, request, client_address)
+
+        def _atender(self, request, client_address):
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    servidor = ServidorConPool("127.0.0.1", 0, aplicacion)
+    threading.Thread(target=servidor.serve_forever, name="app", daemon=True).start()
+    return servidor
+
+
+class EsperaRespuestas:
+    """Avisa al usuario simulado cuando el proveedor recibe su respuesta."""
+
+    def __init__(self, proveedor, db_path):
+        self._eventos = {}
+        self._lock = threading.Lock()
+        self._db_path = db_path
+        self._conexiones = threading.local()
+        proveedor.suscribir(self._recibido)
+
+    def preparar(self, telefono):
+        evento = threading.Event()
+        with self._lock:
+            self._eventos[telefono] = evento
+        return evento
+
+    def _recibido(self, payload, instante):
+        # Los acuses de lectura no llevan destinatario; la ubicación del
+        # centro más cercano llega después de su texto
+        if payload.get("type") != "text":
+            return
+        with self._lock:
+            evento = self._eventos.pop(payload.get("to"), None)
+        if evento is not None:
+            evento.instante = instante
+            evento.set()
+
+    def esperar_fin(self, telefono, consultas, timeout=30):
+        """
+        Espera a que el teléfono tenga `consultas` filas en el historial y
+        nada pendiente en la bandeja de salida, para que las últimas partes
+        de una respuesta no se tomen por la respuesta al mensaje siguiente.
+        """
+        conn = getattr(self._conexiones, "conn", None)
+        if conn is None:
+            conn = self._conexiones.conn = sqlite3.connect(self._db_path, timeout=30)
+        limite = time.perf_counter() + timeout
+        while time.perf_counter() < limite:
+            registradas, pendientes = conn.execute(
+                """SELECT (SELECT COUNT(*) FROM historial_consultas WHERE user_id = ?),
+                          (SELECT COUNT(*) FROM bandeja_salida WHERE telefono = ? AND estado != 'fallido')""",
+                (telefono, telefono),
+            ).fetchone()
+            if registradas >= consultas and not pendientes:
+                return True
+            time.sleep(0.005)
+        return False
+
+
+def ejecutar(modo, url, conversaciones, concurrencia, espera):
+    """Lanza los usuarios y devuelve (latencias en s, duración, errores)."""
+    pendientes = queue.Queue()
+    for conversacion in conversaciones:
+        pendientes.put(conversacion)
+    latencias = []
+    errores = [0]
+    lock = threading.Lock()
+
+    def usuario_simulado():
+        sesion = requests.Session()
+        while True:
+            try:
+                telefono, mensajes = pendientes.get_nowait()
+            except queue.Empty:
+                return
+            for numero, (tipo, contenido) in enumerate(mensajes):
+                try:
+                    inicio = time.perf_counter()
+                    if modo == "webhook":
+                        evento = espera.preparar(telefono)
+                        respuesta = sesion.post(
+                            f"{url}/webhook", json=payload_webhook(telefono, numero, tipo, contenido), timeout=30
+                        )
+                        respuesta.raise_for_status()
+                        if not evento.wait(60):
+                            raise TimeoutError(f"Sin respuesta para {telefono}")
+                        latencia = evento.instante - inicio
+                        if not espera.esperar_fin(telefono, numero + 1):
+                            raise TimeoutError(f"Respuesta incompleta para {telefono}")
+                    else:
+                        if tipo == "location":
+                            continue  # /api/chat solo recibe texto
+                        respuesta = sesion.post(
+                            f"{url}/api/chat", json={"mensaje": contenido, "telefono": telefono}, timeout=60
+                        )
+                        respuesta.raise_for_status()
+                        latencia = time.perf_counter() - inicio
+                    with lock:
+                        latencias.append(latencia)
+                except Exception as e:
+                    with lock:
+                        errores[0] += 1
+                    print(f"  error ({modo}, {telefono}): {e}")
+
+    inicio = time.perf_counter()
+    hilos = [threading.Thread(target=usuario_simulado) for _ in range(concurrencia)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    return latencias, time.perf_counter() - inicio, errores[0]
+
+
+def _percentil(valores, p):
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    return ordenados[max(0, math.ceil(p * len(ordenados)) - 1)]
+
+
+def _instantanea(metricas, openai):
+    """Copia de los contadores que se comparan antes y después de cada modo."""
+    _, sqlite_suma, sqlite_total = metricas.LATENCIA_SQLITE.instantanea()
+    return {
+        "sqlite": (sqlite_suma, sqlite_total),
+        "fuentes": {f: metricas.RESPUESTAS_POR_FUENTE.hijo(f).valor for f in metricas.FUENTES},
+        "etapas": {e: metricas.LATENCIA_ETAPAS.hijo(e).instantanea()[1:] for e in metricas.ETAPAS},
+        "openai": openai.llamadas,
+        "primer_fragmento": metricas.LATENCIA_PRIMER_FRAGMENTO.instantanea()[1:],
+        "prompt": metricas.TOKENS_PROMPT.instantanea()[1:],
+        "prompt_sin_ajustar": metricas.TOKENS_PROMPT_SIN_AJUSTAR.instantanea()[1:],
+    }
+
+
+def informe(modo, latencias, duracion, errores, antes, despues, concurrencia):
+    n = len(latencias)
+    print(f"\n== {modo}: {n} mensajes, {concurrencia} usuarios concurrentes")
+    print(f"mensajes/s     {n / duracion:9.1f}    errores {errores}")
+    print(
+        "latencia ms    "
+        f"p50 {_percentil(latencias, 0.50) * 1000:8.1f}   "
+        f"p95 {_percentil(latencias, 0.95) * 1000:8.1f}   "
+        f"p99 {_percentil(latencias, 0.99) * 1000:8.1f}   "
+        f"max {max(latencias, default=0) * 1000:8.1f}"
+    )
+    suma = despues["sqlite"][0] - antes["sqlite"][0]
+    sentencias = despues["sqlite"][1] - antes["sqlite"][1]
+    if sentencias:
+        print(
+            f"SQLite         {sentencias} sentencias, {suma * 1000 / max(n, 1):.2f} ms por mensaje, "
+            f"{suma * 1e6 / sentencias:.0f} µs de media"
+        )
+    etapas = []
+    for etapa, (suma_antes, total_antes) in antes["etapas"].items():
+        suma_despues, total_despues = despues["etapas"][etapa]
+        if total_despues > total_antes:
+            media = (suma_despues - suma_antes) / (total_despues - total_antes)
+            etapas.append(f"{etapa} {media * 1000:.2f}")
+    print(f"etapas ms      {', '.join(etapas)}")
+    fuentes = {f: despues["fuentes"][f] - antes["fuentes"][f] for f in despues["fuentes"]}
+    fuentes["menu/otros"] = max(0, n - sum(fuentes.values()))
+    mezcla = ", ".join(f"{f} {v / max(n, 1):.0%}" for f, v in fuentes.items() if v)
+    print(f"fuentes        {mezcla}")
+    print(f"OpenAI         {despues['openai'] - antes['openai']} llamadas al simulador")
+    suma_antes, total_antes = antes["primer_fragmento"]
+    suma_despues, total_despues = despues["primer_fragmento"]
+    if total_despues > total_antes:
+        total = total_despues - total_antes
+        print(
+            f"streaming      primer fragmento en {(suma_despues - suma_antes) * 1000 / total:.1f} ms "
+            f"de media ({total} respuestas)"
+        )
+    suma_antes, total_antes = antes["prompt"]
+    suma_despues, total_despues = despues["prompt"]
+    if total_despues > total_antes:
+        total = total_despues - total_antes
+        sin_ajustar = despues["prompt_sin_ajustar"][0] - antes["prompt_sin_ajustar"][0]
+        print(
+            f"prompt         {(suma_despues - suma_antes) / total:.0f} tokens de media "
+            f"({sin_ajustar / total:.0f} sin presupuesto)"
+        )
+    return _percentil(latencias, 0.95)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--modo", choices=("webhook", "chat", "ambos"), default="ambos")
+    parser.add_argument("--mensajes", type=int, default=2000)
+    parser.add_argument("--usuarios", type=int, default=200)
+    parser.add_argument("--concurrencia", type=int, default=16)
+    parser.add_argument("--hilos-servidor", type=int, default=32)
+    parser.add_argument("--latencia-openai-ms", type=float, default=400)
+    parser.add_argument("--variacion-openai-ms", type=float, default=100)
+    parser.add_argument("--por-token-openai-ms", type=float, default=0, help="ritmo de generación simulado")
+    parser.add_argument("--latencia-whatsapp-ms", type=float, default=20)
+    parser.add_argument("--semilla", type=int, default=7)
+    parser.add_argument("--max-p95-ms", type=float, default=0, help="falla si algún p95 lo supera (0 = no comprobar)")
+    args = parser.parse_args()
+
+    openai = iniciar_openai(
+        latencia=args.latencia_openai_ms / 1000,
+        variacion=args.variacion_openai_ms / 1000,
+        por_token=args.por_token_openai_ms / 1000,
+    )
+    proveedor = iniciar_proveedor(latencia=args.latencia_whatsapp_ms / 1000)
+
+    directorio = tempfile.mkdtemp(prefix="carga-chatbot-")
+    # Registrado antes de importar la app: atexit lo ejecuta después de sus cierres
+    atexit.register(shutil.rmtree, directorio, True)
+    os.environ.update({
+        "OPENAI_API_KEY": "sk-simulado",
+        "OPENAI_BASE_URL": openai.url,
+        "WHATSAPP_API_URL": proveedor.url,
+        "WHATSAPP_PHONE_NUMBER_ID": "123456",
+        "WHATSAPP_TOKEN": "simulado",
+        "WHATSAPP_MENSAJES_POR_SEGUNDO": "0",
+        "MEMORIA_DB_PATH": os.path.join(directorio, "chatbot_memoria.db"),
+        "LOG_LEVEL": "WARNING",
+        "LOG_FILE": os.path.join(directorio, "chatbot.log"),
+    })
+
+    # La configuración se lee al importar, así que la app se importa aquí
+    import app as aplicacion
+    from services import metricas
+
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+
+    servidor = servir(aplicacion.app, max(args.hilos_servidor, args.concurrencia))
+    url = f"http://127.0.0.1:{servidor.server_port}"
+    espera = EsperaRespuestas(proveedor, os.environ["MEMORIA_DB_PATH"])
+    print(
+        f"App en {url} | OpenAI simulado {args.latencia_openai_ms:.0f}±{args.variacion_openai_ms:.0f} ms | "
+        f"WhatsApp simulado {args.latencia_whatsapp_ms:.0f} ms"
+    )
+
+    modos = ("webhook", "chat") if args.modo == "ambos" else (args.modo,)
+    peor_p95 = 0.0
+    for indice, modo in enumerate(modos):
+        # Teléfonos distintos en cada modo: todas las sesiones empiezan de cero
+        conversaciones = generar_conversaciones(
+            args.usuarios, args.mensajes, args.semilla + indice, f"2409{indice}"
+        )
+        antes = _instantanea(metricas, openai)
+        latencias, duracion, errores = ejecutar(modo, url, conversaciones, args.concurrencia, espera)
+        despues = _instantanea(metricas, openai)
+        p95 = informe(modo, latencias, duracion, errores, antes, despues, args.concurrencia)
+        peor_p95 = max(peor_p95, p95)
+
+    servidor.shutdown()
+    openai.shutdown()
+    proveedor.shutdown()
+    if args.max_p95_ms and peor_p95 * 1000 > args.max_p95_ms:
+        print(f"\np95 {peor_p95 * 1000:.1f} ms supera el máximo de {args.max_p95_ms:.0f} ms")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
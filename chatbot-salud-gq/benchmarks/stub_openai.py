@@ -0,0 +1,192 @@
+"""
+API de OpenAI simulada para pruebas y benchmarks sin conexión.
+
+Acepta POST en /v1/chat/completions como la API real y responde, tras una
+latencia configurable (media más variación aleatoria), con una respuesta
+de varios párrafos que repite el último mensaje del usuario. `por_token`
+simula el ritmo de generación: sin streaming se espera a que termine y con
+`"stream": true` los trozos se envían como eventos SSE a ese ritmo, y con
+`cortar_tras` el stream se corta tras ese número de trozos, como si se
+cayera la conexión. Cuenta
+las llamadas y los tokens aproximados del prompt para poder compararlos
+entre ejecuciones.
+
+Uso:
+    python benchmarks/stub_openai.py --puerto 8089 --latencia-ms 400 --variacion-ms 200 --por-token-ms 20
+"""
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class OpenAISimulado(ThreadingHTTPServer):
+    """Servidor HTTP que imita el endpoint de chat completions."""
+
+    daemon_threads = True
+
+    def __init__(self, direccion, latencia=0.0, variacion=0.0, por_token=0.0, cortar_tras=None):
+        super().__init__(direccion, _Manejador)
+        self.latencia = latencia
+        self.variacion = variacion
+        self.por_token = por_token
+        self.cortar_tras = cortar_tras
+        self.lock = threading.Lock()
+        self.llamadas = 0
+        self.caracteres_prompt = 0
+
+    @property
+    def url(self):
+        host, puerto = self.server_address[:2]
+        return f"http://{host}:{puerto}/v1"
+
+    def esperar(self):
+        """Duerme la latencia simulada hasta el primer token."""
+        retardo = self.latencia + random.uniform(-self.variacion, self.variacion)
+        if retardo > 0:
+            time.sleep(retardo)
+
+
+class _Manejador(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        longitud = int(self.headers.get("Content-Length", 0))
+        try:
+            peticion = json.loads(self.rfile.read(longitud) or b"{}")
+        except ValueError:
+            self._responder(400, {"error": {"message": "JSON inválido"}})
+            return
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._responder(404, {"error": {"message": f"Ruta no simulada: {self.path}"}})
+            return
+
+        mensajes = peticion.get("messages", [])
+        prompt = sum(len(m.get("content") or "") for m in mensajes)
+        pregunta = next(
+            (m.get("content", "") for m in reversed(mensajes) if m.get("role") == "user"), ""
+        )
+        with self.server.lock:
+            self.server.llamadas += 1
+            self.server.caracteres_prompt += prompt
+            numero = self.server.llamadas
+        self.server.esperar()
+
+        contenido = (
+            f"Respuesta simulada sobre: {pregunta[:80]}. Es una consulta frecuente "
+            "y conviene seguir unas pautas sencillas mientras se observa la evolución.\n\n"
+            "Recomendaciones:\n"
+            "- Beba abundante agua potable o hervida.\n"
+            "- Descanse y vigile la temperatura cada pocas horas.\n"
+            "- Duerma bajo mosquitero para evitar nuevas picaduras.\n\n"
+            "Si los síntomas continúan, acuda al centro de salud más cercano."
+        )
+        # Trozos del tamaño aproximado de un token: palabra con su espacio
+        tokens = re.findall(r"\S+\s*|\s+", contenido)
+        uso = {
+            # Aproximación habitual: unos 4 caracteres por token
+            "prompt_tokens": prompt // 4,
+            "completion_tokens": len(contenido) // 4,
+            "total_tokens": (prompt + len(contenido)) // 4,
+        }
+        if peticion.get("stream"):
+            self._responder_stream(numero, peticion, tokens, uso)
+            return
+
+        if self.server.por_token:
+            time.sleep(self.server.por_token * len(tokens))
+        self._responder(200, {
+            "id": f"chatcmpl-simulado-{numero}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": peticion.get("model", "simulado"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": contenido},
+                "finish_reason": "stop",
+            }],
+            "usage": uso,
+        })
+
+    def _responder_stream(self, numero, peticion, tokens, uso):
+        """Eventos SSE con un trozo por token, en codificación chunked."""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        base = {
+            "id": f"chatcmpl-simulado-{numero}",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": peticion.get("model", "simulado"),
+        }
+        deltas = [{"role": "assistant", "content": ""}] + [{"content": t} for t in tokens]
+        for i, delta in enumerate(deltas):
+            if self.server.cortar_tras is not None and i > self.server.cortar_tras:
+                # Sin [DONE] ni trozo final: el cliente ve la conexión cerrada
+                self.close_connection = True
+                return
+            if i and self.server.por_token:
+                time.sleep(self.server.por_token)
+            self._escribir_evento(dict(base, choices=[{"index": 0, "delta": delta, "finish_reason": None}]))
+        self._escribir_evento(dict(base, choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}]))
+        if (peticion.get("stream_options") or {}).get("include_usage"):
+            # Como la API real: un último evento sin choices con el consumo
+            self._escribir_evento(dict(base, choices=[], usage=uso))
+        self._escribir_trozo(b"data: [DONE]\n\n")
+        self._escribir_trozo(b"")
+
+    def _escribir_evento(self, datos):
+        self._escribir_trozo(f"data: {json.dumps(datos)}\n\n".encode("utf-8"))
+
+    def _escribir_trozo(self, datos):
+        self.wfile.write(f"{len(datos):x}\r\n".encode("ascii") + datos + b"\r\n")
+        self.wfile.flush()
+
+    def _responder(self, estado, datos):
+        cuerpo = json.dumps(datos).encode("utf-8")
+        self.send_response(estado)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def log_message(self, formato, *args):
+        pass  # Silencioso durante los benchmarks
+
+
+def iniciar_openai(puerto=0, latencia=0.0, variacion=0.0, por_token=0.0, cortar_tras=None):
+    """Arranca la API simulada en un hilo y la devuelve."""
+    servidor = OpenAISimulado(("127.0.0.1", puerto), latencia, variacion, por_token, cortar_tras)
+    hilo = threading.Thread(target=servidor.serve_forever, name="stub-openai", daemon=True)
+    hilo.start()
+    return servidor
+
+
+def main():
+    parser = argparse.ArgumentParser(description="API de OpenAI simulada")
+    parser.add_argument("--puerto", type=int, default=8089)
+    parser.add_argument("--latencia-ms", type=float, default=400)
+    parser.add_argument("--variacion-ms", type=float, default=0)
+    parser.add_argument("--por-token-ms", type=float, default=0)
+    parser.add_argument("--cortar-tras", type=int, default=None,
+                        help="trozos del stream antes de cortar la conexión")
+    args = parser.parse_args()
+
+    servidor = OpenAISimulado(
+        ("127.0.0.1", args.puerto), args.latencia_ms / 1000, args.variacion_ms / 1000,
+        args.por_token_ms / 1000, args.cortar_tras,
+    )
+    print(f"OpenAI simulado escuchando en {servidor.url}")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        servidor.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+Proveedor de WhatsApp simulado para pruebas y benchmarks sin conexión.
+
+Acepta POST en /<phone_number_id>/messages como la Cloud API de Meta,
+con latencia configurable y una tasa opcional de errores 429/500 para
+ejercitar los reintentos. Guarda cada mensaje recibido.
+
+`latencia_conexion` se paga una vez por conexión TCP nueva y simula el
+coste del handshake TLS contra el proveedor real, que es lo que ahorra
+reutilizar conexiones.
+
+Uso:
+    python benchmarks/stub_whatsapp.py --puerto 8088 --latencia-ms 50 --latencia-conexion-ms 100
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class ProveedorSimulado(ThreadingHTTPServer):
+    """Servidor HTTP que imita el endpoint de envío de mensajes."""
+
+    daemon_threads = True
+
+    def __init__(self, direccion, latencia=0.0, tasa_error=0.0, latencia_conexion=0.0):
+        super().__init__(direccion, _Manejador)
+        self.latencia = latencia
+        self.latencia_conexion = latencia_conexion
+        self.conexiones = 0
+        self.tasa_error = tasa_error
+        self.lock = threading.Lock()
+        self.recibidos = []
+        self.errores_simulados = 0
+        self._suscriptores = []
+
+    @property
+    def url(self):
+        host, puerto = self.server_address[:2]
+        return f"http://{host}:{puerto}"
+
+    def suscribir(self, funcion):
+        """Registra funcion(payload, instante) para cada mensaje aceptado."""
+        self._suscriptores.append(funcion)
+
+    def registrar(self, payload):
+        instante = time.perf_counter()
+        with self.lock:
+            self.recibidos.append((instante, payload))
+        for funcion in self._suscriptores:
+            funcion(payload, instante)
+
+
+class _Manejador(BaseHTTPRequestHandler):
+    # HTTP/1.1 para que los clientes puedan reutilizar la conexión
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.conexiones += 1
+        if self.server.latencia_conexion:
+            time.sleep(self.server.latencia_conexion)
+
+    def do_POST(self):
+        longitud = int(self.headers.get("Content-Length", 0))
+        cuerpo = self.rfile.read(longitud)
+        if self.server.latencia:
+            time.sleep(self.server.latencia)
+
+        if self.server.tasa_error and random.random() < self.server.tasa_error:
+            with self.server.lock:
+                self.server.errores_simulados += 1
+            self._responder(random.choice((429, 500)), {"error": {"message": "simulado"}})
+            return
+
+        try:
+            payload = json.loads(cuerpo or b"{}")
+        except ValueError:
+            self._responder(400, {"error": {"message": "JSON inválido"}})
+            return
+        self.server.registrar(payload)
+        self._responder(200, {
+            "messaging_product": "whatsapp",
+            "messages": [{"id": f"wamid.simulado.{len(self.server.recibidos)}"}],
+        })
+
+    def _responder(self, estado, datos):
+        cuerpo = json.dumps(datos).encode("utf-8")
+        self.send_response(estado)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def log_message(self, formato, *args):
+        pass  # Silencioso durante los benchmarks
+
+
+def iniciar_proveedor(puerto=0, latencia=0.0, tasa_error=0.0, latencia_conexion=0.0):
+    """Arranca el proveedor simulado en un hilo y lo devuelve."""
+    servidor = ProveedorSimulado(("127.0.0.1", puerto), latencia, tasa_error, latencia_conexion)
+    hilo = threading.Thread(target=servidor.serve_forever, name="stub-whatsapp", daemon=True)
+    hilo.start()
+    return servidor
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Proveedor de WhatsApp simulado")
+    parser.add_argument("--puerto", type=int, default=8088)
+    parser.add_argument("--latencia-ms", type=float, default=0)
+    parser.add_argument("--tasa-error", type=float, default=0)
+    parser.add_argument("--latencia-conexion-ms", type=float, default=0)
+    args = parser.parse_args()
+
+    servidor = ProveedorSimulado(
+        ("127.0.0.1", args.puerto),
+        args.latencia_ms / 1000,
+        args.tasa_error,
+        args.latencia_conexion_ms / 1000,
+    )
+    print(f"Proveedor simulado escuchando en {servidor.url}")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        servidor.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -11,9 +11,43 @@ load_dotenv()
 GREEN_API_INSTANCE_ID = os.getenv("GREEN_API_INSTANCE_ID", "")
 GREEN_API_TOKEN = os.getenv("GREEN_API_TOKEN", "")
 
+# ==================== WhatsApp Cloud API (Meta) ====================
+WHATSAPP_TOKEN = os.getenv("WHATSAPP_TOKEN", "")
+WHATSAPP_PHONE_NUMBER_ID = os.getenv("WHATSAPP_PHONE_NUMBER_ID", "")
+WHATSAPP_API_URL = os.getenv("WHATSAPP_API_URL", "https://graph.facebook.com/v21.0")
+
+# Transporte HTTP: pool keep-alive, reintentos y cuota de envío
+WHATSAPP_POOL_CONEXIONES = int(os.getenv("WHATSAPP_POOL_CONEXIONES", "20"))
+WHATSAPP_REINTENTOS = int(os.getenv("WHATSAPP_REINTENTOS", "3"))
+WHATSAPP_BACKOFF_SEGUNDOS = float(os.getenv("WHATSAPP_BACKOFF_SEGUNDOS", "0.5"))
+WHATSAPP_MENSAJES_POR_SEGUNDO = float(os.getenv("WHATSAPP_MENSAJES_POR_SEGUNDO", "80"))
+WHATSAPP_RAFAGA = int(os.getenv("WHATSAPP_RAFAGA", "80"))
+WHATSAPP_TIMEOUT_CONEXION = float(os.getenv("WHATSAPP_TIMEOUT_CONEXION", "5"))
+WHATSAPP_TIMEOUT_LECTURA = float(os.getenv("WHATSAPP_TIMEOUT_LECTURA", "30"))
+
+# Bandeja de salida: las respuestas se guardan en SQLite junto al historial
+# y un hilo las envía en lotes, reintentando con espera exponencial
+BANDEJA_TAMANO_LOTE = int(os.getenv("BANDEJA_TAMANO_LOTE", "50"))
+BANDEJA_HILOS_ENVIO = int(os.getenv("BANDEJA_HILOS_ENVIO", "8"))
+BANDEJA_INTERVALO_SEGUNDOS = float(os.getenv("BANDEJA_INTERVALO_SEGUNDOS", "1.0"))
+BANDEJA_MAX_INTENTOS = int(os.getenv("BANDEJA_MAX_INTENTOS", "8"))
+BANDEJA_ESPERA_BASE_SEGUNDOS = float(os.getenv("BANDEJA_ESPERA_BASE_SEGUNDOS", "2"))
+BANDEJA_ESPERA_MAX_SEGUNDOS = float(os.getenv("BANDEJA_ESPERA_MAX_SEGUNDOS", "300"))
+# Un envío reclamado por un proceso que murió se reintenta pasado este tiempo
+BANDEJA_RECLAMO_SEGUNDOS = float(os.getenv("BANDEJA_RECLAMO_SEGUNDOS", "120"))
+
 # ==================== OpenAI API ====================
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+# Vacío = API oficial. Permite apuntar a un proxy o al simulador de benchmarks
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "")
+# Respuestas por WhatsApp en streaming: cada párrafo completo se envía ya,
+# en fragmentos de al menos estos caracteres
+OPENAI_STREAMING = os.getenv("OPENAI_STREAMING", "True").lower() == "true"
+OPENAI_STREAMING_MIN_CARACTERES = int(os.getenv("OPENAI_STREAMING_MIN_CARACTERES", "120"))
+# Tokens máximos del prompt (instrucciones, contexto, historial y pregunta);
+# si no cabe todo se recortan o descartan primero los bloques menos relevantes
+PROMPT_MAX_TOKENS = int(os.getenv("PROMPT_MAX_TOKENS", "1500"))
 
 # ==================== Servidor ====================
 FLASK_HOST = os.getenv("FLASK_HOST", "0.0.0.0")
@@ -26,6 +60,82 @@ BOT_NAME = "Asistente de Salud GQ"
 BOT_NAME_FANG = "Asistente ya Salud GQ"
 DEFAULT_LANGUAGE = "es"
 SESSION_TIMEOUT_MINUTES = 30
+# Resolución de la rueda de tiempo que caduca las sesiones
+SESIONES_GRANULARIDAD_SEGUNDOS = int(os.getenv("SESIONES_GRANULARIDAD_SEGUNDOS", "60"))
+
+# ==================== Base de datos (SQLite) ====================
+# NORMAL es seguro en modo WAL: solo se pierde la última transacción
+# ante un corte de luz, nunca se corrompe la base de datos.
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL").upper()
+# Vacío = data/chatbot_memoria.db dentro del proyecto
+MEMORIA_DB_PATH = os.getenv("MEMORIA_DB_PATH", "")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_CACHE_SENTENCIAS = int(os.getenv("SQLITE_CACHE_SENTENCIAS", "256"))
+# Registros que aporta como máximo cada palabra de la consulta a los
+# candidatos de la memoria (a cada lado de su longitud): las listas de las
+# palabras muy frecuentes no se recorren enteras y la búsqueda no crece con
+# el tamaño de la base de datos. 0 = sin límite (búsqueda exhaustiva)
+MEMORIA_CANDIDATOS_POR_PALABRA = int(os.getenv("MEMORIA_CANDIDATOS_POR_PALABRA", "500"))
+
+# ==================== Escritor de aprendizaje ====================
+# Las escrituras de aprendizaje se confirman en lotes en segundo plano
+ESCRITOR_TAMANO_LOTE = int(os.getenv("ESCRITOR_TAMANO_LOTE", "50"))
+ESCRITOR_INTERVALO_SEGUNDOS = float(os.getenv("ESCRITOR_INTERVALO_SEGUNDOS", "1.0"))
+ESCRITOR_MAX_COLA = int(os.getenv("ESCRITOR_MAX_COLA", "10000"))
+
+# ==================== Procesamiento de mensajes ====================
+# Hilos que atienden mensajes en paralelo (un carril FIFO por hilo)
+MENSAJES_WORKERS = int(os.getenv("MENSAJES_WORKERS", "8"))
+MENSAJES_MAX_PENDIENTES = int(os.getenv("MENSAJES_MAX_PENDIENTES", "1000"))
+MENSAJES_DRENADO_SEGUNDOS = float(os.getenv("MENSAJES_DRENADO_SEGUNDOS", "30"))
+# Reenvíos del mismo webhook: cuánto se recuerda cada message_id y
+# cuántos se guardan en memoria antes de consultar SQLite
+MENSAJES_DEDUP_TTL_HORAS = float(os.getenv("MENSAJES_DEDUP_TTL_HORAS", "72"))
+MENSAJES_DEDUP_MAX_MEMORIA = int(os.getenv("MENSAJES_DEDUP_MAX_MEMORIA", "100000"))
+
+# ==================== Caché de respuestas de IA ====================
+# Respuestas de OpenAI reutilizables para preguntas repetidas
+CACHE_RESPUESTAS_TTL_SEGUNDOS = int(os.getenv("CACHE_RESPUESTAS_TTL_SEGUNDOS", "21600"))
+CACHE_RESPUESTAS_MAX_BYTES = int(os.getenv("CACHE_RESPUESTAS_MAX_BYTES", str(16 * 1024 * 1024)))
+CACHE_RESPUESTAS_CATEGORIAS_EXCLUIDAS = [
+    c.strip()
+    for c in os.getenv("CACHE_RESPUESTAS_CATEGORIAS_EXCLUIDAS", "emergencia").split(",")
+    if c.strip()
+]
+
+# Peticiones idénticas simultáneas a OpenAI comparten una sola llamada;
+# los demás esperan como máximo estos segundos
+COALESCENCIA_TIMEOUT_SEGUNDOS = float(os.getenv("COALESCENCIA_TIMEOUT_SEGUNDOS", "60"))
+
+# ==================== Historial de conversación ====================
+# Últimos turnos por usuario en RAM (LRU); el resto se recupera de SQLite
+HISTORIAL_TURNOS = int(os.getenv("HISTORIAL_TURNOS", "3"))
+HISTORIAL_MAX_USUARIOS = int(os.getenv("HISTORIAL_MAX_USUARIOS", "5000"))
+HISTORIAL_MAX_BYTES = int(os.getenv("HISTORIAL_MAX_BYTES", str(32 * 1024 * 1024)))
+# Turnos más antiguos que se conservan resumidos (una línea cada uno)
+HISTORIAL_RESUMEN_TURNOS = int(os.getenv("HISTORIAL_RESUMEN_TURNOS", "6"))
+
+# ==================== Archivo del historial de consultas ====================
+# Meses que se conservan en SQLite; los anteriores pasan a data/archivo/
+# como JSONL comprimido (0 desactiva el archivado)
+HISTORIAL_MESES_ACTIVOS = int(os.getenv("HISTORIAL_MESES_ACTIVOS", "3"))
+HISTORIAL_ARCHIVO_DIR = os.getenv("HISTORIAL_ARCHIVO_DIR", "")
+HISTORIAL_MANTENIMIENTO_HORAS = float(os.getenv("HISTORIAL_MANTENIMIENTO_HORAS", "6"))
+HISTORIAL_VACUUM_PAGINAS = int(os.getenv("HISTORIAL_VACUUM_PAGINAS", "1000"))
+
+# ==================== Índice vectorial de la memoria ====================
+# Vectores de n-gramas de caracteres (sin red) para encontrar preguntas
+# aprendidas escritas con faltas o variantes; dimensión 0 lo desactiva.
+# Cada búsqueda recorre todo el índice (~6 ms por 100k registros), así que
+# solo se hace si una palabra desconocida está a una falta de otra guardada
+MEMORIA_VECTORES_DIMENSION = int(os.getenv("MEMORIA_VECTORES_DIMENSION", "128"))
+# Coseno mínimo de un candidato. Solo sirve para corregir faltas de la
+# consulta: la respuesta se acepta por similitud de palabras, nunca por coseno
+MEMORIA_VECTORES_UMBRAL = float(os.getenv("MEMORIA_VECTORES_UMBRAL", "0.75"))
+MEMORIA_VECTORES_DIR = os.getenv("MEMORIA_VECTORES_DIR", "")
+MEMORIA_VECTORES_COMPACTAR_HORAS = float(os.getenv("MEMORIA_VECTORES_COMPACTAR_HORAS", "24"))
+# Cada cuánto añade un hilo de fondo los registros nuevos al índice
+MEMORIA_VECTORES_INTERVALO_SEGUNDOS = float(os.getenv("MEMORIA_VECTORES_INTERVALO_SEGUNDOS", "10"))
 
 # ==================== Prompt del sistema para la IA ====================
 SYSTEM_PROMPT = """Eres un asistente virtual especializado para Guinea Ecuatorial.
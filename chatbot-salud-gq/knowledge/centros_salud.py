@@ -1,8 +1,14 @@
 """
 Directorio de centros de salud de Guinea Ecuatorial por región.
 Datos basados en la estructura del sistema sanitario nacional.
+Las coordenadas (latitud, longitud) son aproximadas, a nivel de barrio, y
+alimentan el índice espacial que responde a las ubicaciones compartidas.
 """
 
+from utils.aho_corasick import detectar_grupo, registrar_palabras_clave
+from utils.arbol_kd import ArbolKD
+from utils.symspell import registrar_vocabulario
+
 CENTROS_SALUD = {
     # ===================== REGIÓN INSULAR =====================
     "malabo": {
@@ -13,6 +19,7 @@ CENTROS_SALUD = {
                 "nombre": "Hospital Regional de Malabo",
                 "tipo": "Hospital Regional",
                 "direccion": "Malabo Centro, Bioko Norte",
+                "coordenadas": (3.7491, 8.7785),
                 "telefono": "+240 333 09 24 00",
                 "servicios": [
                     "Urgencias 24h", "Medicina Interna", "Cirugía",
@@ -26,6 +33,7 @@ CENTROS_SALUD = {
                 "nombre": "Hospital La Paz",
                 "tipo": "Hospital Privado",
                 "direccion": "Barrio de Ela Nguema, Malabo",
+                "coordenadas": (3.7332, 8.8006),
                 "telefono": "+240 333 09 33 50",
                 "servicios": [
                     "Consulta General", "Especialidades",
@@ -38,6 +46,7 @@ CENTROS_SALUD = {
                 "nombre": "Centro de Salud de Ela Nguema",
                 "tipo": "Centro de Salud",
                 "direccion": "Barrio Ela Nguema, Malabo",
+                "coordenadas": (3.7347, 8.7985),
                 "telefono": "+240 222 XXX XXX",
                 "servicios": [
                     "Consulta General", "Vacunación",
@@ -51,6 +60,7 @@ CENTROS_SALUD = {
                 "nombre": "Centro de Salud de Semu",
                 "tipo": "Centro de Salud",
                 "direccion": "Barrio Semu, Malabo",
+                "coordenadas": (3.7401, 8.7662),
                 "telefono": "+240 222 XXX XXX",
                 "servicios": [
                     "Consulta General", "Vacunación",
@@ -63,6 +73,7 @@ CENTROS_SALUD = {
                 "nombre": "Centro de Salud de New Building",
                 "tipo": "Centro de Salud",
                 "direccion": "Barrio New Building, Malabo",
+                "coordenadas": (3.7439, 8.7718),
                 "telefono": "+240 222 XXX XXX",
                 "servicios": [
                     "Consulta General", "Vacunación",
@@ -75,6 +86,7 @@ CENTROS_SALUD = {
                 "nombre": "Centro de Control del VIH/SIDA",
                 "tipo": "Centro Especializado",
                 "direccion": "Malabo Centro",
+                "coordenadas": (3.7518, 8.7769),
                 "telefono": "+240 333 09 XX XX",
                 "servicios": [
                     "Pruebas de VIH (confidencial y gratuito)",
@@ -94,6 +106,7 @@ CENTROS_SALUD = {
                 "nombre": "Hospital Distrital de Luba",
                 "tipo": "Hospital Distrital",
                 "direccion": "Luba, Bioko Sur",
+                "coordenadas": (3.4568, 8.5547),
                 "telefono": "+240 333 XX XX XX",
                 "servicios": [
                     "Urgencias", "Consulta General", "Maternidad",
@@ -113,6 +126,7 @@ CENTROS_SALUD = {
                 "nombre": "Hospital Regional de Bata",
                 "tipo": "Hospital Regional",
                 "direccion": "Bata Centro, Litoral",
+                "coordenadas": (1.8478, 9.7702),
                 "telefono": "+240 333 08 22 00",
                 "servicios": [
                     "Urgencias 24h", "Medicina Interna", "Cirugía",
@@ -126,6 +140,7 @@ CENTROS_SALUD = {
                 "nombre": "Hospital Virgen de Guadalupe",
                 "tipo": "Hospital Misionero",
                 "direccion": "Bata, Litoral",
+                "coordenadas": (1.8617, 9.7695),
                 "telefono": "+240 333 08 XX XX",
                 "servicios": [
                     "Consulta General", "Maternidad",
@@ -138,6 +153,7 @@ CENTROS_SALUD = {
                 "nombre": "Centro de Salud de Bata Comandachina",
                 "tipo": "Centro de Salud",
                 "direccion": "Barrio Comandachina, Bata",
+                "coordenadas": (1.8569, 9.7761),
                 "telefono": "+240 222 XXX XXX",
                 "servicios": [
                     "Consulta General", "Vacunación",
@@ -151,6 +167,7 @@ CENTROS_SALUD = {
                 "nombre": "Centro de Salud de Bata Mondoasi",
                 "tipo": "Centro de Salud",
                 "direccion": "Barrio Mondoasi, Bata",
+                "coordenadas": (1.8402, 9.7779),
                 "telefono": "+240 222 XXX XXX",
                 "servicios": [
                     "Consulta General", "Vacunación",
@@ -163,6 +180,7 @@ CENTROS_SALUD = {
                 "nombre": "Centro de Control del VIH/SIDA Bata",
                 "tipo": "Centro Especializado",
                 "direccion": "Bata Centro",
+                "coordenadas": (1.8631, 9.7679),
                 "telefono": "+240 333 08 XX XX",
                 "servicios": [
                     "Pruebas de VIH (confidencial y gratuito)",
@@ -182,6 +200,7 @@ CENTROS_SALUD = {
                 "nombre": "Hospital Distrital de Ebebiyín",
                 "tipo": "Hospital Distrital",
                 "direccion": "Ebebiyín, Kie-Ntem",
+                "coordenadas": (2.1539, 11.3298),
                 "telefono": "+240 333 XX XX XX",
                 "servicios": [
                     "Urgencias", "Consulta General", "Maternidad",
@@ -194,6 +213,7 @@ CENTROS_SALUD = {
                 "nombre": "Centro de Salud de Ebebiyín",
                 "tipo": "Centro de Salud",
                 "direccion": "Ebebiyín Centro",
+                "coordenadas": (2.1508, 11.3357),
                 "telefono": "+240 222 XXX XXX",
                 "servicios": [
                     "Consulta General", "Vacunación",
@@ -212,6 +232,7 @@ CENTROS_SALUD = {
                 "nombre": "Hospital Distrital de Mongomo",
                 "tipo": "Hospital Distrital",
                 "direccion": "Mongomo, Wele-Nzas",
+                "coordenadas": (1.6302, 11.3141),
                 "telefono": "+240 333 XX XX XX",
                 "servicios": [
                     "Urgencias", "Consulta General", "Maternidad",
@@ -230,6 +251,7 @@ CENTROS_SALUD = {
                 "nombre": "Hospital Distrital de Evinayong",
                 "tipo": "Hospital Distrital",
                 "direccion": "Evinayong, Centro-Sur",
+                "coordenadas": (1.4378, 10.5669),
                 "telefono": "+240 333 XX XX XX",
                 "servicios": [
                     "Urgencias", "Consulta General", "Maternidad",
@@ -248,6 +270,7 @@ CENTROS_SALUD = {
                 "nombre": "Centro de Salud de Aconibe",
                 "tipo": "Centro de Salud",
                 "direccion": "Aconibe, Wele-Nzas",
+                "coordenadas": (1.2969, 10.9372),
                 "telefono": "+240 222 XXX XXX",
                 "servicios": [
                     "Consulta General", "Vacunación",
@@ -266,6 +289,7 @@ CENTROS_SALUD = {
                 "nombre": "Centro de Salud de Annobón",
                 "tipo": "Centro de Salud",
                 "direccion": "San Antonio de Palé, Annobón",
+                "coordenadas": (-1.4071, 5.6329),
                 "telefono": "+240 222 XXX XXX",
                 "servicios": [
                     "Consulta General", "Maternidad básica",
@@ -285,6 +309,7 @@ CENTROS_SALUD = {
                 "nombre": "Puestos de Salud Rurales",
                 "tipo": "Puesto de Salud",
                 "direccion": "Distribuidos en poblados de la región continental",
+                "coordenadas": None,  # sin ubicación fija
                 "telefono": "Contactar al jefe del poblado",
                 "servicios": [
                     "Primeros auxilios", "Distribución de mosquiteros",
@@ -302,6 +327,7 @@ CENTROS_SALUD = {
                 "nombre": "Agentes Comunitarios de Salud",
                 "tipo": "Servicio Comunitario",
                 "direccion": "Poblados de las provincias continentales",
+                "coordenadas": None,  # sin ubicación fija
                 "telefono": "Contactar al jefe del poblado o delegación sanitaria",
                 "servicios": [
                     "Pruebas rápidas de malaria",
@@ -339,6 +365,14 @@ EMERGENCIAS = {
 }
 
 
+# Vocabulario para corregir faltas: ciudades y regiones
+registrar_vocabulario(
+    texto
+    for clave, zona in CENTROS_SALUD.items()
+    for texto in (clave, zona["region"], zona["nombre_fang"])
+)
+
+
 def buscar_centros(ubicacion):
     """Busca centros de salud por ubicación."""
     ubicacion = ubicacion.lower().strip()
@@ -355,6 +389,80 @@ def buscar_centros(ubicacion):
     return resultados
 
 
+# Servicios por los que se puede filtrar: palabras que los identifican tanto
+# en el mensaje del usuario como en la lista de servicios de cada centro
+SERVICIOS_CENTROS = {
+    "maternidad": ["maternidad", "parto", "dar a luz", "embaraz"],
+    "urgencias": ["urgencia"],
+    "pediatria": ["pediatr"],
+    "vih": ["vih", "sida", "antirretroviral"],
+    "laboratorio": ["laboratorio", "análisis", "analisis"],
+    "farmacia": ["farmacia"],
+    "vacunacion": ["vacuna"],
+    "radiologia": ["radiolog", "rayos x", "radiograf"],
+    "cirugia": ["cirug", "operación", "operacion"],
+}
+
+registrar_palabras_clave("servicio_centro", SERVICIOS_CENTROS)
+
+
+def _servicios_ofrecidos(centro):
+    texto = " ".join(centro["servicios"]).lower()
+    return frozenset(
+        servicio
+        for servicio, palabras in SERVICIOS_CENTROS.items()
+        if any(palabra in texto for palabra in palabras)
+    )
+
+
+def _construir_indice_centros():
+    """Árbol k-d con los centros que tienen ubicación fija."""
+    puntos = []
+    for clave, zona in CENTROS_SALUD.items():
+        for centro in zona["centros"]:
+            if centro.get("coordenadas"):
+                latitud, longitud = centro["coordenadas"]
+                puntos.append((latitud, longitud, (clave, centro, _servicios_ofrecidos(centro))))
+    return ArbolKD(puntos)
+
+
+_INDICE_CENTROS = _construir_indice_centros()
+
+
+def detectar_servicio(texto):
+    """Servicio de SERVICIOS_CENTROS mencionado en el texto, o None."""
+    servicios = detectar_grupo(texto, "servicio_centro")
+    return servicios[0] if servicios else None
+
+
+def centros_cercanos(latitud, longitud, k=3, servicio=None):
+    """
+    Los k centros más cercanos a unas coordenadas, opcionalmente solo los
+    que ofrecen un servicio. Retorna [(distancia_km, clave_zona, centro)].
+    """
+    filtro = None
+    if servicio:
+        filtro = lambda valor: servicio in valor[2]  # noqa: E731
+    return [
+        (distancia, clave, centro)
+        for distancia, _, (clave, centro, _) in _INDICE_CENTROS.cercanos(latitud, longitud, k, filtro)
+    ]
+
+
+def formatear_centros_cercanos(cercanos, idioma="es", servicio=None):
+    """Formatea los centros más cercanos con su distancia."""
+    if idioma == "fang":
+        texto = "*Centros ya salud (kilómetros):*\n\n"
+    elif servicio:
+        texto = f"*Centros de salud más cercanos con {servicio}:*\n\n"
+    else:
+        texto = "*Centros de salud más cercanos:*\n\n"
+    for i, (distancia, _, centro) in enumerate(cercanos, 1):
+        texto += f"{i}. ({distancia:.1f} km) " + formatear_centro(centro) + "\n"
+    texto += formatear_emergencias()
+    return texto
+
+
 def obtener_centro_mas_cercano(ubicacion):
     """Retorna los centros de salud de una ubicación específica."""
     resultados = buscar_centros(ubicacion)
@@ -3,6 +3,8 @@ Conocimiento sobre la Constitución de Guinea Ecuatorial.
 Ley Fundamental reformada en 2012.
 """
 
+from utils.aho_corasick import detectar_grupo, registrar_palabras_clave
+
 CONSTITUCION = {
     "informacion_general": {
         "titulo": "Constitución de la República de Guinea Ecuatorial",
@@ -144,46 +146,43 @@ CONSTITUCION = {
 }
 
 
-def buscar_constitucion(texto):
-    """Busca información constitucional relevante según el texto."""
-    texto = texto.lower().strip()
-    resultados = []
+# Palabras clave por sección (se registran en el detector compartido)
+PALABRAS_CLAVE_CONSTITUCION = {
+    "informacion_general": ["constitución", "constitucion", "ley fundamental", "ley suprema", "reforma"],
+    "estructura": ["estructura", "títulos", "titulos", "artículos", "articulos", "organización"],
+    "derechos_fundamentales": [
+        "derecho", "derechos", "deber", "deberes", "libertad", "igualdad",
+        "educación", "educacion", "salud", "trabajo", "expresión", "expresion",
+        "religión", "religion", "propiedad",
+    ],
+    "poder_ejecutivo": [
+        "presidente", "ejecutivo", "gobierno", "ministro", "primer ministro",
+        "vicepresidente", "jefe de estado", "fuerzas armadas",
+    ],
+    "poder_legislativo": [
+        "legislativo", "parlamento", "cámara", "camara", "diputado", "senado",
+        "senador", "ley", "leyes", "presupuesto",
+    ],
+    "poder_judicial": [
+        "judicial", "justicia", "tribunal", "juez", "jueces", "supremo",
+        "constitucional", "cuentas", "consuetudinario",
+    ],
+    "organizacion_territorial": [
+        "territorio", "territorial", "región", "region", "distrito", "capital",
+        "malabo", "oyala", "insular", "continental", "municipio",
+    ],
+    "simbolos_nacionales": [
+        "símbolo", "simbolo", "bandera", "escudo", "himno", "lema",
+        "idioma oficial", "moneda", "franco", "ceiba",
+    ],
+}
 
-    keywords_map = {
-        "informacion_general": ["constitución", "constitucion", "ley fundamental", "ley suprema", "reforma"],
-        "estructura": ["estructura", "títulos", "titulos", "artículos", "articulos", "organización"],
-        "derechos_fundamentales": [
-            "derecho", "derechos", "deber", "deberes", "libertad", "igualdad",
-            "educación", "educacion", "salud", "trabajo", "expresión", "expresion",
-            "religión", "religion", "propiedad",
-        ],
-        "poder_ejecutivo": [
-            "presidente", "ejecutivo", "gobierno", "ministro", "primer ministro",
-            "vicepresidente", "jefe de estado", "fuerzas armadas",
-        ],
-        "poder_legislativo": [
-            "legislativo", "parlamento", "cámara", "camara", "diputado", "senado",
-            "senador", "ley", "leyes", "presupuesto",
-        ],
-        "poder_judicial": [
-            "judicial", "justicia", "tribunal", "juez", "jueces", "supremo",
-            "constitucional", "cuentas", "consuetudinario",
-        ],
-        "organizacion_territorial": [
-            "territorio", "territorial", "región", "region", "distrito", "capital",
-            "malabo", "oyala", "insular", "continental", "municipio",
-        ],
-        "simbolos_nacionales": [
-            "símbolo", "simbolo", "bandera", "escudo", "himno", "lema",
-            "idioma oficial", "moneda", "franco", "ceiba",
-        ],
-    }
+registrar_palabras_clave("constitucion", PALABRAS_CLAVE_CONSTITUCION)
 
-    for seccion, keywords in keywords_map.items():
-        if any(kw in texto for kw in keywords):
-            resultados.append(seccion)
 
-    return resultados
+def buscar_constitucion(texto):
+    """Busca información constitucional relevante según el texto."""
+    return detectar_grupo(texto, "constitucion")
 
 
 def formatear_constitucion(secciones, idioma="es"):
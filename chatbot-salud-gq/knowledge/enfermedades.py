@@ -3,6 +3,11 @@ Base de conocimiento: Enfermedades prevalentes en Guinea Ecuatorial.
 Fuentes: OMS, Ministerio de Sanidad y Bienestar Social de GQ.
 """
 
+from bisect import bisect_right
+from functools import lru_cache
+
+from utils.symspell import registrar_vocabulario
+
 ENFERMEDADES = {
     "malaria": {
         "nombre_es": "Malaria (Paludismo)",
@@ -519,42 +524,101 @@ CATEGORIAS = {
 }
 
 
-def buscar_enfermedad(texto):
-    """Busca enfermedades que coincidan con el texto del usuario."""
-    texto = texto.lower().strip()
-    resultados = []
+# ==================== Índices de búsqueda ====================
+# Se construyen una vez al importar. Mantienen la semántica de la búsqueda
+# original (subcadenas en minúsculas) pero sin recorrer todas las
+# enfermedades en cada consulta.
+
 
+def _construir_indice_nombres():
+    """
+    Une clave, nombres (es/fang) y síntomas de cada enfermedad en un solo
+    texto separado por '\x00', con el desplazamiento donde empieza cada una.
+    """
+    partes, inicios, claves = [], [], []
+    desplazamiento = 0
+    longitud_maxima = 0
     for clave, enfermedad in ENFERMEDADES.items():
-        nombre_es = enfermedad["nombre_es"].lower()
-        nombre_fang = enfermedad["nombre_fang"].lower()
+        campos = [clave, enfermedad["nombre_es"], enfermedad["nombre_fang"]]
+        campos += enfermedad["sintomas_es"]
+        campos = [c.lower() for c in campos]
+        longitud_maxima = max(longitud_maxima, *(len(c) for c in campos))
+        bloque = "\x00".join(campos) + "\x00"
+        inicios.append(desplazamiento)
+        claves.append(clave)
+        partes.append(bloque)
+        desplazamiento += len(bloque)
+    return "".join(partes), inicios, claves, longitud_maxima
 
-        if (
-            texto in clave
-            or texto in nombre_es
-            or texto in nombre_fang
-            or any(texto in s.lower() for s in enfermedad["sintomas_es"])
-        ):
-            resultados.append((clave, enfermedad))
 
-    return resultados
+def _construir_indice_sintomas():
+    """
+    Cada subcadena de 4+ letras de las palabras de los síntomas apunta a las
+    enfermedades que la contienen, con su peso (1 por palabra coincidente).
+    """
+    indice = {}
+    for orden, (clave, enfermedad) in enumerate(ENFERMEDADES.items()):
+        for token in " ".join(enfermedad["sintomas_es"]).lower().split():
+            for inicio in range(len(token)):
+                for fin in range(inicio + 4, len(token) + 1):
+                    indice.setdefault(token[inicio:fin], {})[clave] = orden
+    return {sub: tuple(claves.items()) for sub, claves in indice.items()}
 
 
-def buscar_por_sintomas(sintomas_texto):
-    """Busca enfermedades que coincidan con una lista de síntomas."""
-    palabras = sintomas_texto.lower().split()
+_TEXTO_NOMBRES, _INICIOS_NOMBRES, _CLAVES_NOMBRES, _LONGITUD_MAXIMA = _construir_indice_nombres()
+_INDICE_SINTOMAS = _construir_indice_sintomas()
+
+# Vocabulario para corregir faltas: nombres (es/fang) y síntomas
+registrar_vocabulario(
+    texto
+    for clave, enfermedad in ENFERMEDADES.items()
+    for texto in (
+        [clave, enfermedad["nombre_es"], enfermedad["nombre_fang"]]
+        + enfermedad["sintomas_es"]
+        + enfermedad.get("sintomas_fang", [])
+    )
+)
+
+
+@lru_cache(maxsize=1024)
+def _claves_por_texto(texto):
+    if not texto:
+        return tuple(ENFERMEDADES)
+    # Un texto más largo que cualquier campo no puede estar contenido en él
+    if len(texto) > _LONGITUD_MAXIMA or "\x00" in texto:
+        return ()
+    claves = []
+    posicion = _TEXTO_NOMBRES.find(texto)
+    while posicion != -1:
+        indice = bisect_right(_INICIOS_NOMBRES, posicion) - 1
+        claves.append(_CLAVES_NOMBRES[indice])
+        if indice + 1 == len(_INICIOS_NOMBRES):
+            break
+        # Saltar al bloque de la siguiente enfermedad
+        posicion = _TEXTO_NOMBRES.find(texto, _INICIOS_NOMBRES[indice + 1])
+    return tuple(claves)
+
+
+@lru_cache(maxsize=1024)
+def _claves_por_sintomas(palabras):
     puntuacion = {}
+    for palabra in palabras:
+        for clave, orden in _INDICE_SINTOMAS.get(palabra, ()):
+            score, _ = puntuacion.get(clave, (0, orden))
+            puntuacion[clave] = (score + 1, orden)
+    ordenados = sorted(puntuacion.items(), key=lambda x: (-x[1][0], x[1][1]))
+    return tuple(clave for clave, _ in ordenados[:3])
 
-    for clave, enfermedad in ENFERMEDADES.items():
-        score = 0
-        todos_sintomas = " ".join(enfermedad["sintomas_es"]).lower()
-        for palabra in palabras:
-            if len(palabra) > 3 and palabra in todos_sintomas:
-                score += 1
-        if score > 0:
-            puntuacion[clave] = score
 
-    ordenados = sorted(puntuacion.items(), key=lambda x: x[1], reverse=True)
-    return [(clave, ENFERMEDADES[clave]) for clave, _ in ordenados[:3]]
+def buscar_enfermedad(texto):
+    """Busca enfermedades que coincidan con el texto del usuario."""
+    return [(clave, ENFERMEDADES[clave]) for clave in _claves_por_texto(texto.lower().strip())]
+
+
+def buscar_por_sintomas(sintomas_texto):
+    """Busca enfermedades que coincidan con una lista de síntomas."""
+    palabras = tuple(p for p in sintomas_texto.lower().split() if len(p) > 3)
+    return [(clave, ENFERMEDADES[clave]) for clave in _claves_por_sintomas(palabras)]
 
 
 def listar_enfermedades():
@@ -3,6 +3,8 @@ Conocimiento sobre la Historia de Guinea Ecuatorial.
 Desde la época precolonial hasta la actualidad.
 """
 
+from utils.aho_corasick import detectar_grupo, registrar_palabras_clave
+
 HISTORIA = {
     "precolonial": {
         "titulo_es": "Época Precolonial",
@@ -178,54 +180,51 @@ HISTORIA = {
 }
 
 
-def buscar_historia(texto):
-    """Busca información histórica relevante según el texto."""
-    texto = texto.lower().strip()
-    resultados = []
+# Palabras clave por sección (se registran en el detector compartido)
+PALABRAS_CLAVE_HISTORIA = {
+    "precolonial": [
+        "precolonial", "antes de colonia", "bubi", "originario",
+        "ancestro", "antiguo", "ancianos", "tradición", "tradicion",
+    ],
+    "portuguesa": [
+        "portugal", "portugués", "portugues", "fernando poo",
+        "formosa", "1471", "1778", "tratado de el pardo",
+    ],
+    "colonial_espanola": [
+        "colonial", "colonia", "españa", "español", "espanol",
+        "gobernación", "gobernacion", "cacao", "río muni", "rio muni",
+        "conferencia de berlín", "conferencia de berlin", "autonomía", "autonomia",
+    ],
+    "independencia": [
+        "independencia", "12 de octubre", "1968", "macías", "macias",
+        "referéndum", "referendum", "primer presidente",
+    ],
+    "primera_republica": [
+        "primera república", "primera republica", "macías nguema", "macias nguema",
+        "punt", "golpe de estado 1979", "presidente vitalicio",
+    ],
+    "segunda_republica": [
+        "segunda república", "segunda republica", "obiang", "pdge",
+        "petróleo", "petroleo", "multipartidismo", "democrático", "democratico",
+        "boom petrolero", "oyala", "djibloho",
+    ],
+    "datos_actuales": [
+        "datos", "actual", "hoy", "población", "poblacion", "superficie",
+        "capital", "moneda", "idioma oficial", "opep", "cemac",
+    ],
+    "etnias": [
+        "etnia", "etnias", "grupo étnico", "grupo etnico", "fang", "bubi",
+        "ndowé", "ndowe", "annobonés", "annobones", "fernandino",
+        "bisió", "bisio", "pueblo", "tribu",
+    ],
+}
 
-    keywords_map = {
-        "precolonial": [
-            "precolonial", "antes de colonia", "bubi", "originario",
-            "ancestro", "antiguo", "ancianos", "tradición", "tradicion",
-        ],
-        "portuguesa": [
-            "portugal", "portugués", "portugues", "fernando poo",
-            "formosa", "1471", "1778", "tratado de el pardo",
-        ],
-        "colonial_espanola": [
-            "colonial", "colonia", "españa", "español", "espanol",
-            "gobernación", "gobernacion", "cacao", "río muni", "rio muni",
-            "conferencia de berlín", "conferencia de berlin", "autonomía", "autonomia",
-        ],
-        "independencia": [
-            "independencia", "12 de octubre", "1968", "macías", "macias",
-            "referéndum", "referendum", "primer presidente",
-        ],
-        "primera_republica": [
-            "primera república", "primera republica", "macías nguema", "macias nguema",
-            "punt", "golpe de estado 1979", "presidente vitalicio",
-        ],
-        "segunda_republica": [
-            "segunda república", "segunda republica", "obiang", "pdge",
-            "petróleo", "petroleo", "multipartidismo", "democrático", "democratico",
-            "boom petrolero", "oyala", "djibloho",
-        ],
-        "datos_actuales": [
-            "datos", "actual", "hoy", "población", "poblacion", "superficie",
-            "capital", "moneda", "idioma oficial", "opep", "cemac",
-        ],
-        "etnias": [
-            "etnia", "etnias", "grupo étnico", "grupo etnico", "fang", "bubi",
-            "ndowé", "ndowe", "annobonés", "annobones", "fernandino",
-            "bisió", "bisio", "pueblo", "tribu",
-        ],
-    }
+registrar_palabras_clave("historia", PALABRAS_CLAVE_HISTORIA)
 
-    for seccion, keywords in keywords_map.items():
-        if any(kw in texto for kw in keywords):
-            resultados.append(seccion)
 
-    return resultados
+def buscar_historia(texto):
+    """Busca información histórica relevante según el texto."""
+    return detectar_grupo(texto, "historia")
 
 
 def formatear_historia(secciones, idioma="es"):
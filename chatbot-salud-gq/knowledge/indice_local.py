@@ -0,0 +1,158 @@
+"""
+Índice local unificado sobre todos los módulos de conocimiento.
+
+Una sola consulta por mensaje reúne lo que antes se buscaba por separado
+(enfermedades, síntomas, centros de salud, Constitución, OHADA, historia y
+vocabulario fang) y devuelve los aciertos ordenados con su fuente y sección.
+El resultado se calcula una vez y lo comparten la búsqueda local, el
+contexto para OpenAI y la respuesta sin IA del mismo mensaje.
+"""
+
+import re
+from collections import namedtuple
+from functools import lru_cache
+
+from knowledge.centros_salud import buscar_centros
+from knowledge.constitucion_gq import buscar_constitucion
+from knowledge.enfermedades import buscar_enfermedad, buscar_por_sintomas
+from knowledge.historia_gq import buscar_historia
+from knowledge.idioma_fang import VOCABULARIO_MEDICO
+from knowledge.ohada import buscar_ohada
+from utils.aho_corasick import detectar
+
+Acierto = namedtuple("Acierto", ["fuente", "seccion", "puntuacion"])
+
+# Peso de cada fuente al ordenar los aciertos: el mismo orden de prioridad
+# con el que la búsqueda local elige la respuesta
+PESOS_FUENTE = {
+    "enfermedad": 1.0,
+    "sintomas": 0.8,
+    "centros_salud": 0.7,
+    "constitucion": 0.6,
+    "ohada": 0.5,
+    "historia": 0.4,
+    "vocabulario_fang": 0.2,
+}
+
+_PALABRA = re.compile(r"[^\W\d_]+(?:'[^\W\d_]+)?")
+
+
+def _construir_indice_vocabulario():
+    """
+    Forma (es o fang, palabra o expresión) -> clave de VOCABULARIO_MEDICO.
+    Se compara por palabras completas: "mam" (agua) no debe coincidir con
+    "mamá" ni "dia" (comer) con "diarrea".
+    """
+    indice = {}
+    for clave, traducciones in VOCABULARIO_MEDICO.items():
+        formas = [clave, traducciones["fang"]] + traducciones["es"].split("/")
+        for forma in formas:
+            forma = forma.lower().strip()
+            if forma:
+                indice.setdefault(tuple(_PALABRA.findall(forma)), clave)
+    return indice, {forma[0]: max(len(f) for f in indice if f[0] == forma[0]) for forma in indice}
+
+
+# Forma -> clave, y primera palabra de cada forma -> palabras de la más larga
+_INDICE_VOCABULARIO, _PRIMERAS_PALABRAS = _construir_indice_vocabulario()
+
+
+class ConsultaLocal:
+    """
+    Resultado de buscar un mensaje en todo el conocimiento local.
+    Las búsquedas baratas se hacen al crearla; centros, vocabulario y el
+    orden de los aciertos solo la primera vez que se piden.
+    """
+
+    __slots__ = (
+        "texto", "detectados", "enfermedades", "sintomas",
+        "constitucion", "ohada", "historia", "_centros", "_vocabulario", "_aciertos",
+    )
+
+    def __init__(self, texto):
+        self.texto = texto
+        self.detectados = detectar(texto)  # {grupo: frozenset(claves)}
+        self.enfermedades = buscar_enfermedad(texto)
+        self.sintomas = buscar_por_sintomas(texto)
+        self.constitucion = buscar_constitucion(texto)
+        self.ohada = buscar_ohada(texto)
+        self.historia = buscar_historia(texto)
+        self._centros = None
+        self._vocabulario = None
+        self._aciertos = None
+
+    @property
+    def centros(self):
+        """Zonas de CENTROS_SALUD: por el texto completo o, si no, por cada palabra."""
+        if self._centros is None:
+            resultados = buscar_centros(self.texto)
+            if not resultados:
+                for palabra in self.texto.split():
+                    if len(palabra) > 2:
+                        resultados = buscar_centros(palabra)
+                        if resultados:
+                            break
+            self._centros = resultados
+        return self._centros
+
+    @property
+    def vocabulario(self):
+        """Claves de VOCABULARIO_MEDICO mencionadas (en español o en fang)."""
+        if self._vocabulario is None:
+            palabras = _PALABRA.findall(self.texto)
+            claves = []
+            for inicio, palabra in enumerate(palabras):
+                maximo = _PRIMERAS_PALABRAS.get(palabra)
+                if not maximo:
+                    continue
+                for n in range(min(maximo, len(palabras) - inicio), 0, -1):
+                    clave = _INDICE_VOCABULARIO.get(tuple(palabras[inicio:inicio + n]))
+                    if clave:
+                        if clave not in claves:
+                            claves.append(clave)
+                        break
+            self._vocabulario = claves
+        return self._vocabulario
+
+    def disparadores(self, grupo):
+        """Disparadores de la búsqueda local presentes ("sintomas", "centros_salud")."""
+        return grupo in self.detectados.get("busqueda_local", ())
+
+    @property
+    def aciertos(self):
+        """Todos los aciertos como Acierto(fuente, seccion, puntuacion), de mejor a peor."""
+        if self._aciertos is not None:
+            return self._aciertos
+        # Los centros solo cuentan si el mensaje habla de centros o ciudades
+        centros = self.centros if self.disparadores("centros_salud") else []
+        por_fuente = (
+            ("enfermedad", [clave for clave, _ in self.enfermedades]),
+            ("sintomas", [clave for clave, _ in self.sintomas]),
+            ("centros_salud", [clave for clave, _ in centros]),
+            ("constitucion", self.constitucion),
+            ("ohada", self.ohada),
+            ("historia", self.historia),
+            ("vocabulario_fang", self.vocabulario),
+        )
+        aciertos = []
+        for fuente, secciones in por_fuente:
+            peso = PESOS_FUENTE[fuente]
+            for orden, seccion in enumerate(secciones):
+                # Dentro de una fuente se respeta su propio orden
+                aciertos.append(Acierto(fuente, seccion, peso / (1 + 0.1 * orden)))
+        aciertos.sort(key=lambda a: -a.puntuacion)
+        self._aciertos = aciertos
+        return aciertos
+
+
+@lru_cache(maxsize=512)
+def _consultar(texto):
+    return ConsultaLocal(texto)
+
+
+def consultar(texto):
+    """
+    ConsultaLocal del texto (en minúsculas y sin espacios en los extremos).
+    Un mismo mensaje devuelve el mismo objeto mientras siga en la caché.
+    """
+    return _consultar(texto.lower().strip())
@@ -3,6 +3,8 @@ Conocimiento sobre la OHADA y su aplicación en Guinea Ecuatorial.
 Organización para la Armonización del Derecho Mercantil en África.
 """
 
+from utils.aho_corasick import detectar_grupo, registrar_palabras_clave
+
 OHADA = {
     "informacion_general": {
         "titulo_es": "OHADA - Organización para la Armonización del Derecho Mercantil en África",
@@ -204,41 +206,38 @@ OHADA = {
 }
 
 
-def buscar_ohada(texto):
-    """Busca información de OHADA relevante según el texto."""
-    texto = texto.lower().strip()
-    resultados = []
+# Palabras clave por sección (se registran en el detector compartido)
+PALABRAS_CLAVE_OHADA = {
+    "informacion_general": [
+        "ohada", "qué es ohada", "que es ohada", "armonización",
+        "armonizacion", "derecho mercantil", "tratado",
+    ],
+    "estados_miembros": ["miembros", "estados", "países", "paises", "miembro"],
+    "actas_uniformes": [
+        "acta", "actas", "uniforme", "ley", "leyes", "audcg", "auscgie",
+        "sarl", "comercial", "garantía", "garantia", "arbitraje",
+        "contabilidad", "transporte", "cooperativa", "mediación", "mediacion",
+    ],
+    "instituciones": [
+        "institución", "institucion", "ccja", "ersuma", "secretaría",
+        "secretaria", "consejo", "corte", "tribunal",
+    ],
+    "importancia_gq": [
+        "importancia", "guinea ecuatorial", "beneficio", "ventaja",
+        "por qué", "por que", "para qué", "para que",
+    ],
+    "crear_empresa": [
+        "empresa", "crear empresa", "sociedad", "sarl", "negocio",
+        "capital", "emprender", "registrar", "comercio",
+    ],
+}
 
-    keywords_map = {
-        "informacion_general": [
-            "ohada", "qué es ohada", "que es ohada", "armonización",
-            "armonizacion", "derecho mercantil", "tratado",
-        ],
-        "estados_miembros": ["miembros", "estados", "países", "paises", "miembro"],
-        "actas_uniformes": [
-            "acta", "actas", "uniforme", "ley", "leyes", "audcg", "auscgie",
-            "sarl", "comercial", "garantía", "garantia", "arbitraje",
-            "contabilidad", "transporte", "cooperativa", "mediación", "mediacion",
-        ],
-        "instituciones": [
-            "institución", "institucion", "ccja", "ersuma", "secretaría",
-            "secretaria", "consejo", "corte", "tribunal",
-        ],
-        "importancia_gq": [
-            "importancia", "guinea ecuatorial", "beneficio", "ventaja",
-            "por qué", "por que", "para qué", "para que",
-        ],
-        "crear_empresa": [
-            "empresa", "crear empresa", "sociedad", "sarl", "negocio",
-            "capital", "emprender", "registrar", "comercio",
-        ],
-    }
+registrar_palabras_clave("ohada", PALABRAS_CLAVE_OHADA)
 
-    for seccion, keywords in keywords_map.items():
-        if any(kw in texto for kw in keywords):
-            resultados.append(seccion)
 
-    return resultados
+def buscar_ohada(texto):
+    """Busca información de OHADA relevante según el texto."""
+    return detectar_grupo(texto, "ohada")
 
 
 def formatear_ohada(secciones, idioma="es"):
@@ -5,26 +5,52 @@ con la capacidad de GPT. Registra TODAS las interacciones para aprendizaje conti
 """
 
 import logging
+import threading
+import time
+
 from openai import OpenAI
 
-from config.settings import OPENAI_API_KEY, OPENAI_MODEL, SYSTEM_PROMPT
-from knowledge.enfermedades import (
-    ENFERMEDADES,
-    buscar_enfermedad,
-    buscar_por_sintomas,
-    listar_enfermedades,
+from config.settings import (
+    OPENAI_API_KEY,
+    OPENAI_BASE_URL,
+    OPENAI_MODEL,
+    OPENAI_STREAMING,
+    PROMPT_MAX_TOKENS,
+    SYSTEM_PROMPT,
 )
+from knowledge.enfermedades import ENFERMEDADES, listar_enfermedades
 from knowledge.centros_salud import (
-    buscar_centros,
     formatear_centro,
     formatear_emergencias,
     EMERGENCIAS,
 )
 from knowledge.idioma_fang import obtener_frase, VOCABULARIO_MEDICO
-from knowledge.constitucion_gq import buscar_constitucion, formatear_constitucion, formatear_resumen_constitucion
-from knowledge.ohada import buscar_ohada, formatear_ohada, formatear_resumen_ohada
-from knowledge.historia_gq import buscar_historia, formatear_historia, formatear_resumen_historia
-from services.knowledge_memory import KnowledgeMemory
+from knowledge.constitucion_gq import formatear_constitucion, formatear_resumen_constitucion
+from knowledge.ohada import formatear_ohada, formatear_resumen_ohada
+from knowledge.historia_gq import formatear_historia, formatear_resumen_historia
+from knowledge.indice_local import consultar
+from services.bandeja_salida import EntregaProgresiva
+from services.cache_respuestas import CacheRespuestas
+from services.coalescencia import Coalescedor, clave_mensajes
+from services.historial_conversacion import HistorialConversacion
+from services.knowledge_memory import (
+    ENCABEZADOS_CONTEXTO,
+    KnowledgeMemory,
+    formatear_bloques_contexto,
+)
+from services.metricas import (
+    BLOQUES_DESCARTADOS,
+    BLOQUES_RECORTADOS,
+    ETAPAS,
+    LATENCIA_ETAPAS,
+    RESPUESTAS_POR_FUENTE,
+    TOKENS_OPENAI,
+    TOKENS_PROMPT,
+    TOKENS_PROMPT_SIN_AJUSTAR,
+)
+from utils.aho_corasick import detectar, detectar_grupo, registrar_palabras_clave
+from utils.presupuesto_tokens import Bloque, ajustar, estimar_mensajes
+from utils.symspell import corregir_texto, registrar_vocabulario
 
 logger = logging.getLogger(__name__)
 
@@ -73,108 +99,218 @@ CATEGORIAS_KEYWORDS = {
     ],
 }
 
+# Palabras que indican una emergencia médica
+PALABRAS_EMERGENCIA = [
+    "emergencia", "urgente", "urgencia", "me muero",
+    "no respira", "no puede respirar", "sangre mucha",
+    "convulsiones", "desmayo", "inconsciente",
+    "se cayó", "accidente", "envenenamiento", "veneno",
+    "parto", "trabajo de parto", "va a nacer",
+    "mordedura de serpiente", "serpiente",
+    "quemadura grave", "quemadura",
+    "ahogando", "se ahoga",
+    # Fang
+    "a wu", "a si fufú",
+    "meyon ose", "a biki nnam",
+]
+
+# Disparadores de la búsqueda local por síntomas y por centros de salud
+PALABRAS_BUSQUEDA_LOCAL = {
+    "sintomas": [
+        "fiebre", "dolor", "tos", "diarrea", "vomito", "vómito",
+        "sangre", "mareo", "picazón", "hinchado", "herida",
+        "efie", "a yem", "ekos", "nsus", "meyon", "evu",
+    ],
+    "centros_salud": [
+        "malabo", "bata", "ebebiyin", "ebebiyín", "mongomo",
+        "evinayong", "luba", "aconibe", "annobon", "annobón",
+        "hospital", "centro de salud", "doctor", "médico",
+    ],
+}
+
+registrar_palabras_clave("categoria", CATEGORIAS_KEYWORDS)
+registrar_palabras_clave("emergencia", {"emergencia": PALABRAS_EMERGENCIA})
+registrar_palabras_clave("busqueda_local", PALABRAS_BUSQUEDA_LOCAL)
+# Los disparadores de la búsqueda local también se corrigen ("hopital")
+registrar_vocabulario(
+    palabra for palabras in PALABRAS_BUSQUEDA_LOCAL.values() for palabra in palabras
+)
+
+# Histograma de cada etapa de generar_respuesta, resuelto una sola vez
+_LATENCIA = {etapa: LATENCIA_ETAPAS.hijo(etapa) for etapa in ETAPAS}
+
+# Se añade a una respuesta de OpenAI cuyo stream se cortó después de enviar una parte
+AVISO_RESPUESTA_CORTADA = (
+    "(La respuesta se ha cortado. Vuelva a enviar su pregunta para recibirla completa.)"
+)
+
+# Valor de cada bloque del prompt cuando no cabe todo en PROMPT_MAX_TOKENS.
+# Se multiplica por la relevancia propia del bloque: la puntuación del
+# acierto local, la similitud del conocimiento o 0.8 por cada turno de antigüedad
+RELEVANCIA_BLOQUES = {
+    "contexto_local": 1.0,
+    "turno": 0.9,
+    "conocimiento": 0.7,
+    "resumen": 0.5,
+    "intereses": 0.3,
+    "historial_usuario": 0.25,
+    "temas_populares": 0.1,
+}
+
+# Bloques que dependen de la conversación de cada usuario: una respuesta
+# escrita con ellos solo vale para ese usuario y esa conversación
+BLOQUES_DEL_USUARIO = ("resumen", "turno", "historial_usuario", "intereses")
+
 
 class AIService:
     """Servicio de inteligencia artificial para el chatbot médico."""
 
-    def __init__(self, memory=None):
+    def __init__(self, memory=None, escritor=None, cache=None, historial=None):
         self.client = None
         if OPENAI_API_KEY:
-            self.client = OpenAI(api_key=OPENAI_API_KEY)
-        self.conversation_history = {}
+            self.client = OpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL or None)
         self.memory = memory or KnowledgeMemory()
-
-    def generar_respuesta(self, user_id, mensaje, idioma="es"):
+        # Últimos turnos por usuario, acotados y recuperables desde SQLite
+        self.historial = historial or HistorialConversacion(self.memory)
+        # Si hay escritor, el aprendizaje se escribe en segundo plano
+        self.escritor = escritor
+        # Respuestas de OpenAI reutilizables para preguntas repetidas
+        self.cache = cache or CacheRespuestas()
+        # Preguntas idénticas simultáneas comparten una sola llamada
+        self.coalescedor = Coalescedor()
+        # Mensajes con faltas que la búsqueda local resolvió tras corregirlos
+        self._correccion = {
+            "mensajes_corregidos": 0,
+            "resueltos_localmente": 0,
+            "llamadas_openai_evitadas": 0,
+        }
+        self._lock_correccion = threading.Lock()
+
+    def generar_respuesta(self, user_id, mensaje, idioma="es", enviar=False):
         """
         Genera una respuesta médica inteligente.
         Registra TODAS las interacciones para aprendizaje.
+        Con `enviar`, la respuesta queda en la bandeja de salida de WhatsApp.
         """
         mensaje_lower = mensaje.lower().strip()
         categoria = self._detectar_categoria(mensaje_lower)
 
         # 1. Detectar emergencias
-        if self._es_emergencia(mensaje_lower):
+        inicio = time.perf_counter()
+        es_emergencia = self._es_emergencia(mensaje_lower)
+        _LATENCIA["emergencia"].observar(time.perf_counter() - inicio)
+        if es_emergencia:
             respuesta = self._respuesta_emergencia(idioma)
-            self._post_procesar(user_id, mensaje, respuesta, "emergencia", idioma, "emergencia")
+            self._post_procesar(user_id, mensaje, respuesta, "emergencia", idioma, "emergencia", enviar)
             return respuesta
 
-        # 2. Buscar en base de conocimiento local
-        respuesta_local = self._buscar_local(mensaje_lower, idioma)
+        # 2. Buscar en base de conocimiento local. La consulta se comparte
+        # con los pasos siguientes (contexto para OpenAI y fallback)
+        inicio = time.perf_counter()
+        consulta = consultar(mensaje_lower)
+        respuesta_local = self._buscar_local(consulta, idioma)
+        _LATENCIA["busqueda_local"].observar(time.perf_counter() - inicio)
         if respuesta_local:
-            self._post_procesar(user_id, mensaje, respuesta_local, "local", idioma, categoria)
+            self._post_procesar(user_id, mensaje, respuesta_local, "local", idioma, categoria, enviar)
             return respuesta_local
 
         # 3. Buscar en memoria aprendida
+        inicio = time.perf_counter()
         respuesta_memoria, confianza = self.memory.buscar(mensaje_lower, idioma)
+        _LATENCIA["memoria"].observar(time.perf_counter() - inicio)
         if respuesta_memoria and confianza >= 0.6:
             logger.info(f"Respuesta desde memoria (confianza: {confianza:.2f})")
-            self._post_procesar(user_id, mensaje, respuesta_memoria, "memoria", idioma, categoria)
+            self._post_procesar(user_id, mensaje, respuesta_memoria, "memoria", idioma, categoria, enviar)
             return respuesta_memoria
 
         # 4. Buscar en patrones aprendidos
+        inicio = time.perf_counter()
         respuesta_patron, frecuencia, confianza_patron = self.memory.buscar_patron(mensaje_lower, idioma)
+        _LATENCIA["patrones"].observar(time.perf_counter() - inicio)
         if respuesta_patron and confianza_patron >= 0.6:
             logger.info(f"Respuesta desde patrón (freq={frecuencia}, confianza: {confianza_patron:.2f})")
-            self._post_procesar(user_id, mensaje, respuesta_patron, "patron", idioma, categoria)
+            self._post_procesar(user_id, mensaje, respuesta_patron, "patron", idioma, categoria, enviar)
             return respuesta_patron
 
         # 5. Si hay API de OpenAI, usar IA
         if self.client:
-            respuesta_ia = self._respuesta_ia(user_id, mensaje, idioma)
-            self._post_procesar(user_id, mensaje, respuesta_ia, "openai", idioma, categoria)
+            inicio = time.perf_counter()
+            # Por WhatsApp, cada párrafo sale en cuanto OpenAI lo termina
+            entrega = None
+            if enviar and OPENAI_STREAMING:
+                entrega = EntregaProgresiva(self.memory.bandeja_salida, user_id)
+            respuesta_ia = self._respuesta_ia(user_id, mensaje, idioma, categoria, consulta, entrega)
+            _LATENCIA["openai"].observar(time.perf_counter() - inicio)
+            fuente = "openai"
+            # Si ya salió en parte, junto al historial solo se encola lo que falta
+            texto_envio = entrega.resto() if entrega and entrega.enviados else None
+            if entrega and entrega.interrumpida:
+                # Solo llegó el principio: se avisa al usuario y no se aprende de ella
+                fuente = "openai_parcial"
+                respuesta_ia = f"{respuesta_ia.rstrip()}\n\n{AVISO_RESPUESTA_CORTADA}"
+                texto_envio = f"{texto_envio}\n\n{AVISO_RESPUESTA_CORTADA}".strip()
+            self._post_procesar(
+                user_id, mensaje, respuesta_ia, fuente, idioma, categoria, enviar, texto_envio
+            )
             return respuesta_ia
 
         # 6. Fallback sin IA
-        respuesta_fb = self._respuesta_fallback(mensaje_lower, idioma)
-        self._post_procesar(user_id, mensaje, respuesta_fb, "fallback", idioma, categoria)
+        respuesta_fb = self._respuesta_fallback(consulta, idioma)
+        self._post_procesar(user_id, mensaje, respuesta_fb, "fallback", idioma, categoria, enviar)
         return respuesta_fb
 
-    def _post_procesar(self, user_id, pregunta, respuesta, fuente, idioma, categoria):
+    def _post_procesar(
+        self, user_id, pregunta, respuesta, fuente, idioma, categoria, enviar=False, texto_envio=None
+    ):
         """
         Post-procesamiento: registra en historial, guarda conocimiento,
         actualiza patrones y perfil del usuario.
+        Con escritor, las escrituras se encolan y no retrasan la respuesta.
+        Si hay que enviarla, el historial se escribe ya, en la misma
+        transacción que la bandeja de salida (`texto_envio` si solo falta
+        enviar una parte).
         """
+        RESPUESTAS_POR_FUENTE.hijo(fuente).incrementar()
+        inicio = time.perf_counter()
+        escribir = self.escritor.encolar if self.escritor else self._escribir_directo
         try:
             # 1. Siempre registrar en historial
-            self.memory.registrar_consulta(user_id, pregunta, respuesta, fuente, idioma, categoria)
+            if enviar:
+                self.memory.registrar_consulta(
+                    user_id, pregunta, respuesta, fuente, idioma, categoria,
+                    enviar=True, texto_envio=texto_envio,
+                )
+            else:
+                escribir("registrar_consulta", user_id, pregunta, respuesta, fuente, idioma, categoria)
 
             # 2. Guardar en conocimiento aprendido si es respuesta útil
+            # (nunca una respuesta cortada, "openai_parcial")
             if fuente in ("local", "openai"):
-                self.memory.guardar(pregunta, respuesta, idioma, categoria)
+                escribir("guardar", pregunta, respuesta, idioma, categoria)
 
             # 3. Actualizar patrones aprendidos
             if fuente in ("local", "openai", "memoria"):
-                self.memory.actualizar_patron(pregunta, respuesta, idioma, categoria)
+                escribir("actualizar_patron", pregunta, respuesta, idioma, categoria)
 
             # 4. Actualizar perfil del usuario
-            self.memory.actualizar_perfil(user_id, idioma, categoria)
+            escribir("actualizar_perfil", user_id, idioma, categoria)
 
         except Exception as e:
             logger.error(f"Error en post-procesamiento: {e}")
+        _LATENCIA["post_procesado"].observar(time.perf_counter() - inicio)
+
+    def _escribir_directo(self, operacion, *args):
+        """Ejecuta la operación de memoria en el mismo hilo."""
+        getattr(self.memory, operacion)(*args)
 
     def _detectar_categoria(self, mensaje):
         """Detecta la categoría del mensaje basándose en palabras clave."""
-        for categoria, keywords in CATEGORIAS_KEYWORDS.items():
-            if any(kw in mensaje for kw in keywords):
-                return categoria
-        return "general"
+        categorias = detectar_grupo(mensaje, "categoria")
+        return categorias[0] if categorias else "general"
 
     def _es_emergencia(self, mensaje):
         """Detecta si el mensaje describe una emergencia médica."""
-        palabras_emergencia = [
-            "emergencia", "urgente", "urgencia", "me muero",
-            "no respira", "no puede respirar", "sangre mucha",
-            "convulsiones", "desmayo", "inconsciente",
-            "se cayó", "accidente", "envenenamiento", "veneno",
-            "parto", "trabajo de parto", "va a nacer",
-            "mordedura de serpiente", "serpiente",
-            "quemadura grave", "quemadura",
-            "ahogando", "se ahoga",
-            # Fang
-            "emergencia", "a wu", "a si fufú",
-            "meyon ose", "a biki nnam",
-        ]
-        return any(palabra in mensaje for palabra in palabras_emergencia)
+        return "emergencia" in detectar(mensaje)
 
     def _respuesta_emergencia(self, idioma):
         """Genera respuesta de emergencia con números importantes."""
@@ -202,50 +338,68 @@ class AIService:
             )
         return texto
 
-    def _buscar_local(self, mensaje, idioma):
+    def _buscar_local(self, consulta, idioma):
+        """
+        Busca respuestas en la base de conocimiento local. Si no hay nada,
+        corrige las faltas de ortografía ("tifoydea", "ebebiyn", "hopital")
+        y vuelve a buscar antes de pasar a la memoria o a OpenAI.
+        """
+        respuesta = self._buscar_local_exacto(consulta, idioma)
+        # Pedir la ubicación tampoco es una respuesta: "hospital en ebebiyn"
+        if respuesta and respuesta != self._frase_pidiendo_ubicacion(idioma):
+            return respuesta
+
+        corregido, correcciones = corregir_texto(consulta.texto)
+        if not correcciones:
+            return respuesta
+        respuesta_corregida = self._buscar_local_exacto(consultar(corregido), idioma)
+        resuelto = respuesta_corregida and respuesta_corregida != respuesta
+        with self._lock_correccion:
+            self._correccion["mensajes_corregidos"] += 1
+            if resuelto:
+                self._correccion["resueltos_localmente"] += 1
+                # Sin la corrección el mensaje habría seguido hacia OpenAI
+                if self.client and respuesta is None:
+                    self._correccion["llamadas_openai_evitadas"] += 1
+        if resuelto:
+            logger.info(f"Búsqueda local tras corregir {dict(correcciones)}")
+            return respuesta_corregida
+        return respuesta
+
+    @staticmethod
+    def _frase_pidiendo_ubicacion(idioma):
+        return obtener_frase("pidiendo_ubicacion", "fang" if idioma == "fang" else "es")
+
+    def metricas_correccion(self):
+        """Contadores de la corrección ortográfica de la búsqueda local."""
+        with self._lock_correccion:
+            return dict(self._correccion)
+
+    def _buscar_local_exacto(self, consulta, idioma):
         """Busca respuestas en la base de conocimiento local."""
         # Buscar enfermedades específicas
-        resultados = buscar_enfermedad(mensaje)
-        if resultados:
-            return self._formatear_enfermedad(resultados[0], idioma)
+        if consulta.enfermedades:
+            return self._formatear_enfermedad(consulta.enfermedades[0], idioma)
 
         # Buscar por síntomas
-        palabras_sintomas = [
-            "fiebre", "dolor", "tos", "diarrea", "vomito", "vómito",
-            "sangre", "mareo", "picazón", "hinchado", "herida",
-            "efie", "a yem", "ekos", "nsus", "meyon", "evu",
-        ]
-        if any(palabra in mensaje for palabra in palabras_sintomas):
-            resultados = buscar_por_sintomas(mensaje)
-            if resultados:
-                return self._formatear_resultados_sintomas(resultados, idioma)
+        if consulta.disparadores("sintomas") and consulta.sintomas:
+            return self._formatear_resultados_sintomas(consulta.sintomas, idioma)
 
         # Buscar centros de salud
-        ciudades = [
-            "malabo", "bata", "ebebiyin", "ebebiyín", "mongomo",
-            "evinayong", "luba", "aconibe", "annobon", "annobón",
-            "hospital", "centro de salud", "doctor", "médico",
-        ]
-        palabras_msg = mensaje.split()
-        if any(ciudad in mensaje for ciudad in ciudades) or any(
-            palabra in ciudades for palabra in palabras_msg
-        ):
-            return self._buscar_centros_salud(mensaje, idioma)
+        if consulta.disparadores("centros_salud"):
+            return self._buscar_centros_salud(consulta, idioma)
 
         # Buscar en Constitución
-        secciones_const = buscar_constitucion(mensaje)
-        if secciones_const:
-            return formatear_constitucion(secciones_const, idioma)
+        if consulta.constitucion:
+            return formatear_constitucion(consulta.constitucion, idioma)
 
         # Buscar en OHADA
-        secciones_ohada = buscar_ohada(mensaje)
-        if secciones_ohada:
-            return formatear_ohada(secciones_ohada, idioma)
+        if consulta.ohada:
+            return formatear_ohada(consulta.ohada, idioma)
 
         # Buscar en Historia
-        secciones_hist = buscar_historia(mensaje)
-        if secciones_hist:
-            return formatear_historia(secciones_hist, idioma)
+        if consulta.historia:
+            return formatear_historia(consulta.historia, idioma)
 
         return None
 
@@ -312,22 +466,11 @@ class AIService:
 
         return texto
 
-    def _buscar_centros_salud(self, mensaje, idioma):
-        """Busca y formatea centros de salud."""
-        resultados = buscar_centros(mensaje)
-
-        # Si no encuentra con el texto completo, buscar por cada palabra
+    def _buscar_centros_salud(self, consulta, idioma):
+        """Formatea los centros de salud de la zona mencionada."""
+        resultados = consulta.centros
         if not resultados:
-            for palabra in mensaje.split():
-                if len(palabra) > 2:
-                    resultados = buscar_centros(palabra)
-                    if resultados:
-                        break
-
-        if not resultados:
-            if idioma == "fang":
-                return obtener_frase("pidiendo_ubicacion", "fang")
-            return obtener_frase("pidiendo_ubicacion", "es")
+            return self._frase_pidiendo_ubicacion(idioma)
 
         clave, zona = resultados[0]
         if idioma == "fang":
@@ -341,11 +484,12 @@ class AIService:
         texto += "\n" + formatear_emergencias()
         return texto
 
-    def _respuesta_ia(self, user_id, mensaje, idioma):
-        """Genera respuesta usando OpenAI con contexto médico enriquecido."""
-        if user_id not in self.conversation_history:
-            self.conversation_history[user_id] = []
-
+    def _respuesta_ia(self, user_id, mensaje, idioma, categoria="general", consulta=None, entrega=None):
+        """
+        Genera respuesta usando OpenAI con contexto médico enriquecido.
+        Con `entrega` (EntregaProgresiva) la respuesta se pide en streaming
+        y se va encolando por párrafos; se devuelve igualmente completa.
+        """
         idioma_instruccion = (
             "Responde en fang (lengua de Guinea Ecuatorial) "
             "con explicaciones en español si es necesario."
@@ -353,112 +497,207 @@ class AIService:
             else "Responde en español sencillo."
         )
 
-        context = self._construir_contexto(mensaje)
+        consulta = consulta or consultar(mensaje)
+        secciones = self._secciones_contexto(consulta)
+        context = "\n\n".join(texto for _, texto, _ in secciones)
+        bloques = self._bloques_prompt(user_id, mensaje, idioma_instruccion, secciones)
+
+        # Pregunta casi idéntica respondida hace poco, con el mismo contexto
+        # local y la misma conversación del usuario: no llamar a OpenAI
+        clave_cache = None
+        if self.cache.admite(categoria):
+            contexto_usuario = "\n".join(b.texto for b in bloques if b.tipo in BLOQUES_DEL_USUARIO)
+            clave_cache = self.cache.clave(mensaje, idioma, context, contexto_usuario)
+            respuesta = self.cache.obtener(clave_cache)
+            if respuesta:
+                logger.info(f"Respuesta de IA desde caché (categoría: {categoria})")
+                self.historial.agregar(user_id, mensaje, respuesta)
+                return respuesta
+
+        # Instrucciones, contexto local, conocimiento aprendido, resumen,
+        # turnos recientes y pregunta, ajustados al presupuesto de tokens
+        messages = self._construir_mensajes(mensaje, bloques)
+
+        def llamar_openai():
+            if entrega:
+                respuesta = self._completar_streaming(messages, entrega)
+            else:
+                response = self.client.chat.completions.create(
+                    model=OPENAI_MODEL,
+                    messages=messages,
+                    max_tokens=800,
+                    temperature=0.3,
+                )
+                self._contar_uso(response.usage)
+                respuesta = response.choices[0].message.content
+            if clave_cache:
+                self.cache.guardar(clave_cache, respuesta, categoria)
+            return respuesta
 
-        # Contexto enriquecido: memoria + patrones + historial + tendencias
-        contexto_enriquecido = self.memory.obtener_contexto_enriquecido(mensaje, user_id)
+        try:
+            if clave_cache:
+                # Si el mismo prompt ya está en curso, esperar su respuesta
+                respuesta = self.coalescedor.ejecutar(clave_mensajes(messages), llamar_openai)
+            else:
+                respuesta = llamar_openai()
 
-        messages = [
-            {"role": "system", "content": SYSTEM_PROMPT + "\n\n" + idioma_instruccion},
-        ]
+            self.historial.agregar(user_id, mensaje, respuesta)
+            return respuesta
 
-        if context:
+        except Exception as e:
+            logger.error(f"Error en OpenAI API: {e}")
+            if entrega and entrega.enviados:
+                # El usuario ya recibió el principio: se cierra con lo que llegó,
+                # marcado para que no se guarde en caché, historial ni memoria
+                entrega.interrumpida = True
+                return entrega.texto
+            return self._respuesta_fallback(consulta, idioma)
+
+    def _completar_streaming(self, messages, entrega):
+        """Consume la respuesta de OpenAI en streaming y la pasa a `entrega`."""
+        stream = self.client.chat.completions.create(
+            model=OPENAI_MODEL,
+            messages=messages,
+            max_tokens=800,
+            temperature=0.3,
+            stream=True,
+            stream_options={"include_usage": True},
+        )
+        for evento in stream:
+            if evento.choices and evento.choices[0].delta.content:
+                entrega.agregar(evento.choices[0].delta.content)
+            if evento.usage:
+                # Llega en un último evento sin choices
+                self._contar_uso(evento.usage)
+        return entrega.texto
+
+    @staticmethod
+    def _contar_uso(uso):
+        """Suma los tokens que OpenAI declara en `usage`."""
+        if uso:
+            TOKENS_OPENAI.hijo("prompt").incrementar(uso.prompt_tokens or 0)
+            TOKENS_OPENAI.hijo("completion").incrementar(uso.completion_tokens or 0)
+
+    def _bloques_prompt(self, user_id, mensaje, idioma_instruccion, secciones):
+        """Todos los bloques candidatos al prompt, con su relevancia, antes de ajustarlos."""
+        bloques = [Bloque("sistema", SYSTEM_PROMPT + "\n\n" + idioma_instruccion, 1.0, True, False)]
+        for _, texto, puntuacion in secciones:
+            bloques.append(Bloque("contexto_local", texto, RELEVANCIA_BLOQUES["contexto_local"] * puntuacion))
+        for tipo, texto, relevancia in self.memory.obtener_bloques_contexto(mensaje, user_id):
+            bloques.append(Bloque(tipo, texto, RELEVANCIA_BLOQUES[tipo] * relevancia))
+        resumen = self.historial.resumen(user_id)
+        if resumen:
+            bloques.append(Bloque("resumen", resumen, RELEVANCIA_BLOQUES["resumen"]))
+        historial = self.historial.mensajes(user_id)
+        turnos = list(zip(historial[::2], historial[1::2]))
+        for i, (pregunta, respuesta) in enumerate(turnos):
+            bloques.append(Bloque(
+                "turno",
+                pregunta["content"] + "\n" + respuesta["content"],
+                RELEVANCIA_BLOQUES["turno"] * 0.8 ** (len(turnos) - 1 - i),
+                recortable=False,
+                datos=(pregunta, respuesta),
+            ))
+        bloques.append(Bloque("pregunta", mensaje, 1.0, True, False))
+        return bloques
+
+    def _construir_mensajes(self, mensaje, bloques):
+        """
+        Mensajes para OpenAI dentro de PROMPT_MAX_TOKENS. Las instrucciones
+        y la pregunta van siempre; el contexto local, el conocimiento
+        aprendido, los turnos recientes y el resumen de los anteriores
+        entran por orden de relevancia, recortados o descartados si no caben.
+        """
+        bloques, informe = ajustar(bloques, PROMPT_MAX_TOKENS, OPENAI_MODEL)
+        por_tipo = {}
+        for bloque in bloques:
+            por_tipo.setdefault(bloque.tipo, []).append(bloque)
+
+        messages = [{"role": "system", "content": por_tipo["sistema"][0].texto}]
+        if "contexto_local" in por_tipo:
+            local = "\n\n".join(b.texto for b in por_tipo["contexto_local"])
             messages.append({
                 "role": "system",
-                "content": f"Contexto relevante de la base de datos local:\n{context}",
+                "content": f"Contexto relevante de la base de datos local:\n{local}",
             })
-
-        if contexto_enriquecido:
+        enriquecidos = [b for b in bloques if b.tipo in ENCABEZADOS_CONTEXTO]
+        if enriquecidos:
             messages.append({
                 "role": "system",
-                "content": f"Conocimiento aprendido y contexto del usuario:\n{contexto_enriquecido}",
+                "content": f"Conocimiento aprendido y contexto del usuario:\n{formatear_bloques_contexto(enriquecidos)}",
             })
-
-        history = self.conversation_history[user_id][-6:]
-        messages.extend(history)
+        if "resumen" in por_tipo:
+            messages.append({
+                "role": "system",
+                "content": f"Resumen de la conversación anterior con este usuario:\n{por_tipo['resumen'][0].texto}",
+            })
+        for bloque in por_tipo.get("turno", ()):
+            messages.extend(bloque.datos)
         messages.append({"role": "user", "content": mensaje})
 
-        try:
-            response = self.client.chat.completions.create(
-                model=OPENAI_MODEL,
-                messages=messages,
-                max_tokens=800,
-                temperature=0.3,
-            )
-
-            respuesta = response.choices[0].message.content
-
-            self.conversation_history[user_id].append(
-                {"role": "user", "content": mensaje}
-            )
-            self.conversation_history[user_id].append(
-                {"role": "assistant", "content": respuesta}
-            )
+        tokens = estimar_mensajes(messages, OPENAI_MODEL)
+        # Los encabezados y separadores de los mensajes se suman también
+        # al tamaño sin ajustar, para que ambas cifras sean comparables
+        sin_ajustar = informe["tokens_sin_ajustar"] + tokens - informe["tokens"]
+        TOKENS_PROMPT.observar(tokens)
+        TOKENS_PROMPT_SIN_AJUSTAR.observar(sin_ajustar)
+        for tipo in informe["descartados"]:
+            BLOQUES_DESCARTADOS.hijo(tipo).incrementar()
+        for tipo in informe["recortados"]:
+            BLOQUES_RECORTADOS.hijo(tipo).incrementar()
+        logger.debug(
+            f"Prompt de {tokens} tokens (sin ajustar {sin_ajustar}); "
+            f"descartados: {informe['descartados']}, recortados: {informe['recortados']}"
+        )
+        return messages
 
-            if len(self.conversation_history[user_id]) > 20:
-                self.conversation_history[user_id] = (
-                    self.conversation_history[user_id][-12:]
-                )
+    def _secciones_contexto(self, consulta):
+        """Contexto local por fuente: [(fuente, texto, puntuación de su mejor acierto)]."""
+        # Aciertos agrupados por fuente, en el orden de la consulta
+        secciones = {}
+        mejores = {}
+        for acierto in consulta.aciertos:
+            secciones.setdefault(acierto.fuente, []).append(acierto.seccion)
+            mejores.setdefault(acierto.fuente, acierto.puntuacion)
 
-            return respuesta
-
-        except Exception as e:
-            logger.error(f"Error en OpenAI API: {e}")
-            return self._respuesta_fallback(mensaje.lower(), idioma)
-
-    def _construir_contexto(self, mensaje):
-        """Construye contexto relevante de la base de conocimiento."""
         contexto_partes = []
-        mensaje_lower = mensaje.lower()
-
-        resultados_enf = buscar_enfermedad(mensaje_lower)
-        if resultados_enf:
-            clave, enf = resultados_enf[0]
-            contexto_partes.append(
-                f"Enfermedad relevante: {enf['nombre_es']}\n"
-                f"Descripción: {enf['descripcion_es']}\n"
-                f"Síntomas: {', '.join(enf['sintomas_es'][:5])}\n"
-                f"Tratamiento: {enf['tratamiento_es']}"
-            )
-
-        resultados_sintomas = buscar_por_sintomas(mensaje_lower)
-        if resultados_sintomas:
-            nombres = [enf["nombre_es"] for _, enf in resultados_sintomas]
-            contexto_partes.append(
-                f"Enfermedades posibles por síntomas: {', '.join(nombres)}"
-            )
-
-        # Contexto de constitución
-        secciones_const = buscar_constitucion(mensaje_lower)
-        if secciones_const:
-            contexto_partes.append(
-                f"Tema constitucional detectado: {', '.join(secciones_const)}"
-            )
-
-        # Contexto de OHADA
-        secciones_ohada = buscar_ohada(mensaje_lower)
-        if secciones_ohada:
-            contexto_partes.append(
-                f"Tema OHADA detectado: {', '.join(secciones_ohada)}"
-            )
-
-        # Contexto de historia
-        secciones_hist = buscar_historia(mensaje_lower)
-        if secciones_hist:
-            contexto_partes.append(
-                f"Tema histórico detectado: {', '.join(secciones_hist)}"
-            )
+        for fuente, claves in secciones.items():
+            if fuente == "enfermedad":
+                enf = ENFERMEDADES[claves[0]]
+                texto = (
+                    f"Enfermedad relevante: {enf['nombre_es']}\n"
+                    f"Descripción: {enf['descripcion_es']}\n"
+                    f"Síntomas: {', '.join(enf['sintomas_es'][:5])}\n"
+                    f"Tratamiento: {enf['tratamiento_es']}"
+                )
+            elif fuente == "sintomas":
+                nombres = [ENFERMEDADES[clave]["nombre_es"] for clave in claves]
+                texto = f"Enfermedades posibles por síntomas: {', '.join(nombres)}"
+            elif fuente == "constitucion":
+                texto = f"Tema constitucional detectado: {', '.join(claves)}"
+            elif fuente == "ohada":
+                texto = f"Tema OHADA detectado: {', '.join(claves)}"
+            elif fuente == "historia":
+                texto = f"Tema histórico detectado: {', '.join(claves)}"
+            elif fuente == "vocabulario_fang":
+                traducciones = [
+                    f"{VOCABULARIO_MEDICO[clave]['es']} = {VOCABULARIO_MEDICO[clave]['fang']}"
+                    for clave in claves
+                ]
+                texto = f"Vocabulario fang: {', '.join(traducciones)}"
+            else:
+                continue
+            contexto_partes.append((fuente, texto, mejores[fuente]))
 
-        return "\n\n".join(contexto_partes)
+        return contexto_partes
 
-    def _respuesta_fallback(self, mensaje, idioma):
+    def _respuesta_fallback(self, consulta, idioma):
         """Respuesta cuando no hay API de IA disponible."""
-        resultados = buscar_por_sintomas(mensaje)
-        if resultados:
-            return self._formatear_resultados_sintomas(resultados, idioma)
+        if consulta.sintomas:
+            return self._formatear_resultados_sintomas(consulta.sintomas, idioma)
 
         # Buscar en memoria aprendida antes de devolver "no entiendo"
-        respuesta_memoria, confianza = self.memory.buscar(mensaje, idioma)
+        respuesta_memoria, confianza = self.memory.buscar(consulta.texto, idioma)
         if respuesta_memoria:
             logger.info(f"Fallback: respuesta desde memoria (confianza: {confianza:.2f})")
             return respuesta_memoria
@@ -467,5 +706,4 @@ class AIService:
 
     def limpiar_sesion(self, user_id):
         """Limpia el historial de conversación de un usuario."""
-        if user_id in self.conversation_history:
-            del self.conversation_history[user_id]
+        self.historial.olvidar(user_id)
@@ -0,0 +1,315 @@
+"""
+Archivo mensual del historial de consultas.
+`historial_consultas` solo conserva los meses recientes. Los meses más
+antiguos se vuelcan a segmentos JSONL comprimidos con gzip (una partición
+por mes) y se borran de la base de datos. Un índice pequeño en SQLite
+registra qué segmentos existen y qué usuarios aparecen en cada uno, para
+que el historial archivado se pueda seguir leyendo en streaming.
+Incluye un planificador que archiva y ejecuta VACUUM incremental.
+"""
+
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+from config.settings import (
+    HISTORIAL_MANTENIMIENTO_HORAS,
+    HISTORIAL_MESES_ACTIVOS,
+    HISTORIAL_VACUUM_PAGINAS,
+)
+
+logger = logging.getLogger(__name__)
+
+COLUMNAS = ("id", "user_id", "pregunta", "respuesta", "fuente", "idioma", "categoria", "fecha")
+
+
+def _mes_limite(meses_activos, ahora=None):
+    """Primer mes ('YYYY-MM') que sigue activo en la base de datos."""
+    ahora = ahora or datetime.now()
+    indice = ahora.year * 12 + ahora.month - 1 - max(0, meses_activos - 1)
+    return f"{indice // 12:04d}-{indice % 12 + 1:02d}"
+
+
+class ArchivoHistorial:
+    """Particiones mensuales comprimidas del historial y su mantenimiento."""
+
+    def __init__(
+        self,
+        db,
+        directorio,
+        meses_activos=HISTORIAL_MESES_ACTIVOS,
+        intervalo_horas=HISTORIAL_MANTENIMIENTO_HORAS,
+        paginas_vacuum=HISTORIAL_VACUUM_PAGINAS,
+    ):
+        self._db = db
+        self.directorio = directorio
+        self.meses_activos = meses_activos
+        self.intervalo = intervalo_horas * 3600
+        self.paginas_vacuum = paginas_vacuum
+        self._detener = threading.Event()
+        self._hilo = None
+        self._lock = threading.Lock()
+        self._crear_tablas()
+
+    def _crear_tablas(self):
+        with self._db.transaccion() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS archivo_segmentos (
+                    archivo TEXT PRIMARY KEY,
+                    mes TEXT NOT NULL,
+                    filas INTEGER NOT NULL,
+                    bytes INTEGER NOT NULL,
+                    primer_id INTEGER NOT NULL,
+                    ultimo_id INTEGER NOT NULL,
+                    fecha_archivo TEXT NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS archivo_usuarios (
+                    user_id TEXT NOT NULL,
+                    archivo TEXT NOT NULL,
+                    filas INTEGER NOT NULL,
+                    PRIMARY KEY (user_id, archivo)
+                ) WITHOUT ROWID
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_archivo_segmentos_mes ON archivo_segmentos(mes)")
+
+    # ==================== Archivado ====================
+
+    def archivar_meses_antiguos(self):
+        """
+        Vuelca a disco los meses anteriores a los `meses_activos` más
+        recientes y los borra de `historial_consultas`.
+        Retorna el número de filas archivadas.
+        """
+        if self.meses_activos <= 0:
+            return 0
+        limite = _mes_limite(self.meses_activos)
+        cursor = self._db.conexion().cursor()
+        cursor.execute(
+            """SELECT DISTINCT substr(fecha, 1, 7) FROM historial_consultas
+               WHERE fecha < ? ORDER BY 1""",
+            (limite,),
+        )
+        total = 0
+        with self._lock:
+            for (mes,) in cursor.fetchall():
+                total += self._archivar_mes(mes)
+        return total
+
+    def _archivar_mes(self, mes):
+        """Escribe un segmento con las filas de un mes y las borra de la BD."""
+        os.makedirs(self.directorio, exist_ok=True)
+        cursor = self._db.conexion().cursor()
+        cursor.execute(
+            "SELECT MAX(id) FROM historial_consultas WHERE fecha >= ? AND fecha < ?",
+            (mes, self._siguiente_mes(mes)),
+        )
+        ultimo_id = cursor.fetchone()[0]
+        if ultimo_id is None:
+            return 0
+
+        numero = self._db.conexion().execute(
+            "SELECT COUNT(*) FROM archivo_segmentos WHERE mes = ?", (mes,)
+        ).fetchone()[0]
+        nombre = f"historial_{mes}.{numero}.jsonl.gz"
+        ruta = os.path.join(self.directorio, nombre)
+        temporal = ruta + ".tmp"
+
+        filas, primer_id, usuarios = 0, None, {}
+        cursor.execute(
+            f"""SELECT {", ".join(COLUMNAS)} FROM historial_consultas
+                WHERE fecha >= ? AND fecha < ? AND id <= ?
+                ORDER BY id""",
+            (mes, self._siguiente_mes(mes), ultimo_id),
+        )
+        with gzip.open(temporal, "wt", encoding="utf-8") as salida:
+            for fila in cursor:
+                registro = dict(zip(COLUMNAS, fila))
+                salida.write(json.dumps(registro, ensure_ascii=False) + "\n")
+                filas += 1
+                if primer_id is None:
+                    primer_id = registro["id"]
+                usuarios[registro["user_id"]] = usuarios.get(registro["user_id"], 0) + 1
+        if not filas:
+            os.remove(temporal)
+            return 0
+        os.replace(temporal, ruta)
+
+        # Índice y borrado en la misma transacción: o queda archivado o no
+        with self._db.transaccion() as conn:
+            conn.execute(
+                """INSERT OR REPLACE INTO archivo_segmentos
+                   (archivo, mes, filas, bytes, primer_id, ultimo_id, fecha_archivo)
+                   VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                (nombre, mes, filas, os.path.getsize(ruta), primer_id, ultimo_id,
+                 datetime.now().isoformat()),
+            )
+            conn.executemany(
+                "INSERT OR REPLACE INTO archivo_usuarios (user_id, archivo, filas) VALUES (?, ?, ?)",
+                [(user_id, nombre, n) for user_id, n in usuarios.items()],
+            )
+            conn.execute(
+                "DELETE FROM historial_consultas WHERE fecha >= ? AND fecha < ? AND id <= ?",
+                (mes, self._siguiente_mes(mes), ultimo_id),
+            )
+        logger.info(f"Historial de {mes} archivado: {filas} consultas en {nombre}")
+        return filas
+
+    @staticmethod
+    def _siguiente_mes(mes):
+        anio, numero = int(mes[:4]), int(mes[5:7])
+        return f"{anio + numero // 12:04d}-{numero % 12 + 1:02d}"
+
+    # ==================== Lectura en streaming ====================
+
+    def _segmentos(self, desde=None, hasta=None, user_id=None):
+        """Segmentos (nombre, mes) que pueden contener filas del rango/usuario."""
+        consulta = "SELECT s.archivo, s.mes FROM archivo_segmentos s"
+        condiciones, parametros = [], []
+        if user_id is not None:
+            consulta += " JOIN archivo_usuarios u ON u.archivo = s.archivo"
+            condiciones.append("u.user_id = ?")
+            parametros.append(user_id)
+        if desde:
+            condiciones.append("s.mes >= ?")
+            parametros.append(desde[:7])
+        if hasta:
+            condiciones.append("s.mes <= ?")
+            parametros.append(hasta[:7])
+        if condiciones:
+            consulta += " WHERE " + " AND ".join(condiciones)
+        consulta += " ORDER BY s.mes, s.primer_id"
+        return self._db.conexion().execute(consulta, parametros).fetchall()
+
+    def leer(self, desde=None, hasta=None, user_id=None):
+        """
+        Recorre las consultas archivadas en orden cronológico, sin cargar
+        los segmentos en memoria. `desde`/`hasta` son fechas ISO (inclusive
+        y exclusiva respectivamente).
+        """
+        for nombre, _ in self._segmentos(desde, hasta, user_id):
+            for registro in self._leer_segmento(nombre, user_id):
+                if desde and registro["fecha"] < desde:
+                    continue
+                if hasta and registro["fecha"] >= hasta:
+                    continue
+                yield registro
+
+    def _leer_segmento(self, nombre, user_id=None):
+        """Filas de un segmento, filtradas opcionalmente por usuario."""
+        ruta = os.path.join(self.directorio, nombre)
+        try:
+            with gzip.open(ruta, "rt", encoding="utf-8") as entrada:
+                for linea in entrada:
+                    registro = json.loads(linea)
+                    if user_id is None or registro["user_id"] == user_id:
+                        yield registro
+        except FileNotFoundError:
+            logger.error(f"Segmento de historial no encontrado: {ruta}")
+
+    def historial_usuario(self, user_id, limite=10):
+        """Últimas consultas archivadas de un usuario, de la más reciente a la más antigua."""
+        resultado = []
+        # Del segmento más reciente al más antiguo, hasta completar el límite
+        for nombre, _ in reversed(self._segmentos(user_id=user_id)):
+            filas = sorted(self._leer_segmento(nombre, user_id), key=lambda r: r["fecha"], reverse=True)
+            resultado.extend(filas)
+            if len(resultado) >= limite:
+                break
+        return resultado[:limite]
+
+    def iterar_historial(self, desde=None, hasta=None, user_id=None):
+        """Historial completo (archivado + activo) en orden cronológico."""
+        yield from self.leer(desde, hasta, user_id)
+        consulta = f"SELECT {', '.join(COLUMNAS)} FROM historial_consultas"
+        condiciones, parametros = [], []
+        if user_id is not None:
+            condiciones.append("user_id = ?")
+            parametros.append(user_id)
+        if desde:
+            condiciones.append("fecha >= ?")
+            parametros.append(desde)
+        if hasta:
+            condiciones.append("fecha < ?")
+            parametros.append(hasta)
+        if condiciones:
+            consulta += " WHERE " + " AND ".join(condiciones)
+        consulta += " ORDER BY fecha, id"
+        for fila in self._db.conexion().execute(consulta, parametros):
+            yield dict(zip(COLUMNAS, fila))
+
+    # ==================== Mantenimiento ====================
+
+    def vacuum_incremental(self, pausa=0.05):
+        """
+        Devuelve al sistema las páginas libres en tandas pequeñas, para no
+        bloquear a los escritores. Retorna las páginas liberadas.
+        """
+        conn = self._db.conexion()
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            # Base de datos creada sin auto_vacuum: se convierte una sola vez
+            logger.info("Activando auto_vacuum incremental (VACUUM completo, una sola vez)")
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.execute("VACUUM")
+            return 0
+        liberadas = 0
+        while True:
+            libres = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if not libres:
+                break
+            tanda = min(libres, self.paginas_vacuum)
+            # executescript recorre todos los pasos del PRAGMA (execute solo el primero)
+            conn.executescript(f"PRAGMA incremental_vacuum({tanda});")
+            liberadas += tanda
+            if self._detener.wait(pausa):
+                break
+        if liberadas:
+            logger.info(f"VACUUM incremental: {liberadas} páginas liberadas")
+        return liberadas
+
+    def mantenimiento(self):
+        """Archiva los meses antiguos y recupera el espacio que dejan."""
+        try:
+            archivadas = self.archivar_meses_antiguos()
+            if archivadas:
+                self.vacuum_incremental()
+        except Exception as e:
+            logger.error(f"Error en mantenimiento del historial: {e}")
+
+    def iniciar(self):
+        """Arranca el hilo de mantenimiento periódico."""
+        if self._hilo and self._hilo.is_alive():
+            return
+        self._detener.clear()
+        self._hilo = threading.Thread(
+            target=self._bucle, name="mantenimiento-historial", daemon=True
+        )
+        self._hilo.start()
+
+    def detener(self, timeout=10):
+        """Detiene el hilo de mantenimiento."""
+        self._detener.set()
+        if self._hilo:
+            self._hilo.join(timeout)
+            self._hilo = None
+
+    def _bucle(self):
+        # Primera pasada poco después de arrancar, luego cada intervalo
+        espera = 60
+        while not self._detener.wait(espera):
+            inicio = time.monotonic()
+            self.mantenimiento()
+            logger.debug(f"Mantenimiento del historial en {time.monotonic() - inicio:.1f}s")
+            espera = self.intervalo
+
+    def metricas(self):
+        """Segmentos archivados, filas y bytes en disco."""
+        fila = self._db.conexion().execute(
+            "SELECT COUNT(*), COALESCE(SUM(filas), 0), COALESCE(SUM(bytes), 0) FROM archivo_segmentos"
+        ).fetchone()
+        return {"segmentos": fila[0], "filas_archivadas": fila[1], "bytes_archivo": fila[2]}
@@ -0,0 +1,358 @@
+"""
+Bandeja de salida (outbox) de los mensajes de WhatsApp.
+Cada respuesta se guarda en SQLite en la misma transacción que su fila del
+historial, ya partida en los trozos que admite WhatsApp. Un hilo la drena en
+lotes: reclama el primer envío pendiente de cada teléfono (así las partes de
+un mensaje largo llegan en orden), los envía en paralelo por el transporte
+compartido (pool keep-alive y limitador de ritmo) y reintenta con espera
+exponencial los que fallan. Como todo está en la base de datos, lo que no se
+llegó a enviar sale al reiniciar el proceso.
+"""
+
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from config.settings import (
+    BANDEJA_ESPERA_BASE_SEGUNDOS,
+    BANDEJA_ESPERA_MAX_SEGUNDOS,
+    BANDEJA_HILOS_ENVIO,
+    BANDEJA_INTERVALO_SEGUNDOS,
+    BANDEJA_MAX_INTENTOS,
+    BANDEJA_RECLAMO_SEGUNDOS,
+    BANDEJA_TAMANO_LOTE,
+    OPENAI_STREAMING_MIN_CARACTERES,
+)
+from services.metricas import LATENCIA_BANDEJA, LATENCIA_PRIMER_FRAGMENTO
+from services.whatsapp_service import LIMITE_CARACTERES, WhatsAppService
+from utils.fragmentos import FragmentadorParrafos
+
+logger = logging.getLogger(__name__)
+
+# Errores 4xx que sí pueden salir bien más tarde
+ESTADOS_TRANSITORIOS = (408, 425, 429)
+
+
+class BandejaSalida:
+    """Envíos pendientes persistidos en SQLite y el hilo que los drena."""
+
+    def __init__(
+        self,
+        db,
+        tamano_lote=BANDEJA_TAMANO_LOTE,
+        hilos_envio=BANDEJA_HILOS_ENVIO,
+        intervalo=BANDEJA_INTERVALO_SEGUNDOS,
+        max_intentos=BANDEJA_MAX_INTENTOS,
+        espera_base=BANDEJA_ESPERA_BASE_SEGUNDOS,
+        espera_max=BANDEJA_ESPERA_MAX_SEGUNDOS,
+        reclamo=BANDEJA_RECLAMO_SEGUNDOS,
+    ):
+        self._db = db
+        self.tamano_lote = tamano_lote
+        self.hilos_envio = max(1, hilos_envio)
+        self.intervalo = intervalo
+        self.max_intentos = max_intentos
+        self.espera_base = espera_base
+        self.espera_max = espera_max
+        self.reclamo = reclamo
+        self._whatsapp = None
+        self._pool = None
+        self._hilo = None
+        self._detener = threading.Event()
+        self._aviso = threading.Event()
+        self._lock = threading.Lock()
+        self._contadores = {
+            "encolados": 0,
+            "enviados": 0,
+            "reintentos": 0,
+            "fallidos": 0,
+            "lotes": 0,
+            "errores": 0,
+        }
+        self._crear_tablas()
+
+    def _crear_tablas(self):
+        with self._db.transaccion() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS bandeja_salida (
+                    id INTEGER PRIMARY KEY,
+                    telefono TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    estado TEXT NOT NULL DEFAULT 'pendiente',
+                    intentos INTEGER NOT NULL DEFAULT 0,
+                    creado REAL NOT NULL,
+                    proximo_intento REAL NOT NULL,
+                    reclamado REAL,
+                    ultimo_error TEXT
+                )
+            """)
+            # Primer envío por teléfono; los fallidos definitivos no bloquean la cola
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_bandeja_telefono
+                ON bandeja_salida(telefono, id) WHERE estado != 'fallido'
+            """)
+
+    # ==================== Encolado ====================
+
+    def agregar(self, conn, telefono, mensaje, adjuntos=()):
+        """
+        Inserta el mensaje (partido si es largo) y los payloads adjuntos
+        usando la transacción del llamante. Después de confirmarla hay que
+        llamar a avisar() para que el hilo no espere al siguiente intervalo.
+        """
+        payloads = [
+            WhatsAppService.payload_texto(telefono, parte)
+            for parte in WhatsAppService.dividir_mensaje(mensaje)
+        ]
+        payloads.extend(adjuntos)
+        ahora = time.time()
+        conn.executemany(
+            """INSERT INTO bandeja_salida (telefono, payload, creado, proximo_intento)
+               VALUES (?, ?, ?, ?)""",
+            [(telefono, json.dumps(p, ensure_ascii=False), ahora, ahora) for p in payloads],
+        )
+        with self._lock:
+            self._contadores["encolados"] += len(payloads)
+        return len(payloads)
+
+    def encolar(self, telefono, mensaje, adjuntos=()):
+        """Encola un mensaje que no va asociado a una fila del historial."""
+        try:
+            with self._db.transaccion() as conn:
+                self.agregar(conn, telefono, mensaje, adjuntos)
+        except Exception as e:
+            logger.error(f"Error encolando mensaje para {telefono}: {e}")
+            with self._lock:
+                self._contadores["errores"] += 1
+            return False
+        self.avisar()
+        return True
+
+    def avisar(self):
+        """Despierta al hilo de envío."""
+        self._aviso.set()
+
+    # ==================== Ciclo de vida ====================
+
+    def iniciar(self, whatsapp):
+        """Arranca el hilo de envío; los pendientes de una ejecución anterior salen ya."""
+        if self._hilo and self._hilo.is_alive():
+            return
+        self._whatsapp = whatsapp
+        self._detener.clear()
+        self._pool = ThreadPoolExecutor(self.hilos_envio, thread_name_prefix="bandeja-envio")
+        self._hilo = threading.Thread(target=self._bucle, name="bandeja-salida", daemon=True)
+        self._hilo.start()
+
+    def detener(self, timeout=10):
+        """
+        Termina el lote en curso y detiene el hilo. Lo que quede pendiente
+        sigue en SQLite y se enviará al volver a arrancar.
+        """
+        self._detener.set()
+        self._aviso.set()
+        if self._hilo:
+            self._hilo.join(timeout)
+            self._hilo = None
+        if self._pool:
+            self._pool.shutdown(wait=False)
+            self._pool = None
+
+    def _bucle(self):
+        while not self._detener.is_set():
+            self._aviso.clear()
+            # Tras un lote se sigue sin esperar: puede haber otra parte del mismo teléfono
+            if self.procesar_lote() == 0:
+                self._aviso.wait(self.intervalo)
+
+    # ==================== Envío ====================
+
+    def procesar_lote(self):
+        """Reclama, envía y confirma un lote. Devuelve cuántos envíos intentó."""
+        filas = self._reclamar()
+        if not filas:
+            return 0
+        resultados = None
+        if self._pool:
+            try:
+                resultados = list(self._pool.map(self._enviar_fila, filas))
+            except RuntimeError:
+                # Al salir, concurrent.futures cierra los pools antes que
+                # nuestros atexit: el lote en curso se envía en este hilo
+                pass
+        if resultados is None:
+            resultados = [self._enviar_fila(fila) for fila in filas]
+        self._confirmar(filas, resultados)
+        with self._lock:
+            self._contadores["lotes"] += 1
+        return len(filas)
+
+    def _reclamar(self):
+        """
+        Marca como 'enviando' el envío más antiguo de cada teléfono que ya
+        toque intentar. Con varios procesos, el UPDATE dentro de BEGIN
+        IMMEDIATE impide que dos reclamen la misma fila; las reclamadas por
+        un proceso que murió vuelven a estar disponibles pasado `reclamo`.
+        """
+        ahora = time.time()
+        try:
+            with self._db.transaccion() as conn:
+                return conn.execute(
+                    """UPDATE bandeja_salida SET estado = 'enviando', reclamado = ?
+                       WHERE id IN (
+                           SELECT b.id FROM (
+                               SELECT MIN(id) AS id FROM bandeja_salida
+                               WHERE estado != 'fallido' GROUP BY telefono
+                           ) AS primeros
+                           JOIN bandeja_salida b ON b.id = primeros.id
+                           WHERE (b.estado = 'pendiente' AND b.proximo_intento <= ?)
+                              OR (b.estado = 'enviando' AND b.reclamado <= ?)
+                           ORDER BY b.id LIMIT ?
+                       )
+                       RETURNING id, telefono, payload, intentos, creado""",
+                    (ahora, ahora, ahora - self.reclamo, self.tamano_lote),
+                ).fetchall()
+        except Exception as e:
+            logger.error(f"Error reclamando envíos de la bandeja de salida: {e}")
+            with self._lock:
+                self._contadores["errores"] += 1
+            return []
+
+    def _enviar_fila(self, fila):
+        """
+        Envía un payload. Devuelve (enviado, espera, definitivo, error):
+        `espera` es el Retry-After del proveedor si lo indicó y `definitivo`
+        marca los rechazos que no tiene sentido reintentar.
+        """
+        _, telefono, payload, _, creado = fila
+        try:
+            self._whatsapp.enviar_payload(json.loads(payload))
+        except requests.exceptions.HTTPError as e:
+            estado = e.response.status_code if e.response is not None else None
+            retry_after = e.response.headers.get("Retry-After", "") if e.response is not None else ""
+            espera = float(retry_after) if retry_after.isdigit() else None
+            definitivo = estado is not None and 400 <= estado < 500 and estado not in ESTADOS_TRANSITORIOS
+            logger.warning(f"WhatsApp rechazó el envío a {telefono} ({estado}): {e}")
+            return False, espera, definitivo, str(e)
+        except Exception as e:
+            logger.warning(f"Error enviando a {telefono}, se reintentará: {e}")
+            return False, None, False, str(e)
+        LATENCIA_BANDEJA.observar(max(0.0, time.time() - creado))
+        return True, None, False, None
+
+    def _confirmar(self, filas, resultados):
+        """Borra los enviados y reprograma (o da por fallidos) los demás."""
+        ahora = time.time()
+        enviados, reprogramados, fallidos = [], [], []
+        for (id_fila, telefono, _, intentos, _), (ok, espera, definitivo, error) in zip(filas, resultados):
+            if ok:
+                enviados.append((id_fila,))
+            elif definitivo or intentos + 1 >= self.max_intentos:
+                fallidos.append((error, id_fila))
+                logger.error(f"Envío a {telefono} descartado tras {intentos + 1} intentos: {error}")
+            else:
+                if espera is None:
+                    espera = min(self.espera_max, self.espera_base * (2 ** intentos))
+                reprogramados.append((ahora + espera, error, id_fila))
+        try:
+            with self._db.transaccion() as conn:
+                conn.executemany("DELETE FROM bandeja_salida WHERE id = ?", enviados)
+                conn.executemany(
+                    """UPDATE bandeja_salida
+                       SET estado = 'pendiente', intentos = intentos + 1,
+                           proximo_intento = ?, ultimo_error = ?, reclamado = NULL
+                       WHERE id = ?""",
+                    reprogramados,
+                )
+                conn.executemany(
+                    """UPDATE bandeja_salida
+                       SET estado = 'fallido', intentos = intentos + 1, ultimo_error = ?
+                       WHERE id = ?""",
+                    fallidos,
+                )
+        except Exception as e:
+            # Las filas siguen 'enviando' y se reintentarán pasado `reclamo`
+            logger.error(f"Error confirmando envíos de la bandeja de salida: {e}")
+            with self._lock:
+                self._contadores["errores"] += 1
+            return
+        with self._lock:
+            self._contadores["enviados"] += len(enviados)
+            self._contadores["reintentos"] += len(reprogramados)
+            self._contadores["fallidos"] += len(fallidos)
+
+    # ==================== Métricas ====================
+
+    def metricas(self):
+        """Profundidad de la bandeja, antigüedad del envío más viejo y contadores."""
+        with self._lock:
+            datos = dict(self._contadores)
+        pendientes = enviando = fallidos_tabla = 0
+        antiguedad = 0.0
+        try:
+            conn = self._db.conexion()
+            for estado, cantidad, creado in conn.execute(
+                "SELECT estado, COUNT(*), MIN(creado) FROM bandeja_salida GROUP BY estado"
+            ):
+                if estado == "pendiente":
+                    pendientes = cantidad
+                elif estado == "enviando":
+                    enviando = cantidad
+                else:
+                    fallidos_tabla = cantidad
+                    continue
+                antiguedad = max(antiguedad, time.time() - creado)
+        except Exception as e:
+            logger.error(f"Error leyendo métricas de la bandeja de salida: {e}")
+        datos.update({
+            "pendientes": pendientes,
+            "enviando": enviando,
+            "fallidos_guardados": fallidos_tabla,
+            "antiguedad_segundos": round(antiguedad, 3),
+        })
+        return datos
+
+
+class EntregaProgresiva:
+    """
+    Entrega por fragmentos de una respuesta que llega en streaming: cada
+    párrafo o grupo de viñetas completo entra en la bandeja de salida (y
+    sale hacia WhatsApp) sin esperar al resto. Lo que quede al terminar,
+    `resto()`, se encola junto a la fila del historial. Si el stream se
+    corta después de enviar algo, `interrumpida` lo indica.
+    """
+
+    def __init__(self, bandeja, telefono, minimo=OPENAI_STREAMING_MIN_CARACTERES):
+        self.bandeja = bandeja
+        self.telefono = telefono
+        self.enviados = 0
+        self.interrumpida = False
+        self._fragmentador = FragmentadorParrafos(LIMITE_CARACTERES, minimo)
+        self._partes = []
+        self._sin_encolar = []
+        self._inicio = time.perf_counter()
+
+    def agregar(self, texto):
+        """Añade un trozo del stream y encola los fragmentos que ya están completos."""
+        self._partes.append(texto)
+        for fragmento in self._fragmentador.agregar(texto):
+            # Si uno falla, los siguientes esperan detrás para no desordenarse
+            if not self._sin_encolar and self.bandeja.encolar(self.telefono, fragmento):
+                if self.enviados == 0:
+                    LATENCIA_PRIMER_FRAGMENTO.observar(time.perf_counter() - self._inicio)
+                self.enviados += 1
+            else:
+                self._sin_encolar.append(fragmento)
+
+    @property
+    def texto(self):
+        """La respuesta completa recibida hasta ahora."""
+        return "".join(self._partes)
+
+    def resto(self):
+        """Lo que aún no se ha encolado: los fragmentos pendientes y el final del stream."""
+        return "\n\n".join(self._sin_encolar + [self._fragmentador.terminar()]).strip()
@@ -0,0 +1,119 @@
+"""
+Caché de respuestas de la IA.
+Evita repetir llamadas a OpenAI cuando una pregunta casi idéntica, en el
+mismo idioma y con el mismo contexto local, ya se respondió hace poco
+(por ejemplo, preguntas repetidas sobre malaria o cólera en un brote).
+El contexto propio del usuario (resumen, turnos, historial, intereses)
+también entra en la clave: una pregunta corta como "¿y para niños?" no
+significa lo mismo en dos conversaciones distintas.
+Expulsión LRU, caducidad por TTL y límite de memoria en bytes.
+"""
+
+import hashlib
+import logging
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+from config.settings import (
+    CACHE_RESPUESTAS_CATEGORIAS_EXCLUIDAS,
+    CACHE_RESPUESTAS_MAX_BYTES,
+    CACHE_RESPUESTAS_TTL_SEGUNDOS,
+)
+
+logger = logging.getLogger(__name__)
+
+_NO_ALFANUMERICO = re.compile(r"[^\w]+")
+
+
+def normalizar_pregunta(texto):
+    """Minúsculas, sin tildes, sin puntuación y con espacios simples."""
+    texto = unicodedata.normalize("NFKD", texto.lower())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    return _NO_ALFANUMERICO.sub(" ", texto).strip()
+
+
+class CacheRespuestas:
+    """Caché LRU con TTL y límite de tamaño para respuestas de la IA."""
+
+    def __init__(
+        self,
+        ttl=CACHE_RESPUESTAS_TTL_SEGUNDOS,
+        max_bytes=CACHE_RESPUESTAS_MAX_BYTES,
+        categorias_excluidas=CACHE_RESPUESTAS_CATEGORIAS_EXCLUIDAS,
+    ):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.categorias_excluidas = set(categorias_excluidas)
+        self._entradas = OrderedDict()  # clave -> (respuesta, caduca, bytes)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._contadores = {"aciertos": 0, "fallos": 0, "guardadas": 0, "expulsadas": 0, "caducadas": 0}
+
+    def admite(self, categoria):
+        """Indica si las respuestas de esta categoría se pueden cachear."""
+        return self.ttl > 0 and categoria not in self.categorias_excluidas
+
+    @staticmethod
+    def clave(pregunta, idioma, contexto="", contexto_usuario=""):
+        """Clave: pregunta normalizada + idioma + huellas del contexto local y del usuario."""
+        huella = hashlib.blake2b(contexto.encode("utf-8"), digest_size=8).hexdigest()
+        if contexto_usuario:
+            huella += hashlib.blake2b(contexto_usuario.encode("utf-8"), digest_size=8).hexdigest()
+        return f"{idioma}|{huella}|{normalizar_pregunta(pregunta)}"
+
+    def obtener(self, clave):
+        """Devuelve la respuesta cacheada o None."""
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is None:
+                self._contadores["fallos"] += 1
+                return None
+            respuesta, caduca, tamano = entrada
+            if caduca < time.monotonic():
+                del self._entradas[clave]
+                self._bytes -= tamano
+                self._contadores["caducadas"] += 1
+                self._contadores["fallos"] += 1
+                return None
+            self._entradas.move_to_end(clave)
+            self._contadores["aciertos"] += 1
+            return respuesta
+
+    def guardar(self, clave, respuesta, categoria=None):
+        """Guarda una respuesta si su categoría lo permite."""
+        if not respuesta or not self.admite(categoria):
+            return
+        tamano = len(clave.encode("utf-8")) + len(respuesta.encode("utf-8"))
+        if tamano > self.max_bytes:
+            return
+        with self._lock:
+            anterior = self._entradas.pop(clave, None)
+            if anterior:
+                self._bytes -= anterior[2]
+            self._entradas[clave] = (respuesta, time.monotonic() + self.ttl, tamano)
+            self._bytes += tamano
+            self._contadores["guardadas"] += 1
+            while self._bytes > self.max_bytes:
+                _, (_, _, liberado) = self._entradas.popitem(last=False)
+                self._bytes -= liberado
+                self._contadores["expulsadas"] += 1
+
+    def limpiar(self):
+        """Vacía la caché."""
+        with self._lock:
+            self._entradas.clear()
+            self._bytes = 0
+
+    def metricas(self):
+        """Aciertos, fallos, tasa de acierto y ocupación."""
+        with self._lock:
+            datos = dict(self._contadores)
+            datos["entradas"] = len(self._entradas)
+            datos["bytes"] = self._bytes
+        consultas = datos["aciertos"] + datos["fallos"]
+        datos["tasa_aciertos"] = round(datos["aciertos"] / consultas, 3) if consultas else 0.0
+        datos["max_bytes"] = self.max_bytes
+        return datos
@@ -0,0 +1,94 @@
+"""
+Coalescencia de peticiones ("single-flight").
+Cuando varios usuarios hacen la misma pregunta a la vez, solo el primero
+llama a OpenAI; los demás esperan ese resultado en lugar de lanzar su
+propia petición. Si la llamada falla, todos reciben el mismo error.
+Solo se agrupan peticiones con exactamente el mismo prompt (ver
+`clave_mensajes`): el historial y el perfil de cada usuario forman parte
+de él, y la respuesta del primero no vale para otra conversación.
+"""
+
+import hashlib
+import json
+import logging
+import threading
+
+from config.settings import COALESCENCIA_TIMEOUT_SEGUNDOS
+
+logger = logging.getLogger(__name__)
+
+
+def clave_mensajes(messages):
+    """Huella de la lista completa de mensajes enviada a OpenAI."""
+    serializado = json.dumps(messages, ensure_ascii=False, sort_keys=True)
+    return hashlib.blake2b(serializado.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class _Vuelo:
+    """Llamada en curso para una clave."""
+
+    __slots__ = ("evento", "resultado", "error", "esperando")
+
+    def __init__(self):
+        self.evento = threading.Event()
+        self.resultado = None
+        self.error = None
+        self.esperando = 0
+
+
+class Coalescedor:
+    """Agrupa llamadas simultáneas con la misma clave en una sola."""
+
+    def __init__(self, timeout=COALESCENCIA_TIMEOUT_SEGUNDOS):
+        self.timeout = timeout
+        self._vuelos = {}
+        self._lock = threading.Lock()
+        self._contadores = {"llamadas": 0, "llamadas_ahorradas": 0, "errores": 0, "timeouts": 0}
+
+    def ejecutar(self, clave, funcion, timeout=None):
+        """
+        Ejecuta funcion() o, si ya hay una llamada en curso con la misma
+        clave, espera su resultado. Lanza TimeoutError si la espera supera
+        `timeout` y propaga la excepción de la llamada original.
+        """
+        with self._lock:
+            vuelo = self._vuelos.get(clave)
+            lider = vuelo is None
+            if lider:
+                vuelo = self._vuelos[clave] = _Vuelo()
+                self._contadores["llamadas"] += 1
+            else:
+                vuelo.esperando += 1
+
+        if lider:
+            try:
+                vuelo.resultado = funcion()
+                return vuelo.resultado
+            except Exception as e:
+                vuelo.error = e
+                with self._lock:
+                    self._contadores["errores"] += 1
+                raise
+            finally:
+                with self._lock:
+                    del self._vuelos[clave]
+                vuelo.evento.set()
+                if vuelo.esperando:
+                    logger.info(f"Llamada compartida con {vuelo.esperando} peticiones en espera")
+
+        if not vuelo.evento.wait(self.timeout if timeout is None else timeout):
+            with self._lock:
+                self._contadores["timeouts"] += 1
+            raise TimeoutError("Tiempo agotado esperando una petición idéntica en curso")
+        if vuelo.error is not None:
+            raise vuelo.error
+        with self._lock:
+            self._contadores["llamadas_ahorradas"] += 1
+        return vuelo.resultado
+
+    def metricas(self):
+        """Llamadas reales, llamadas ahorradas y peticiones en curso."""
+        with self._lock:
+            datos = dict(self._contadores)
+            datos["en_curso"] = len(self._vuelos)
+        return datos
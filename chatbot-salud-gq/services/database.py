@@ -0,0 +1,193 @@
+"""
+Capa de conexiones SQLite para la memoria del chatbot.
+Mantiene una conexión de larga duración por hilo, en modo WAL, para que
+cada mensaje no tenga que abrir y cerrar la base de datos varias veces.
+La conexión se cierra cuando termina su hilo: el servidor de desarrollo
+crea un hilo por petición y, si no, cada webhook dejaría una conexión (y
+los descriptores del WAL) abierta hasta apagar el proceso.
+"""
+
+import logging
+import sqlite3
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+
+from config.settings import (
+    SQLITE_BUSY_TIMEOUT_MS,
+    SQLITE_CACHE_SENTENCIAS,
+    SQLITE_SYNCHRONOUS,
+)
+from services.metricas import LATENCIA_SQLITE
+
+logger = logging.getLogger(__name__)
+
+
+class _CursorMedido(sqlite3.Cursor):
+    """Cursor que mide la duración de cada sentencia."""
+
+    def execute(self, *args):
+        inicio = time.perf_counter()
+        try:
+            return super().execute(*args)
+        finally:
+            LATENCIA_SQLITE.observar(time.perf_counter() - inicio)
+
+    def executemany(self, *args):
+        inicio = time.perf_counter()
+        try:
+            return super().executemany(*args)
+        finally:
+            LATENCIA_SQLITE.observar(time.perf_counter() - inicio)
+
+
+class _ConexionMedida(sqlite3.Connection):
+    """Conexión cuyos cursores (y sus atajos execute) miden cada sentencia."""
+
+    def cursor(self, factory=_CursorMedido):
+        return super().cursor(factory)
+
+    def execute(self, *args):
+        inicio = time.perf_counter()
+        try:
+            return super().execute(*args)
+        finally:
+            LATENCIA_SQLITE.observar(time.perf_counter() - inicio)
+
+    def executemany(self, *args):
+        inicio = time.perf_counter()
+        try:
+            return super().executemany(*args)
+        finally:
+            LATENCIA_SQLITE.observar(time.perf_counter() - inicio)
+
+
+class _Titular:
+    """
+    Conexión de un hilo. Vive solo en el threading.local de ese hilo, así
+    que se libera cuando el hilo termina y su finalizador cierra la conexión.
+    """
+
+    __slots__ = ("conn", "profundidad", "__weakref__")
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.profundidad = 0
+
+
+class GestorConexiones:
+    """Entrega una conexión SQLite por hilo y gestiona transacciones y cierre."""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._conexiones = set()
+        self._cerrado = False
+
+    def _abrir(self):
+        """Abre y configura una conexión nueva para el hilo actual."""
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=SQLITE_BUSY_TIMEOUT_MS / 1000,
+            isolation_level=None,  # Las transacciones se abren explícitamente
+            check_same_thread=False,  # Solo para poder cerrarla al apagar
+            cached_statements=SQLITE_CACHE_SENTENCIAS,
+            factory=_ConexionMedida,
+        )
+        # Solo tiene efecto al crear la base de datos (antes del modo WAL);
+        # las existentes se convierten en el mantenimiento del historial
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+        conn.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA foreign_keys=ON")
+        with self._lock:
+            self._conexiones.add(conn)
+        return conn
+
+    def _liberar(self, conn):
+        """Cierra la conexión de un hilo que ha terminado."""
+        with self._lock:
+            if conn not in self._conexiones:
+                return  # Ya cerrada por cerrar()
+            self._conexiones.discard(conn)
+        try:
+            conn.close()
+        except sqlite3.Error as e:
+            logger.error(f"Error cerrando conexión SQLite: {e}")
+
+    def _titular(self):
+        """Titular de la conexión del hilo actual, creándolo si hace falta."""
+        titular = getattr(self._local, "titular", None)
+        if titular is None:
+            if self._cerrado:
+                raise sqlite3.ProgrammingError("El gestor de conexiones está cerrado")
+            conn = self._abrir()
+            titular = self._local.titular = _Titular(conn)
+            weakref.finalize(titular, self._liberar, conn)
+        return titular
+
+    def conexion(self):
+        """Devuelve la conexión del hilo actual, creándola si hace falta."""
+        return self._titular().conn
+
+    def abiertas(self):
+        """Número de conexiones abiertas (una por hilo vivo que ha usado la base)."""
+        with self._lock:
+            return len(self._conexiones)
+
+    @contextmanager
+    def transaccion(self):
+        """
+        Transacción de escritura sobre la conexión del hilo.
+        Es reentrante: las transacciones anidadas se unen a la exterior,
+        así varias operaciones pueden agruparse en un único commit. Cada
+        una abre un SAVEPOINT, de modo que si falla se deshace solo lo
+        suyo y no queda a medias dentro del commit de la exterior.
+        """
+        titular = self._titular()
+        conn = titular.conn
+        if titular.profundidad > 0:
+            punto = f"anidada_{titular.profundidad}"
+            conn.execute(f"SAVEPOINT {punto}")
+            titular.profundidad += 1
+            try:
+                yield conn
+                conn.execute(f"RELEASE {punto}")
+            except BaseException:
+                if conn.in_transaction:
+                    conn.execute(f"ROLLBACK TO {punto}")
+                    conn.execute(f"RELEASE {punto}")
+                raise
+            finally:
+                titular.profundidad -= 1
+            return
+
+        conn.execute("BEGIN IMMEDIATE")
+        titular.profundidad = 1
+        try:
+            yield conn
+            conn.execute("COMMIT")
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            titular.profundidad = 0
+
+    def cerrar(self):
+        """Cierra todas las conexiones abiertas (hook de apagado)."""
+        with self._lock:
+            self._cerrado = True
+            conexiones, self._conexiones = self._conexiones, set()
+        for conn in conexiones:
+            try:
+                conn.close()
+            except sqlite3.Error as e:
+                logger.error(f"Error cerrando conexión SQLite: {e}")
+        self._local = threading.local()
+        if conexiones:
+            logger.info(f"Cerradas {len(conexiones)} conexiones SQLite")
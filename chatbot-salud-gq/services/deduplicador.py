@@ -0,0 +1,124 @@
+"""
+Deduplicación de webhooks por message_id.
+El proveedor reenvía la notificación si nuestro 200 tarda, y cada reenvío
+generaría otra respuesta, otra fila en el historial y otra llamada a OpenAI.
+Cada message_id se reclama una sola vez: primero se consulta un conjunto
+acotado en memoria (los reenvíos se descartan en microsegundos) y después
+una tabla SQLite con caducidad, donde un único INSERT decide quién lo
+procesa aunque haya varios hilos o procesos de gunicorn.
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from config.settings import MENSAJES_DEDUP_MAX_MEMORIA, MENSAJES_DEDUP_TTL_HORAS
+
+logger = logging.getLogger(__name__)
+
+
+class DeduplicadorMensajes:
+    """Reclamo atómico de message_id con caducidad."""
+
+    def __init__(self, db, ttl_horas=MENSAJES_DEDUP_TTL_HORAS, max_memoria=MENSAJES_DEDUP_MAX_MEMORIA):
+        self._db = db
+        self.ttl = ttl_horas * 3600
+        self.max_memoria = max_memoria
+        self._vistos = OrderedDict()  # message_id -> instante de caducidad
+        self._lock = threading.Lock()
+        # Los caducados se borran de SQLite como mucho una vez por hora
+        self._intervalo_purga = min(3600, self.ttl / 2)
+        self._proxima_purga = time.time() + self._intervalo_purga
+        self._contadores = {
+            "nuevos": 0,
+            "duplicados_memoria": 0,
+            "duplicados_sqlite": 0,
+            "liberados": 0,
+            "purgados": 0,
+            "errores": 0,
+        }
+        self._crear_tablas()
+
+    def _crear_tablas(self):
+        with self._db.transaccion() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS mensajes_recibidos (
+                    message_id TEXT PRIMARY KEY,
+                    caduca REAL NOT NULL
+                ) WITHOUT ROWID
+            """)
+
+    def _recordar(self, message_id, caduca):
+        """Añade al conjunto en memoria (con el lock tomado)."""
+        self._vistos[message_id] = caduca
+        self._vistos.move_to_end(message_id)
+        while len(self._vistos) > self.max_memoria:
+            self._vistos.popitem(last=False)
+
+    def reclamar(self, message_id):
+        """
+        True si este proceso debe atender el mensaje; False si es un reenvío
+        de uno ya reclamado. Sin message_id, o si SQLite falla, se atiende:
+        es preferible responder dos veces a no responder.
+        """
+        if not message_id:
+            return True
+        ahora = time.time()
+        with self._lock:
+            caduca = self._vistos.get(message_id)
+            if caduca is not None and caduca > ahora:
+                self._contadores["duplicados_memoria"] += 1
+                return False
+
+        caduca = ahora + self.ttl
+        try:
+            with self._db.transaccion() as conn:
+                # Inserta, o reaprovecha la fila si ya había caducado
+                reclamado = conn.execute(
+                    """INSERT INTO mensajes_recibidos (message_id, caduca) VALUES (?, ?)
+                       ON CONFLICT(message_id) DO UPDATE SET caduca = excluded.caduca
+                       WHERE mensajes_recibidos.caduca <= ?""",
+                    (message_id, caduca, ahora),
+                ).rowcount == 1
+                purgados = 0
+                if ahora >= self._proxima_purga:
+                    self._proxima_purga = ahora + self._intervalo_purga
+                    purgados = conn.execute(
+                        "DELETE FROM mensajes_recibidos WHERE caduca <= ?", (ahora,)
+                    ).rowcount
+        except Exception as e:
+            logger.error(f"Error reclamando el mensaje {message_id}: {e}")
+            with self._lock:
+                self._contadores["errores"] += 1
+            return True
+
+        with self._lock:
+            # Reclamado aquí o por otro proceso: los reenvíos ya no llegan a SQLite
+            self._recordar(message_id, caduca)
+            self._contadores["nuevos" if reclamado else "duplicados_sqlite"] += 1
+            self._contadores["purgados"] += purgados
+        if not reclamado:
+            logger.info(f"Webhook duplicado descartado: {message_id}")
+        return reclamado
+
+    def liberar(self, message_id):
+        """Devuelve un mensaje reclamado que no se pudo encolar, para aceptar su reenvío."""
+        if not message_id:
+            return
+        with self._lock:
+            self._vistos.pop(message_id, None)
+            self._contadores["liberados"] += 1
+        try:
+            with self._db.transaccion() as conn:
+                conn.execute("DELETE FROM mensajes_recibidos WHERE message_id = ?", (message_id,))
+        except Exception as e:
+            logger.error(f"Error liberando el mensaje {message_id}: {e}")
+
+    def metricas(self):
+        """Mensajes nuevos, reenvíos descartados y tamaño del conjunto en memoria."""
+        with self._lock:
+            datos = dict(self._contadores)
+            datos["en_memoria"] = len(self._vistos)
+        datos["max_memoria"] = self.max_memoria
+        return datos
@@ -0,0 +1,173 @@
+"""
+Escritor en segundo plano para las escrituras de aprendizaje.
+Las operaciones de memoria (historial, conocimiento, patrones, perfiles)
+se encolan y un hilo las confirma en lotes, fuera del camino de respuesta.
+"""
+
+import logging
+import queue
+import threading
+import time
+
+from config.settings import (
+    ESCRITOR_INTERVALO_SEGUNDOS,
+    ESCRITOR_MAX_COLA,
+    ESCRITOR_TAMANO_LOTE,
+)
+
+logger = logging.getLogger(__name__)
+
+# Métodos de KnowledgeMemory que se pueden diferir
+OPERACIONES_PERMITIDAS = {
+    "registrar_consulta",
+    "guardar",
+    "actualizar_patron",
+    "actualizar_perfil",
+}
+
+
+class EscritorAprendizaje:
+    """Cola de escrituras diferidas drenada por un único hilo escritor."""
+
+    def __init__(
+        self,
+        memory,
+        tamano_lote=ESCRITOR_TAMANO_LOTE,
+        intervalo=ESCRITOR_INTERVALO_SEGUNDOS,
+        max_cola=ESCRITOR_MAX_COLA,
+    ):
+        self.memory = memory
+        self.tamano_lote = tamano_lote
+        self.intervalo = intervalo
+        self._cola = queue.Queue(maxsize=max_cola)
+        self._detener = threading.Event()
+        self._hilo = None
+        self._lock = threading.Lock()
+        self._contadores = {
+            "encoladas": 0,
+            "escritas": 0,
+            "lotes": 0,
+            "errores": 0,
+            "sincronas_por_cola_llena": 0,
+        }
+        self._ultimo_lote_ms = 0.0
+        self._mayor_profundidad = 0
+
+    # ==================== Ciclo de vida ====================
+
+    def iniciar(self):
+        """Arranca el hilo escritor."""
+        if self._hilo and self._hilo.is_alive():
+            return
+        self._detener.clear()
+        self._hilo = threading.Thread(
+            target=self._bucle, name="escritor-aprendizaje", daemon=True
+        )
+        self._hilo.start()
+        logger.info("Escritor de aprendizaje iniciado")
+
+    def detener(self, timeout=10):
+        """Detiene el hilo y confirma todo lo que quede en la cola."""
+        self._detener.set()
+        if self._hilo:
+            self._hilo.join(timeout)
+            self._hilo = None
+        # Lo que llegue después de parar el hilo se escribe aquí mismo
+        pendientes = self._extraer_pendientes()
+        if pendientes:
+            self._escribir_lote(pendientes)
+        logger.info("Escritor de aprendizaje detenido")
+
+    # ==================== Encolado ====================
+
+    def encolar(self, operacion, *args, **kwargs):
+        """Encola una llamada a un método de KnowledgeMemory."""
+        if operacion not in OPERACIONES_PERMITIDAS:
+            raise ValueError(f"Operación de memoria no diferible: {operacion}")
+
+        tarea = (operacion, args, kwargs)
+        if self._hilo is None:
+            # Sin hilo escritor (p. ej. ya detenido): escribir directamente
+            self._escribir_lote([tarea])
+            return
+
+        try:
+            self._cola.put_nowait(tarea)
+        except queue.Full:
+            # Contrapresión: si la cola está llena se escribe en línea
+            with self._lock:
+                self._contadores["sincronas_por_cola_llena"] += 1
+            self._escribir_lote([tarea])
+            return
+
+        with self._lock:
+            self._contadores["encoladas"] += 1
+            profundidad = self._cola.qsize()
+            if profundidad > self._mayor_profundidad:
+                self._mayor_profundidad = profundidad
+
+    # ==================== Hilo escritor ====================
+
+    def _bucle(self):
+        """Agrupa tareas hasta llenar un lote o agotar el intervalo."""
+        while not self._detener.is_set():
+            try:
+                primera = self._cola.get(timeout=self.intervalo)
+            except queue.Empty:
+                continue
+
+            lote = [primera]
+            limite = time.monotonic() + self.intervalo
+            while len(lote) < self.tamano_lote:
+                restante = limite - time.monotonic()
+                if restante <= 0 or self._detener.is_set():
+                    break
+                try:
+                    lote.append(self._cola.get(timeout=restante))
+                except queue.Empty:
+                    break
+
+            self._escribir_lote(lote)
+
+    def _extraer_pendientes(self):
+        """Vacía la cola sin bloquear."""
+        pendientes = []
+        while True:
+            try:
+                pendientes.append(self._cola.get_nowait())
+            except queue.Empty:
+                return pendientes
+
+    def _escribir_lote(self, lote):
+        """Ejecuta un lote de operaciones en una sola transacción."""
+        inicio = time.perf_counter()
+        errores = 0
+        try:
+            with self.memory._db.transaccion():
+                for operacion, args, kwargs in lote:
+                    try:
+                        getattr(self.memory, operacion)(*args, **kwargs)
+                    except Exception as e:
+                        errores += 1
+                        logger.error(f"Error en escritura diferida {operacion}: {e}")
+        except Exception as e:
+            errores = len(lote)
+            logger.error(f"Error confirmando lote de aprendizaje ({len(lote)} operaciones): {e}")
+
+        with self._lock:
+            self._contadores["escritas"] += len(lote) - errores
+            self._contadores["errores"] += errores
+            self._contadores["lotes"] += 1
+            self._ultimo_lote_ms = (time.perf_counter() - inicio) * 1000
+
+    # ==================== Métricas ====================
+
+    def metricas(self):
+        """Profundidad de la cola y contadores del escritor."""
+        with self._lock:
+            datos = dict(self._contadores)
+            datos["ultimo_lote_ms"] = round(self._ultimo_lote_ms, 2)
+            datos["mayor_profundidad"] = self._mayor_profundidad
+        datos["profundidad_cola"] = self._cola.qsize()
+        datos["activo"] = self._hilo is not None and self._hilo.is_alive()
+        return datos
@@ -0,0 +1,172 @@
+"""
+Historial de conversación con la IA, acotado en memoria.
+Guarda los últimos turnos de cada usuario como tuplas (pregunta, respuesta)
+en una caché LRU con límite de usuarios y de bytes. Si un usuario no está
+en memoria (expulsado o tras un reinicio), sus últimos turnos se recuperan
+de `historial_consultas` en SQLite la primera vez que se necesitan.
+Los turnos que salen de la ventana no se pierden del todo: pasan a un
+resumen acumulado (una línea por turno) que se calcula una sola vez, al
+salir, y ocupa en el prompt mucho menos que el turno completo.
+"""
+
+import logging
+import re
+import threading
+from collections import OrderedDict, deque
+
+from config.settings import (
+    HISTORIAL_MAX_BYTES,
+    HISTORIAL_MAX_USUARIOS,
+    HISTORIAL_RESUMEN_TURNOS,
+    HISTORIAL_TURNOS,
+)
+
+logger = logging.getLogger(__name__)
+
+_FIN_FRASE = re.compile(r"(?<=[.!?])\s|\n")
+
+
+def _tamano(pregunta, respuesta):
+    return len(pregunta.encode("utf-8")) + len(respuesta.encode("utf-8"))
+
+
+def _acortar(texto, maximo):
+    texto = " ".join(texto.split())
+    return texto if len(texto) <= maximo else texto[:maximo].rstrip() + "…"
+
+
+def linea_resumen(pregunta, respuesta):
+    """Resumen de un turno: la pregunta y la primera frase de la respuesta."""
+    frase = _FIN_FRASE.split(respuesta.strip(), maxsplit=1)[0]
+    return f"- {_acortar(pregunta, 100)} → {_acortar(frase, 160)}"
+
+
+class HistorialConversacion:
+    """Últimos turnos por usuario con expulsión LRU y rehidratación desde SQLite."""
+
+    def __init__(
+        self,
+        memory,
+        turnos=HISTORIAL_TURNOS,
+        max_usuarios=HISTORIAL_MAX_USUARIOS,
+        max_bytes=HISTORIAL_MAX_BYTES,
+        turnos_resumen=HISTORIAL_RESUMEN_TURNOS,
+    ):
+        self.memory = memory
+        self.turnos = max(1, turnos)
+        self.turnos_resumen = max(0, turnos_resumen)
+        self.max_usuarios = max_usuarios
+        self.max_bytes = max_bytes
+        self._usuarios = OrderedDict()  # user_id -> deque[(pregunta, respuesta)]
+        self._resumenes = {}  # user_id -> deque[línea de resumen]
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._contadores = {"rehidratados": 0, "expulsados": 0, "turnos_resumidos": 0}
+
+    def mensajes(self, user_id):
+        """Historial del usuario en formato de mensajes de chat."""
+        historial = []
+        for pregunta, respuesta in self._turnos(user_id):
+            historial.append({"role": "user", "content": pregunta})
+            historial.append({"role": "assistant", "content": respuesta})
+        return historial
+
+    def resumen(self, user_id):
+        """Resumen de los turnos anteriores a los que devuelve mensajes() ("" si no hay)."""
+        self._turnos(user_id)
+        with self._lock:
+            return "\n".join(self._resumenes.get(user_id, ()))
+
+    def agregar(self, user_id, pregunta, respuesta):
+        """Añade un turno y expulsa usuarios antiguos si se supera el límite."""
+        turnos = self._turnos(user_id)
+        with self._lock:
+            if self._usuarios.get(user_id) is not turnos:
+                # Expulsado entre la lectura y la escritura: volver a registrarlo
+                self._usuarios[user_id] = turnos
+                self._bytes += sum(_tamano(*t) for t in turnos)
+            if len(turnos) == turnos.maxlen:
+                self._bytes -= _tamano(*turnos[0])
+                self._resumir(user_id, [turnos[0]])
+            turnos.append((pregunta, respuesta))
+            self._bytes += _tamano(pregunta, respuesta)
+            self._expulsar(conservar=user_id)
+
+    def olvidar(self, user_id):
+        """Elimina de memoria el historial de un usuario."""
+        with self._lock:
+            turnos = self._usuarios.pop(user_id, None)
+            if turnos:
+                self._bytes -= sum(_tamano(*t) for t in turnos)
+            self._bytes -= self._olvidar_resumen(user_id)
+
+    def _resumir(self, user_id, antiguos):
+        """Pasa turnos que salen de la ventana al resumen (con el lock tomado)."""
+        if not self.turnos_resumen or not antiguos:
+            return
+        lineas = self._resumenes.get(user_id)
+        if lineas is None:
+            lineas = self._resumenes[user_id] = deque(maxlen=self.turnos_resumen)
+        for pregunta, respuesta in antiguos:
+            if len(lineas) == lineas.maxlen:
+                self._bytes -= len(lineas[0].encode("utf-8"))
+            linea = linea_resumen(pregunta, respuesta)
+            lineas.append(linea)
+            self._bytes += len(linea.encode("utf-8"))
+            self._contadores["turnos_resumidos"] += 1
+
+    def _olvidar_resumen(self, user_id):
+        """Quita el resumen del usuario y devuelve los bytes que ocupaba (con el lock tomado)."""
+        lineas = self._resumenes.pop(user_id, None)
+        return sum(len(linea.encode("utf-8")) for linea in lineas) if lineas else 0
+
+    def _turnos(self, user_id):
+        """Turnos del usuario, cargándolos de SQLite si no están en memoria."""
+        with self._lock:
+            turnos = self._usuarios.get(user_id)
+            if turnos is not None:
+                self._usuarios.move_to_end(user_id)
+                return turnos
+
+        # Los turnos anteriores a la ventana reconstruyen el resumen
+        recientes = self.memory.obtener_turnos_recientes(user_id, self.turnos + self.turnos_resumen)
+
+        with self._lock:
+            turnos = self._usuarios.get(user_id)
+            if turnos is None:
+                turnos = deque(recientes[-self.turnos:], maxlen=self.turnos)
+                self._usuarios[user_id] = turnos
+                self._bytes += sum(_tamano(*t) for t in turnos)
+                self._bytes -= self._olvidar_resumen(user_id)
+                self._resumir(user_id, recientes[:-self.turnos])
+                if turnos:
+                    self._contadores["rehidratados"] += 1
+                self._expulsar(conservar=user_id)
+            return turnos
+
+    def _expulsar(self, conservar=None):
+        """Expulsa los usuarios menos recientes (con el lock tomado)."""
+        while self._usuarios and (
+            len(self._usuarios) > self.max_usuarios or self._bytes > self.max_bytes
+        ):
+            user_id = next(iter(self._usuarios))
+            if user_id == conservar:
+                if len(self._usuarios) == 1:
+                    break
+                self._usuarios.move_to_end(user_id)
+                continue
+            turnos = self._usuarios.pop(user_id)
+            self._bytes -= sum(_tamano(*t) for t in turnos)
+            self._bytes -= self._olvidar_resumen(user_id)
+            self._contadores["expulsados"] += 1
+
+    def metricas(self):
+        """Usuarios en memoria, bytes ocupados y contadores."""
+        with self._lock:
+            datos = dict(self._contadores)
+            datos["usuarios"] = len(self._usuarios)
+            datos["resumenes"] = len(self._resumenes)
+            datos["bytes"] = self._bytes
+        datos["max_usuarios"] = self.max_usuarios
+        datos["max_bytes"] = self.max_bytes
+        return datos
@@ -0,0 +1,184 @@
+"""
+Índice vectorial en disco para la memoria aprendida.
+Los vectores viven en una matriz float32 mapeada en memoria
+(`<nombre>-<dimension>.f32`) y sus ids en un array int64 paralelo
+(`<nombre>-<dimension>.ids`). Buscar es un producto matriz-vector y una
+selección de los k mayores; añadir es escribir al final de ambos ficheros.
+
+Varios procesos (workers de gunicorn) comparten los ficheros: quien escribe
+toma un flock exclusivo y solo añade ids posteriores al último que ya está
+en disco; quien vuelve a mapear toma un flock compartido. La compactación
+reescribe los ficheros sin los ids que ya no existen en la base de datos.
+"""
+
+import fcntl
+import logging
+import os
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+FILAS_POR_BLOQUE = 65536
+
+
+class IndiceVectorial:
+    """Matriz de vectores mapeada en memoria con su array de ids."""
+
+    def __init__(self, directorio, nombre, dimension):
+        self.dimension = dimension
+        os.makedirs(directorio, exist_ok=True)
+        base = os.path.join(directorio, f"{nombre}-{dimension}")
+        self._ruta_vectores = base + ".f32"
+        self._ruta_ids = base + ".ids"
+        self._ruta_bloqueo = base + ".lock"
+        self._bytes_fila = dimension * 4
+        self._lock = threading.Lock()
+        self._mapa = None  # (estado del fichero de ids, matriz, ids)
+
+    @contextmanager
+    def _bloqueo(self, modo):
+        with open(self._ruta_bloqueo, "a") as fichero:
+            fcntl.flock(fichero, modo)
+            try:
+                yield
+            finally:
+                fcntl.flock(fichero, fcntl.LOCK_UN)
+
+    def _filas_en_disco(self):
+        """Filas completas: una escritura interrumpida puede dejar una cola a medias."""
+        try:
+            filas_ids = os.path.getsize(self._ruta_ids) // 8
+            filas_vectores = os.path.getsize(self._ruta_vectores) // self._bytes_fila
+        except FileNotFoundError:
+            return 0
+        return min(filas_ids, filas_vectores)
+
+    def _estado_ids(self):
+        try:
+            estado = os.stat(self._ruta_ids)
+        except FileNotFoundError:
+            return None
+        return estado.st_ino, estado.st_size
+
+    def _vista(self):
+        """(matriz, ids) mapeados, volviendo a mapear si los ficheros cambiaron."""
+        with self._lock:
+            if self._mapa is not None and self._mapa[0] == self._estado_ids():
+                return self._mapa[1], self._mapa[2]
+            with self._bloqueo(fcntl.LOCK_SH):
+                estado = self._estado_ids()
+                filas = self._filas_en_disco()
+                if filas:
+                    ids = np.memmap(self._ruta_ids, dtype="<i8", mode="r", shape=(filas,))
+                    matriz = np.memmap(
+                        self._ruta_vectores, dtype="<f4", mode="r", shape=(filas, self.dimension)
+                    )
+                else:
+                    ids = np.empty(0, dtype="<i8")
+                    matriz = np.empty((0, self.dimension), dtype="<f4")
+            self._mapa = (estado, matriz, ids)
+            return matriz, ids
+
+    def __len__(self):
+        return len(self._vista()[1])
+
+    def ultimo_id(self):
+        """Mayor id indexado (los ids se añaden en orden creciente)."""
+        ids = self._vista()[1]
+        return int(ids[-1]) if len(ids) else 0
+
+    def agregar(self, ids, vectores):
+        """
+        Añade vectores (matriz n x dimension) con sus ids crecientes.
+        Los ids que otro proceso ya añadió se omiten. Retorna los añadidos.
+        """
+        ids = np.asarray(ids, dtype="<i8")
+        vectores = np.asarray(vectores, dtype="<f4").reshape(len(ids), self.dimension)
+        with self._lock, self._bloqueo(fcntl.LOCK_EX):
+            filas = self._filas_en_disco()
+            ultimo = 0
+            if filas:
+                with open(self._ruta_ids, "rb") as fichero:
+                    fichero.seek((filas - 1) * 8)
+                    ultimo = int(np.frombuffer(fichero.read(8), dtype="<i8")[0])
+            nuevos = ids > ultimo
+            if not nuevos.any():
+                return 0
+            # Los vectores se escriben antes que los ids: un id en disco
+            # siempre tiene su vector completo
+            with open(self._ruta_vectores, "ab") as fichero:
+                fichero.truncate(filas * self._bytes_fila)
+                fichero.write(np.ascontiguousarray(vectores[nuevos]).tobytes())
+            with open(self._ruta_ids, "ab") as fichero:
+                fichero.truncate(filas * 8)
+                fichero.write(ids[nuevos].tobytes())
+            return int(nuevos.sum())
+
+    def buscar(self, vector, k=10, minimo=0.0):
+        """
+        Los k ids con mayor producto escalar (coseno, con vectores de norma 1).
+        Retorna [(id, similitud)] de mayor a menor, solo los que llegan al mínimo.
+        """
+        matriz, ids = self._vista()
+        if not len(ids):
+            return []
+        similitudes = matriz @ np.asarray(vector, dtype="<f4")
+        k = min(k, len(similitudes))
+        mejores = np.argpartition(-similitudes, k - 1)[:k]
+        mejores = mejores[np.argsort(-similitudes[mejores], kind="stable")]
+        return [
+            (int(ids[i]), float(similitudes[i]))
+            for i in mejores
+            if similitudes[i] >= minimo
+        ]
+
+    def compactar(self, ids_validos):
+        """
+        Reescribe los ficheros conservando solo los ids válidos (y sin colas
+        a medias). Retorna las filas eliminadas.
+        """
+        ids_validos = np.asarray(ids_validos, dtype="<i8")
+        with self._lock, self._bloqueo(fcntl.LOCK_EX):
+            filas = self._filas_en_disco()
+            if not filas:
+                return 0
+            ids = np.fromfile(self._ruta_ids, dtype="<i8", count=filas)
+            conservar = np.isin(ids, ids_validos)
+            eliminadas = filas - int(conservar.sum())
+            completos = (
+                os.path.getsize(self._ruta_ids) == filas * 8
+                and os.path.getsize(self._ruta_vectores) == filas * self._bytes_fila
+            )
+            if not eliminadas and completos:
+                return 0
+
+            matriz = np.memmap(
+                self._ruta_vectores, dtype="<f4", mode="r", shape=(filas, self.dimension)
+            )
+            temporal_vectores = self._ruta_vectores + ".tmp"
+            temporal_ids = self._ruta_ids + ".tmp"
+            with open(temporal_vectores, "wb") as fichero:
+                for inicio in range(0, filas, FILAS_POR_BLOQUE):
+                    bloque = slice(inicio, inicio + FILAS_POR_BLOQUE)
+                    fichero.write(np.ascontiguousarray(matriz[bloque][conservar[bloque]]).tobytes())
+            ids[conservar].tofile(temporal_ids)
+            del matriz
+            # Los lectores vuelven a mapear con el flock compartido: ven ambos
+            # ficheros nuevos o ambos antiguos
+            os.replace(temporal_vectores, self._ruta_vectores)
+            os.replace(temporal_ids, self._ruta_ids)
+            self._mapa = None
+        if eliminadas:
+            logger.info(f"Índice vectorial compactado: {eliminadas} filas eliminadas")
+        return eliminadas
+
+    def metricas(self):
+        filas = len(self)
+        return {
+            "vectores": filas,
+            "dimension": self.dimension,
+            "bytes_disco": filas * (self._bytes_fila + 8),
+        }
@@ -1,7 +1,9 @@
 """
 Sistema de memoria de conocimiento aprendido.
 Guarda pares pregunta/respuesta exitosos y los reutiliza
-en futuras consultas similares usando similitud por palabras clave.
+en futuras consultas similares: un índice invertido en SQLite da los
+candidatos, BM25 los ordena y la similitud por palabras clave decide si
+se aceptan.
 
 Incluye sistema completo de aprendizaje:
 - Historial de todas las consultas
@@ -9,12 +11,35 @@ Incluye sistema completo de aprendizaje:
 - Patrones aprendidos de preguntas frecuentes
 """
 
-import sqlite3
 import json
 import logging
+import math
 import os
+import threading
+import time
 from datetime import datetime, timedelta
 
+import numpy as np
+
+from config.settings import (
+    HISTORIAL_ARCHIVO_DIR,
+    MEMORIA_DB_PATH,
+    MEMORIA_CANDIDATOS_POR_PALABRA,
+    MEMORIA_VECTORES_COMPACTAR_HORAS,
+    MEMORIA_VECTORES_DIMENSION,
+    MEMORIA_VECTORES_DIR,
+    MEMORIA_VECTORES_INTERVALO_SEGUNDOS,
+    MEMORIA_VECTORES_UMBRAL,
+)
+from services.archivo_historial import ArchivoHistorial
+from services.bandeja_salida import BandejaSalida
+from services.database import GestorConexiones
+from services.deduplicador import DeduplicadorMensajes
+from services.indice_vectorial import IndiceVectorial
+from utils import bm25, minhash
+from utils.symspell import distancia_edicion, normalizar, variantes_edicion
+from utils.vectores_hash import vectorizar
+
 logger = logging.getLogger(__name__)
 
 # Stopwords en español para excluir de la similitud
@@ -30,7 +55,9 @@ STOPWORDS = {
     "puedo", "tengo", "tiene", "hacer", "saber", "decir",
 }
 
-DB_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "chatbot_memoria.db")
+DB_PATH = MEMORIA_DB_PATH or os.path.join(
+    os.path.dirname(os.path.dirname(__file__)), "data", "chatbot_memoria.db"
+)
 
 
 def _tokenizar(texto):
@@ -52,83 +79,289 @@ def _calcular_similitud(palabras_nueva, palabras_guardada):
     return len(interseccion) / denominador
 
 
+# Faltas que se corrigen con ayuda del índice vectorial: una sola, y solo en
+# palabras largas. Con dos, "hipertension" pasaría a "hipotension". Las de
+# más de LONGITUD_MAXIMA_CORRECCION letras no son palabras (enlaces, códigos)
+DISTANCIA_CORRECCION = 1
+LONGITUD_MINIMA_CORRECCION = 5
+LONGITUD_MAXIMA_CORRECCION = 30
+
+
+def _corregible(palabra):
+    return LONGITUD_MINIMA_CORRECCION <= len(palabra) <= LONGITUD_MAXIMA_CORRECCION
+
+
+def _corregir_palabras(palabras, desconocidas, guardadas):
+    """
+    Sustituye cada palabra `desconocida` (que no aparece en ningún registro)
+    por la única palabra guardada a DISTANCIA_CORRECCION faltas o menos,
+    sin contar acentos. Las palabras conocidas no se tocan: "anemia" nunca
+    se convierte en otra enfermedad, solo "anemai" en "anemia".
+    """
+    libres = [
+        (normalizar(g), g) for g in guardadas - palabras if len(g) >= LONGITUD_MINIMA_CORRECCION
+    ]
+    corregidas = set()
+    for palabra in palabras:
+        if palabra in desconocidas and _corregible(palabra):
+            clave = normalizar(palabra)
+            cercanas = {
+                g for normalizada, g in libres
+                if distancia_edicion(clave, normalizada, DISTANCIA_CORRECCION) <= DISTANCIA_CORRECCION
+            }
+            if len(cercanas) == 1:
+                palabra = cercanas.pop()
+        corregidas.add(palabra)
+    return corregidas
+
+
+def _rango_longitud(num_palabras, umbral):
+    """
+    Rango de longitudes (en palabras) que pueden alcanzar el umbral.
+    Como similitud = comunes / max(n, m), una pregunta guardada con m palabras
+    solo puede llegar al umbral si ceil(umbral * n) <= m <= floor(n / umbral).
+    """
+    minimo = max(1, math.ceil(umbral * num_palabras - 1e-9))
+    maximo = math.floor(num_palabras / umbral + 1e-9)
+    return minimo, maximo
+
+
+def _hora(fecha):
+    """Clave de la franja horaria de una fecha ('YYYY-MM-DDTHH')."""
+    if isinstance(fecha, datetime):
+        fecha = fecha.isoformat()
+    return fecha[:13]
+
+
+def _palabras_registro(tipo, texto):
+    """Palabras de un registro: los patrones ya se guardan tokenizados."""
+    if tipo == "patrones":
+        return set(texto.split())
+    return _tokenizar(texto)
+
+
+# Encabezado de cada tipo de bloque en el contexto enriquecido
+ENCABEZADOS_CONTEXTO = {
+    "conocimiento": "[Conocimiento aprendido]",
+    "historial_usuario": "[Historial reciente del usuario]",
+    "temas_populares": "[Temas populares esta semana]",
+    "intereses": "[Intereses del usuario]",
+}
+
+
+def formatear_bloques_contexto(bloques):
+    """Texto del contexto enriquecido: los bloques (tipo, texto, ...) agrupados bajo su encabezado."""
+    grupos = {}
+    for tipo, texto, *_ in bloques:
+        grupos.setdefault(tipo, []).append(texto)
+    return "\n\n".join(
+        f"{ENCABEZADOS_CONTEXTO[tipo]}\n" + "\n\n".join(textos) for tipo, textos in grupos.items()
+    )
+
+
 class KnowledgeMemory:
     """Memoria de conocimiento aprendido con SQLite."""
 
-    def __init__(self):
+    def __init__(self, db_path=None, candidatos_por_palabra=MEMORIA_CANDIDATOS_POR_PALABRA):
+        self.db_path = db_path or DB_PATH
+        self.candidatos_por_palabra = candidatos_por_palabra
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        self._db = GestorConexiones(self.db_path)
+        # Índices vectoriales en disco, alternativa tolerante a faltas
+        self._vectores = {}
+        if MEMORIA_VECTORES_DIMENSION:
+            directorio = MEMORIA_VECTORES_DIR or os.path.join(os.path.dirname(self.db_path), "vectores")
+            self._vectores = {
+                tipo: IndiceVectorial(directorio, tipo, MEMORIA_VECTORES_DIMENSION)
+                for tipo in ("conocimiento", "patrones")
+            }
+        self._lock_vectores = threading.Lock()
+        self._detener_vectores = threading.Event()
+        self._hilo_vectores = None
+        self._proxima_compactacion = time.monotonic() + MEMORIA_VECTORES_COMPACTAR_HORAS * 3600
         self._init_db()
+        # Meses antiguos del historial, comprimidos fuera de la BD
+        self.archivo = ArchivoHistorial(
+            self._db,
+            HISTORIAL_ARCHIVO_DIR or os.path.join(os.path.dirname(self.db_path), "archivo"),
+        )
+        # message_id de los webhooks ya atendidos, para descartar reenvíos
+        self.mensajes_recibidos = DeduplicadorMensajes(self._db)
+        # Respuestas pendientes de enviar por WhatsApp
+        self.bandeja_salida = BandejaSalida(self._db)
+
+    def cerrar(self):
+        """Cierra las conexiones a la base de datos (llamar al apagar)."""
+        self._db.cerrar()
 
     def _init_db(self):
         """Inicializa la base de datos y todas las tablas."""
-        os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
         try:
-            conn = sqlite3.connect(DB_PATH)
-
-            # Tabla original: conocimiento aprendido
-            conn.execute("""
-                CREATE TABLE IF NOT EXISTS conocimiento_aprendido (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    pregunta TEXT NOT NULL,
-                    respuesta TEXT NOT NULL,
-                    idioma TEXT DEFAULT 'es',
-                    categoria TEXT DEFAULT 'general',
-                    veces_consultado INTEGER DEFAULT 0,
-                    fecha_creacion TEXT NOT NULL,
-                    fecha_ultimo_uso TEXT NOT NULL
-                )
-            """)
-
-            # Historial de TODAS las interacciones
-            conn.execute("""
-                CREATE TABLE IF NOT EXISTS historial_consultas (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id TEXT NOT NULL,
-                    pregunta TEXT NOT NULL,
-                    respuesta TEXT NOT NULL,
-                    fuente TEXT NOT NULL,
-                    idioma TEXT DEFAULT 'es',
-                    categoria TEXT DEFAULT 'general',
-                    fecha TEXT NOT NULL
-                )
-            """)
-
-            # Perfiles persistentes de usuario
-            conn.execute("""
-                CREATE TABLE IF NOT EXISTS perfiles_usuario (
-                    user_id TEXT PRIMARY KEY,
-                    idioma_preferido TEXT DEFAULT 'es',
-                    total_mensajes INTEGER DEFAULT 0,
-                    temas_frecuentes TEXT DEFAULT '{}',
-                    primera_interaccion TEXT NOT NULL,
-                    ultima_interaccion TEXT NOT NULL
-                )
-            """)
-
-            # Patrones aprendidos de preguntas frecuentes
-            conn.execute("""
-                CREATE TABLE IF NOT EXISTS patrones_aprendidos (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    patron_palabras TEXT NOT NULL,
-                    categoria TEXT DEFAULT 'general',
-                    respuesta_sugerida TEXT NOT NULL,
-                    frecuencia INTEGER DEFAULT 1,
-                    idioma TEXT DEFAULT 'es',
-                    fecha_creacion TEXT NOT NULL,
-                    fecha_actualizacion TEXT NOT NULL
-                )
-            """)
-
-            # Índices para rendimiento
-            conn.execute("CREATE INDEX IF NOT EXISTS idx_historial_user ON historial_consultas(user_id)")
-            conn.execute("CREATE INDEX IF NOT EXISTS idx_historial_fecha ON historial_consultas(fecha)")
-            conn.execute("CREATE INDEX IF NOT EXISTS idx_patrones_idioma ON patrones_aprendidos(idioma)")
-
-            conn.commit()
-            conn.close()
+            with self._db.transaccion() as conn:
+                self._crear_tablas(conn)
             logger.info("Base de datos de memoria inicializada correctamente")
         except Exception as e:
             logger.error(f"Error inicializando BD de memoria: {e}")
 
+    def _crear_tablas(self, conn):
+        """Crea tablas e índices y pone al día los datos existentes."""
+        # Tabla original: conocimiento aprendido
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS conocimiento_aprendido (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                pregunta TEXT NOT NULL,
+                respuesta TEXT NOT NULL,
+                idioma TEXT DEFAULT 'es',
+                categoria TEXT DEFAULT 'general',
+                veces_consultado INTEGER DEFAULT 0,
+                fecha_creacion TEXT NOT NULL,
+                fecha_ultimo_uso TEXT NOT NULL
+            )
+        """)
+
+        # Historial de TODAS las interacciones
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS historial_consultas (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id TEXT NOT NULL,
+                pregunta TEXT NOT NULL,
+                respuesta TEXT NOT NULL,
+                fuente TEXT NOT NULL,
+                idioma TEXT DEFAULT 'es',
+                categoria TEXT DEFAULT 'general',
+                fecha TEXT NOT NULL
+            )
+        """)
+
+        # Perfiles persistentes de usuario
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS perfiles_usuario (
+                user_id TEXT PRIMARY KEY,
+                idioma_preferido TEXT DEFAULT 'es',
+                total_mensajes INTEGER DEFAULT 0,
+                temas_frecuentes TEXT DEFAULT '{}',
+                primera_interaccion TEXT NOT NULL,
+                ultima_interaccion TEXT NOT NULL
+            )
+        """)
+
+        # Patrones aprendidos de preguntas frecuentes
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS patrones_aprendidos (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                patron_palabras TEXT NOT NULL,
+                categoria TEXT DEFAULT 'general',
+                respuesta_sugerida TEXT NOT NULL,
+                frecuencia INTEGER DEFAULT 1,
+                idioma TEXT DEFAULT 'es',
+                fecha_creacion TEXT NOT NULL,
+                fecha_actualizacion TEXT NOT NULL
+            )
+        """)
+
+        # Índice invertido palabra -> registro, uno por tipo. La longitud
+        # forma parte de la clave para descartar por rango los registros que
+        # nunca podrían alcanzar el umbral.
+        for tipo, (tabla_indice, tabla_frecuencias) in self._INDICES.items():
+            columna = self._TABLAS[tipo][1]
+            conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS {tabla_indice} (
+                    palabra TEXT NOT NULL,
+                    num_palabras INTEGER NOT NULL,
+                    {columna} INTEGER NOT NULL,
+                    idioma TEXT NOT NULL,
+                    PRIMARY KEY (palabra, num_palabras, {columna})
+                ) WITHOUT ROWID
+            """)
+            conn.execute(
+                f"CREATE INDEX IF NOT EXISTS idx_{tabla_indice}_id "
+                f"ON {tabla_indice}({columna}, palabra)"
+            )
+            # Número de registros que contienen cada palabra (idf de BM25) y su
+            # forma sin acentos, con la que se buscan correcciones de faltas
+            conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS {tabla_frecuencias} (
+                    palabra TEXT PRIMARY KEY,
+                    documentos INTEGER NOT NULL DEFAULT 0,
+                    normalizada TEXT
+                ) WITHOUT ROWID
+            """)
+            self._normalizar_vocabulario(conn, tabla_frecuencias)
+            conn.execute(
+                f"CREATE INDEX IF NOT EXISTS idx_{tabla_frecuencias}_normalizada "
+                f"ON {tabla_frecuencias}(normalizada)"
+            )
+        # Registros y palabras indexados por tipo (N y longitud media de BM25)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS totales_indice (
+                tipo TEXT PRIMARY KEY,
+                documentos INTEGER NOT NULL DEFAULT 0,
+                palabras INTEGER NOT NULL DEFAULT 0
+            ) WITHOUT ROWID
+        """)
+
+        # Resúmenes de estadísticas, actualizados junto con cada consulta
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS estadisticas_contadores (
+                dimension TEXT NOT NULL,
+                valor TEXT NOT NULL,
+                total INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (dimension, valor)
+            ) WITHOUT ROWID
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS estadisticas_horarias (
+                hora TEXT NOT NULL,
+                categoria TEXT NOT NULL,
+                total INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (hora, categoria)
+            ) WITHOUT ROWID
+        """)
+
+        # Cubos LSH de las firmas MinHash, para detectar duplicados al guardar
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS lsh_conocimiento (
+                clave INTEGER NOT NULL,
+                conocimiento_id INTEGER NOT NULL,
+                PRIMARY KEY (clave, conocimiento_id)
+            ) WITHOUT ROWID
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS lsh_patrones (
+                clave INTEGER NOT NULL,
+                patron_id INTEGER NOT NULL,
+                PRIMARY KEY (clave, patron_id)
+            ) WITHOUT ROWID
+        """)
+
+        columnas = {
+            fila[1] for fila in conn.execute("PRAGMA table_info(conocimiento_aprendido)")
+        }
+        if "num_palabras" not in columnas:
+            conn.execute("ALTER TABLE conocimiento_aprendido ADD COLUMN num_palabras INTEGER")
+        if "firma_minhash" not in columnas:
+            conn.execute("ALTER TABLE conocimiento_aprendido ADD COLUMN firma_minhash BLOB")
+        columnas = {
+            fila[1] for fila in conn.execute("PRAGMA table_info(patrones_aprendidos)")
+        }
+        if "firma_minhash" not in columnas:
+            conn.execute("ALTER TABLE patrones_aprendidos ADD COLUMN firma_minhash BLOB")
+
+        # Índices para rendimiento
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_historial_user ON historial_consultas(user_id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_historial_fecha ON historial_consultas(fecha)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_patrones_idioma ON patrones_aprendidos(idioma)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_patrones_frecuencia ON patrones_aprendidos(frecuencia)")
+
+        self._firmar_pendientes(conn.cursor())
+        self._indexar_pendientes(conn.cursor())
+
+        # Bases de datos anteriores a los resúmenes: calcularlos una vez
+        sin_resumen = conn.execute("SELECT 1 FROM estadisticas_contadores LIMIT 1").fetchone() is None
+        con_historial = conn.execute("SELECT 1 FROM historial_consultas LIMIT 1").fetchone() is not None
+        if sin_resumen and con_historial:
+            self._reconstruir_resumenes(conn)
+
     # ==================== Conocimiento aprendido ====================
 
     def guardar(self, pregunta, respuesta, idioma="es", categoria="general"):
@@ -137,45 +370,35 @@ class KnowledgeMemory:
         Si ya existe una pregunta similar, actualiza en vez de duplicar.
         """
         try:
-            conn = sqlite3.connect(DB_PATH)
-            cursor = conn.cursor()
             ahora = datetime.now().isoformat()
-
-            # Verificar si ya existe una pregunta similar
-            cursor.execute(
-                "SELECT id, pregunta FROM conocimiento_aprendido WHERE idioma = ?",
-                (idioma,),
-            )
-            registros = cursor.fetchall()
-
             palabras_nueva = _tokenizar(pregunta)
 
-            for reg_id, reg_pregunta in registros:
-                palabras_guardada = _tokenizar(reg_pregunta)
-                similitud = _calcular_similitud(palabras_nueva, palabras_guardada)
-
-                if similitud >= 0.7:
-                    # Actualizar registro existente con la respuesta más reciente
-                    cursor.execute(
-                        """UPDATE conocimiento_aprendido
-                           SET respuesta = ?, categoria = ?, fecha_ultimo_uso = ?
-                           WHERE id = ?""",
-                        (respuesta, categoria, ahora, reg_id),
-                    )
-                    conn.commit()
-                    conn.close()
-                    logger.debug(f"Memoria actualizada (similitud {similitud:.2f}): {pregunta[:50]}")
-                    return
-
-            # No hay duplicado, insertar nuevo
-            cursor.execute(
-                """INSERT INTO conocimiento_aprendido
-                   (pregunta, respuesta, idioma, categoria, fecha_creacion, fecha_ultimo_uso)
-                   VALUES (?, ?, ?, ?, ?, ?)""",
-                (pregunta, respuesta, idioma, categoria, ahora, ahora),
-            )
-            conn.commit()
-            conn.close()
+            with self._db.transaccion() as conn:
+                cursor = conn.cursor()
+
+                # Verificar si ya existe una pregunta similar (candidatos LSH)
+                firma = minhash.firma(palabras_nueva)
+                candidatos = self._candidatos_duplicado(cursor, "conocimiento", firma, idioma)
+
+                for reg_id, reg_pregunta in candidatos:
+                    palabras_guardada = _tokenizar(reg_pregunta)
+                    similitud = _calcular_similitud(palabras_nueva, palabras_guardada)
+
+                    if similitud >= 0.7:
+                        # Actualizar registro existente con la respuesta más reciente
+                        cursor.execute(
+                            """UPDATE conocimiento_aprendido
+                               SET respuesta = ?, categoria = ?, fecha_ultimo_uso = ?
+                               WHERE id = ?""",
+                            (respuesta, categoria, ahora, reg_id),
+                        )
+                        logger.debug(f"Memoria actualizada (similitud {similitud:.2f}): {pregunta[:50]}")
+                        return
+
+                # No hay duplicado, insertar nuevo
+                self._insertar_conocimiento(
+                    cursor, pregunta, respuesta, idioma, categoria, ahora, palabras_nueva, firma
+                )
             logger.debug(f"Nuevo conocimiento guardado: {pregunta[:50]}")
 
         except Exception as e:
@@ -187,44 +410,29 @@ class KnowledgeMemory:
         Retorna (respuesta, confianza) o (None, 0).
         """
         try:
-            conn = sqlite3.connect(DB_PATH)
-            cursor = conn.cursor()
-            cursor.execute(
-                "SELECT id, pregunta, respuesta FROM conocimiento_aprendido WHERE idioma = ?",
-                (idioma,),
-            )
-            registros = cursor.fetchall()
-
             palabras_nueva = _tokenizar(pregunta)
-            mejor_match = None
-            mejor_similitud = 0.0
-
-            for reg_id, reg_pregunta, reg_respuesta in registros:
-                palabras_guardada = _tokenizar(reg_pregunta)
-                similitud = _calcular_similitud(palabras_nueva, palabras_guardada)
-
-                if similitud > mejor_similitud:
-                    mejor_similitud = similitud
-                    mejor_match = (reg_id, reg_respuesta)
+            aceptados = self._recuperar("conocimiento", palabras_nueva, 0.6, idioma)
+            if not aceptados:
+                # Sin coincidencia por palabras: faltas de ortografía o variantes
+                aceptados = self._recuperar_vectorial("conocimiento", palabras_nueva, 0.6, idioma)
 
-            if mejor_match and mejor_similitud >= 0.6:
+            if aceptados:
+                similitud, (reg_id, _, reg_respuesta) = aceptados[0]
                 # Incrementar contador de uso
                 ahora = datetime.now().isoformat()
-                cursor.execute(
-                    """UPDATE conocimiento_aprendido
-                       SET veces_consultado = veces_consultado + 1,
-                           fecha_ultimo_uso = ?
-                       WHERE id = ?""",
-                    (ahora, mejor_match[0]),
-                )
-                conn.commit()
-                conn.close()
+                with self._db.transaccion() as conn:
+                    conn.execute(
+                        """UPDATE conocimiento_aprendido
+                           SET veces_consultado = veces_consultado + 1,
+                               fecha_ultimo_uso = ?
+                           WHERE id = ?""",
+                        (ahora, reg_id),
+                    )
                 logger.info(
-                    f"Memoria encontrada (similitud {mejor_similitud:.2f}): {pregunta[:50]}"
+                    f"Memoria encontrada (similitud {similitud:.2f}): {pregunta[:50]}"
                 )
-                return mejor_match[1], mejor_similitud
+                return reg_respuesta, similitud
 
-            conn.close()
             return None, 0.0
 
         except Exception as e:
@@ -234,63 +442,528 @@ class KnowledgeMemory:
     def obtener_contexto_para_ia(self, pregunta):
         """
         Devuelve respuestas parciales como contexto adicional para OpenAI.
-        Busca matches con similitud >= 0.4 (umbral más bajo que buscar()).
+        Las 3 mejor puntuadas con similitud >= 0.4 (umbral más bajo que buscar()).
         """
+        return "\n\n".join(texto for _, texto in self._contextos_conocimiento(pregunta))
+
+    def _contextos_conocimiento(self, pregunta):
+        """[(similitud, texto)] de los conocimientos usados como contexto."""
         try:
-            conn = sqlite3.connect(DB_PATH)
-            cursor = conn.cursor()
-            cursor.execute(
-                "SELECT pregunta, respuesta FROM conocimiento_aprendido"
+            palabras_nueva = _tokenizar(pregunta)
+            aceptados = self._recuperar("conocimiento", palabras_nueva, 0.4)
+
+            # Máximo 3 contextos para no sobrecargar el prompt
+            return [
+                (similitud, f"Pregunta anterior: {reg_pregunta}\nRespuesta: {reg_respuesta[:300]}")
+                for similitud, (_, reg_pregunta, reg_respuesta) in aceptados[:3]
+            ]
+
+        except Exception as e:
+            logger.error(f"Error obteniendo contexto de memoria: {e}")
+            return []
+
+    # ==================== Recuperación BM25 ====================
+
+    # Columnas que devuelve la recuperación y filtro adicional de cada tipo
+    _RECUPERACION = {
+        "conocimiento": ("respuesta", ""),
+        "patrones": ("respuesta_sugerida, frecuencia", "AND frecuencia >= 3"),
+    }
+
+    def _recuperar(self, tipo, palabras, umbral, idioma=None, k=10):
+        """
+        Registros mejor puntuados por BM25 cuya similitud alcanza el umbral,
+        de mayor a menor puntuación. Retorna [(similitud, fila)], donde la
+        fila es (id, texto, columnas de _RECUPERACION...).
+
+        Los candidatos salen del índice invertido: un registro necesita al
+        menos ceil(umbral * n) palabras en común, así que basta con recorrer
+        las listas de las n - ceil(umbral * n) + 1 palabras menos frecuentes
+        de la consulta (filtro por prefijo). Cada una aporta como máximo
+        `candidatos_por_palabra` registros a cada lado de la longitud de la
+        consulta, empezando por los de longitud más parecida: las palabras
+        raras aportan su lista entera y las muy frecuentes no se recorren
+        enteras, así que el coste no crece con el tamaño de la base de datos
+        (a cambio, con millones de registros alguna consulta hecha solo de
+        palabras muy frecuentes no encuentra su mejor coincidencia). Las
+        coincidencias y la suma de idf se cuentan dentro de SQLite, sin
+        volver a tokenizar ningún texto; BM25 y la selección de los k
+        mejores se hacen con NumPy.
+        """
+        if not palabras:
+            return []
+        tabla_indice, tabla_frecuencias = self._INDICES[tipo]
+        _, columna, tabla_datos, _ = self._TABLAS[tipo]
+        conn = self._db.conexion()
+
+        lista = list(palabras)
+        frecuencias = dict(conn.execute(
+            f"SELECT palabra, documentos FROM {tabla_frecuencias} "
+            f"WHERE palabra IN ({','.join('?' * len(lista))})",
+            lista,
+        ).fetchall())
+        # Las palabras que ningún registro contiene no aportan candidatos
+        lista.sort(key=lambda p: frecuencias.get(p, 0))
+        minimo_comunes = max(1, math.ceil(umbral * len(lista) - 1e-9))
+        prefijo = [p for p in lista[: len(lista) - minimo_comunes + 1] if frecuencias.get(p)]
+        if not prefijo:
+            return []
+        documentos, total_palabras = conn.execute(
+            "SELECT documentos, palabras FROM totales_indice WHERE tipo = ?", (tipo,)
+        ).fetchone()
+
+        presentes = [p for p in lista if frecuencias.get(p)]
+        idfs = bm25.idf(documentos, [frecuencias[p] for p in presentes])
+        minimo, maximo = _rango_longitud(len(lista), umbral)
+        filtro_idioma = "AND idioma = ?" if idioma else ""
+        filtro = self._RECUPERACION[tipo][1]
+        # Solo los tipos con filtro (frecuencia de los patrones) consultan la tabla de datos
+        union_datos = f"JOIN {tabla_datos} d ON d.id = c.id" if filtro else ""
+        # Por cada palabra del prefijo, desde la longitud de la consulta hacia
+        # arriba y hacia abajo (la clave primaria ya está ordenada así)
+        limite = self.candidatos_por_palabra or -1  # -1: sin límite en SQLite
+        listas = []
+        parametros = []
+        tramos = ((len(lista), maximo, "ASC"), (minimo, len(lista) - 1, "DESC"))
+        for palabra in prefijo:
+            for desde, hasta, orden in tramos:
+                if desde > hasta:
+                    continue
+                listas.append(
+                    f"SELECT id FROM (SELECT {columna} AS id FROM {tabla_indice} "
+                    f"WHERE palabra = ? AND num_palabras BETWEEN ? AND ? {filtro_idioma} "
+                    f"ORDER BY num_palabras {orden} LIMIT ?)"
+                )
+                parametros += [palabra, desde, hasta]
+                if idioma:
+                    parametros.append(idioma)
+                parametros.append(limite)
+        parametros += [v for par in zip(presentes, idfs.tolist()) for v in par]
+        parametros += presentes + [umbral, len(lista)]
+        filas = conn.execute(
+            f"""
+            WITH candidatos AS (
+                {" UNION ".join(listas)}
+            ),
+            coincidencias AS (
+                SELECT i.{columna} AS id, COUNT(*) AS comunes,
+                       SUM(CASE i.palabra {"WHEN ? THEN ? " * len(presentes)}END) AS suma_idf,
+                       MAX(i.num_palabras) AS num_palabras
+                FROM candidatos
+                JOIN {tabla_indice} i INDEXED BY idx_{tabla_indice}_id ON i.{columna} = candidatos.id
+                WHERE i.palabra IN ({",".join("?" * len(presentes))})
+                GROUP BY i.{columna}
             )
-            registros = cursor.fetchall()
-            conn.close()
+            SELECT c.id, c.comunes, c.suma_idf, c.num_palabras
+            FROM coincidencias c {union_datos}
+            WHERE c.comunes >= ? * MAX(?, c.num_palabras) - 1e-9 {filtro}
+            """,
+            parametros,
+        ).fetchall()
+        if not filas:
+            return []
 
-            palabras_nueva = _tokenizar(pregunta)
-            contextos = []
+        ids, comunes, sumas_idf, longitudes = zip(*filas)
+        puntuaciones = bm25.puntuar(sumas_idf, longitudes, total_palabras / max(documentos, 1))
+        orden = bm25.mejores(puntuaciones, ids, k)
+        datos = self._filas(tipo, [ids[i] for i in orden])
+        return [
+            (comunes[i] / max(len(lista), longitudes[i]), datos[ids[i]])
+            for i in orden
+            if ids[i] in datos
+        ]
+
+    def _filas(self, tipo, ids, idioma=None):
+        """{id: (id, texto, columnas de _RECUPERACION...)} de los ids que pasan el filtro."""
+        columnas, filtro = self._RECUPERACION[tipo]
+        _, _, tabla_datos, columna_texto = self._TABLAS[tipo]
+        parametros = list(ids)
+        if idioma:
+            filtro += " AND COALESCE(idioma, 'es') = ?"
+            parametros.append(idioma)
+        cursor = self._db.conexion().execute(
+            f"""SELECT id, {columna_texto}, {columnas} FROM {tabla_datos}
+                WHERE id IN ({",".join("?" * len(ids))}) {filtro}""",
+            parametros,
+        )
+        return {fila[0]: fila for fila in cursor.fetchall()}
+
+    def metricas_indices(self):
+        """Registros en los índices invertidos y tamaño de los vectoriales en disco."""
+        metricas = {}
+        try:
+            for tipo, documentos, palabras in self._db.conexion().execute(
+                "SELECT tipo, documentos, palabras FROM totales_indice"
+            ):
+                metricas[tipo] = {
+                    "documentos": documentos,
+                    "palabras_media": round(palabras / documentos, 2) if documentos else 0,
+                }
+        except Exception as e:
+            logger.error(f"Error leyendo totales de los índices: {e}")
+        for tipo, indice in self._vectores.items():
+            metricas[f"vectores_{tipo}"] = indice.metricas()
+        return metricas
 
-            for reg_pregunta, reg_respuesta in registros:
-                palabras_guardada = _tokenizar(reg_pregunta)
-                similitud = _calcular_similitud(palabras_nueva, palabras_guardada)
+    # ==================== Recuperación vectorial ====================
 
-                if similitud >= 0.4:
-                    contextos.append(
-                        f"Pregunta anterior: {reg_pregunta}\n"
-                        f"Respuesta: {reg_respuesta[:300]}"
+    def iniciar_vectores(self):
+        """
+        Arranca el hilo que pone al día los índices vectoriales. En un
+        despliegue nuevo (o con data/vectores vacío) la primera pasada
+        vectoriza toda la base de datos, fuera del camino de las peticiones.
+        """
+        if not self._vectores or (self._hilo_vectores and self._hilo_vectores.is_alive()):
+            return
+        self._detener_vectores.clear()
+        self._hilo_vectores = threading.Thread(
+            target=self._bucle_vectores, name="indexar-vectores", daemon=True
+        )
+        self._hilo_vectores.start()
+
+    def detener_vectores(self, timeout=10):
+        """Detiene el hilo de los índices vectoriales."""
+        self._detener_vectores.set()
+        if self._hilo_vectores:
+            self._hilo_vectores.join(timeout)
+            self._hilo_vectores = None
+
+    def _bucle_vectores(self):
+        # Primera pasada al arrancar, luego cada intervalo
+        espera = 0
+        while not self._detener_vectores.wait(espera):
+            try:
+                inicio = time.monotonic()
+                agregados = self.actualizar_vectores()
+                if agregados:
+                    logger.info(
+                        f"Índices vectoriales: {agregados} registros añadidos "
+                        f"en {time.monotonic() - inicio:.1f}s"
                     )
+            except Exception as e:
+                logger.error(f"Error actualizando índices vectoriales: {e}")
+            espera = MEMORIA_VECTORES_INTERVALO_SEGUNDOS
 
-            if contextos:
-                # Máximo 3 contextos para no sobrecargar el prompt
-                return "\n\n".join(contextos[:3])
-            return ""
+    def actualizar_vectores(self):
+        """
+        Añade a los índices vectoriales los registros de la BD que aún no
+        tienen vector y, cuando toca, los compacta. Retorna los añadidos.
+        """
+        agregados = 0
+        with self._lock_vectores:
+            for tipo, indice in self._vectores.items():
+                _, _, tabla_datos, columna_texto = self._TABLAS[tipo]
+                cursor = self._db.conexion().execute(
+                    f"SELECT id, {columna_texto} FROM {tabla_datos} WHERE id > ? ORDER BY id",
+                    (indice.ultimo_id(),),
+                )
+                vacio = np.zeros(indice.dimension, dtype=np.float32)
+                while not self._detener_vectores.is_set():
+                    filas = cursor.fetchmany(5000)
+                    if not filas:
+                        break
+                    # Las preguntas sin palabras se guardan como vector nulo (no coinciden nunca)
+                    vectores = [
+                        vectorizar(_palabras_registro(tipo, texto), indice.dimension)
+                        for _, texto in filas
+                    ]
+                    agregados += indice.agregar(
+                        [reg_id for reg_id, _ in filas],
+                        np.vstack([vacio if v is None else v for v in vectores]),
+                    )
+                cursor.close()
+        if time.monotonic() >= self._proxima_compactacion:
+            self._proxima_compactacion = time.monotonic() + MEMORIA_VECTORES_COMPACTAR_HORAS * 3600
+            self.compactar_vectores()
+        return agregados
 
+    def _recuperar_vectorial(self, tipo, palabras, umbral, idioma, k=10):
+        """
+        Registros que alcanzan el umbral de similitud por palabras una vez
+        corregidas las faltas de la consulta. Mismo formato que _recuperar().
+
+        El coseno de los n-gramas (>= MEMORIA_VECTORES_UMBRAL) solo elige los
+        candidatos y nunca decide por sí solo: enfermedades distintas como
+        hipertensión e hipotensión comparten casi todos sus n-gramas. Con
+        cada candidato se corrigen las palabras de la consulta que no existen
+        en el índice (_corregir_palabras) y se vuelve a exigir la similitud
+        por palabras clave de buscar().
+
+        Solo lee lo que ya está en disco: los registros guardados después de
+        la última pasada de iniciar_vectores() aún no son candidatos.
+
+        Recorrer el índice cuesta O(n·d): unos 6 ms con 100k registros y
+        60 ms con 1M. Por eso solo se hace si alguna palabra desconocida
+        tiene en el vocabulario otra a una falta (_correccion_posible); una
+        palabra que no existe ni con una falta no se puede corregir.
+        """
+        if tipo not in self._vectores or not palabras:
+            return []
+        # Sin palabras desconocidas no hay faltas que corregir
+        tabla_frecuencias = self._INDICES[tipo][1]
+        lista = list(palabras)
+        conocidas = {
+            fila[0] for fila in self._db.conexion().execute(
+                f"SELECT palabra FROM {tabla_frecuencias} "
+                f"WHERE palabra IN ({','.join('?' * len(lista))})",
+                lista,
+            )
+        }
+        desconocidas = palabras - conocidas
+        if not desconocidas or not self._correccion_posible(tipo, desconocidas):
+            return []
+        indice = self._vectores[tipo]
+        vector = vectorizar(palabras, indice.dimension)
+        if vector is None:
+            return []
+        if self._RECUPERACION[tipo][1]:
+            k *= 5
+        resultados = indice.buscar(vector, k, MEMORIA_VECTORES_UMBRAL)
+        if not resultados:
+            return []
+        filas = self._filas(tipo, [reg_id for reg_id, _ in resultados], idioma)
+        aceptados = []
+        for reg_id, _ in resultados:
+            fila = filas.get(reg_id)
+            if fila is None:
+                continue
+            guardadas = _palabras_registro(tipo, fila[1])
+            corregidas = _corregir_palabras(palabras, desconocidas, guardadas)
+            similitud = _calcular_similitud(corregidas, guardadas)
+            if similitud >= umbral:
+                aceptados.append((similitud, fila))
+        # A igualdad de similitud se mantiene el orden por coseno
+        aceptados.sort(key=lambda aceptado: -aceptado[0])
+        return aceptados
+
+    def _correccion_posible(self, tipo, desconocidas):
+        """
+        Indica si alguna palabra desconocida corregible tiene en el
+        vocabulario del tipo otra a DISTANCIA_CORRECCION faltas o menos, sin
+        contar acentos. Sus variantes de una falta se buscan en la columna
+        `normalizada` de la tabla de frecuencias: una sola consulta por
+        índice, con las variantes en un array JSON para que la sentencia
+        sea siempre la misma.
+        """
+        variantes = set()
+        for palabra in desconocidas:
+            if _corregible(palabra):
+                variantes |= variantes_edicion(normalizar(palabra))
+        if not variantes:
+            return False
+        tabla_frecuencias = self._INDICES[tipo][1]
+        return self._db.conexion().execute(
+            f"""SELECT 1 FROM json_each(?) v
+                JOIN {tabla_frecuencias} f ON f.normalizada = v.value LIMIT 1""",
+            (json.dumps(list(variantes)),),
+        ).fetchone() is not None
+
+    def compactar_vectores(self):
+        """Reescribe los índices vectoriales sin los registros que ya no existen."""
+        eliminadas = 0
+        try:
+            for tipo, indice in self._vectores.items():
+                _, _, tabla_datos, _ = self._TABLAS[tipo]
+                cursor = self._db.conexion().execute(f"SELECT id FROM {tabla_datos}")
+                ids = np.fromiter((fila[0] for fila in cursor), dtype=np.int64)
+                eliminadas += indice.compactar(ids)
         except Exception as e:
-            logger.error(f"Error obteniendo contexto de memoria: {e}")
-            return ""
+            logger.error(f"Error compactando índices vectoriales: {e}")
+        return eliminadas
+
+    # ==================== Duplicados (MinHash/LSH) ====================
+
+    def _insertar_conocimiento(
+        self, cursor, pregunta, respuesta, idioma, categoria, ahora, palabras=None, firma=None
+    ):
+        """Inserta un par pregunta/respuesta y lo registra en los cubos LSH."""
+        if palabras is None:
+            palabras = _tokenizar(pregunta)
+        if firma is None:
+            firma = minhash.firma(palabras)
+        cursor.execute(
+            """INSERT INTO conocimiento_aprendido
+               (pregunta, respuesta, idioma, categoria, fecha_creacion, fecha_ultimo_uso,
+                num_palabras, firma_minhash)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+            (pregunta, respuesta, idioma, categoria, ahora, ahora, len(palabras),
+             minhash.serializar(firma) if firma else b""),
+        )
+        reg_id = cursor.lastrowid
+        self._indexar_lsh(cursor, "conocimiento", reg_id, firma, idioma)
+        self._indexar_palabras(cursor, "conocimiento", reg_id, palabras, idioma)
+        return reg_id
+
+    # Tabla de cubos LSH, su columna de id, tabla de datos y columna de texto
+    _TABLAS = {
+        "conocimiento": ("lsh_conocimiento", "conocimiento_id", "conocimiento_aprendido", "pregunta"),
+        "patrones": ("lsh_patrones", "patron_id", "patrones_aprendidos", "patron_palabras"),
+    }
+    # Índice invertido y tabla de documentos por palabra de cada tipo
+    _INDICES = {
+        "conocimiento": ("indice_conocimiento", "frecuencia_palabras"),
+        "patrones": ("indice_patrones", "frecuencia_patrones"),
+    }
+
+    @classmethod
+    def _indexar_palabras(cls, cursor, tipo, reg_id, palabras, idioma):
+        """Añade las palabras de un registro al índice invertido y a los totales de BM25."""
+        tabla_indice, tabla_frecuencias = cls._INDICES[tipo]
+        columna = cls._TABLAS[tipo][1]
+        num_palabras = len(palabras)
+        cursor.executemany(
+            f"""INSERT OR IGNORE INTO {tabla_indice} (palabra, num_palabras, {columna}, idioma)
+                VALUES (?, ?, ?, ?)""",
+            [(palabra, num_palabras, reg_id, idioma or "es") for palabra in palabras],
+        )
+        cursor.executemany(
+            f"""INSERT INTO {tabla_frecuencias} (palabra, documentos, normalizada) VALUES (?, 1, ?)
+                ON CONFLICT(palabra) DO UPDATE SET documentos = documentos + 1""",
+            [(palabra, normalizar(palabra)) for palabra in palabras],
+        )
+        cursor.execute(
+            """UPDATE totales_indice SET documentos = documentos + 1, palabras = palabras + ?
+               WHERE tipo = ?""",
+            (num_palabras, tipo),
+        )
+
+    @staticmethod
+    def _normalizar_vocabulario(conn, tabla_frecuencias):
+        """Añade la forma normalizada a las tablas de frecuencias anteriores a ella."""
+        columnas = {fila[1] for fila in conn.execute(f"PRAGMA table_info({tabla_frecuencias})")}
+        if "normalizada" in columnas:
+            return
+        conn.execute(f"ALTER TABLE {tabla_frecuencias} ADD COLUMN normalizada TEXT")
+        palabras = [fila[0] for fila in conn.execute(f"SELECT palabra FROM {tabla_frecuencias}")]
+        conn.executemany(
+            f"UPDATE {tabla_frecuencias} SET normalizada = ? WHERE palabra = ?",
+            [(normalizar(palabra), palabra) for palabra in palabras],
+        )
+        if palabras:
+            logger.info(f"Vocabulario de {tabla_frecuencias} normalizado: {len(palabras)} palabras")
+
+    def _indexar_pendientes(self, cursor):
+        """
+        Construye el índice invertido de los tipos que aún no tienen totales:
+        bases de datos nuevas o anteriores a él. Se hace una vez, al arrancar.
+        """
+        for tipo, (tabla_indice, tabla_frecuencias) in self._INDICES.items():
+            if cursor.execute("SELECT 1 FROM totales_indice WHERE tipo = ?", (tipo,)).fetchone():
+                continue
+            cursor.execute(f"DELETE FROM {tabla_indice}")
+            cursor.execute(f"DELETE FROM {tabla_frecuencias}")
+            cursor.execute("INSERT INTO totales_indice (tipo) VALUES (?)", (tipo,))
+            _, _, tabla_datos, columna_texto = self._TABLAS[tipo]
+            lector = cursor.connection.execute(
+                f"SELECT id, {columna_texto}, idioma FROM {tabla_datos} ORDER BY id"
+            )
+            indexados = 0
+            while True:
+                filas = lector.fetchmany(5000)
+                if not filas:
+                    break
+                for reg_id, texto, idioma in filas:
+                    self._indexar_palabras(cursor, tipo, reg_id, _palabras_registro(tipo, texto), idioma)
+                indexados += len(filas)
+            if indexados:
+                logger.info(f"Índice invertido de {tipo} construido para {indexados} registros")
+
+    @classmethod
+    def _indexar_lsh(cls, cursor, tipo, reg_id, firma, idioma):
+        """Registra la firma de un registro en sus cubos LSH."""
+        if not firma:
+            return
+        tabla, columna, _, _ = cls._TABLAS[tipo]
+        cursor.executemany(
+            f"INSERT OR IGNORE INTO {tabla} (clave, {columna}) VALUES (?, ?)",
+            [(clave, reg_id) for clave in minhash.claves_lsh(firma, idioma or "es")],
+        )
+
+    @classmethod
+    def _candidatos_duplicado(cls, cursor, tipo, firma, idioma, limite=50):
+        """
+        Registros que comparten algún cubo LSH con la firma, los que más
+        bandas comparten primero. Retorna (id, texto) para verificar.
+        """
+        if not firma:
+            return []
+        tabla, columna, tabla_datos, columna_texto = cls._TABLAS[tipo]
+        claves = minhash.claves_lsh(firma, idioma or "es")
+        cursor.execute(
+            f"""SELECT d.id, d.{columna_texto}
+                FROM (SELECT {columna} AS id, COUNT(*) AS bandas
+                      FROM {tabla}
+                      WHERE clave IN ({",".join("?" * len(claves))})
+                      GROUP BY {columna}
+                      ORDER BY bandas DESC, {columna}
+                      LIMIT ?) AS l
+                JOIN {tabla_datos} d ON d.id = l.id
+                WHERE COALESCE(d.idioma, 'es') = ?
+                ORDER BY l.bandas DESC, d.id""",
+            claves + [limite, idioma or "es"],
+        )
+        return cursor.fetchall()
+
+    def _firmar_pendientes(self, cursor):
+        """Calcula firmas MinHash y cubos LSH de los registros anteriores a ellos."""
+        firmados = 0
+        for tipo in self._TABLAS:
+            _, _, tabla_datos, columna_texto = self._TABLAS[tipo]
+            cursor.execute(
+                f"SELECT id, {columna_texto}, idioma FROM {tabla_datos} WHERE firma_minhash IS NULL"
+            )
+            for reg_id, texto, idioma in cursor.fetchall():
+                firma = minhash.firma(_palabras_registro(tipo, texto))
+                cursor.execute(
+                    f"UPDATE {tabla_datos} SET firma_minhash = ? WHERE id = ?",
+                    (minhash.serializar(firma) if firma else b"", reg_id),
+                )
+                self._indexar_lsh(cursor, tipo, reg_id, firma, idioma)
+                firmados += 1
+        if firmados:
+            logger.info(f"Firmas MinHash calculadas para {firmados} registros")
 
     # ==================== Historial de consultas ====================
 
-    def registrar_consulta(self, user_id, pregunta, respuesta, fuente, idioma="es", categoria="general"):
-        """Registra cada interacción en el historial completo."""
+    def registrar_consulta(
+        self, user_id, pregunta, respuesta, fuente, idioma="es", categoria="general",
+        enviar=False, adjuntos=(), texto_envio=None,
+    ):
+        """
+        Registra cada interacción en el historial completo.
+        Con `enviar`, la respuesta (y los payloads `adjuntos`) se encola en la
+        bandeja de salida hacia `user_id` en la misma transacción: si queda
+        en el historial, también queda pendiente de envío. `texto_envio`
+        sustituye a la respuesta en la bandeja cuando ya se envió una parte.
+        """
+        if texto_envio is None:
+            texto_envio = respuesta
         try:
-            conn = sqlite3.connect(DB_PATH)
             ahora = datetime.now().isoformat()
-            conn.execute(
-                """INSERT INTO historial_consultas
-                   (user_id, pregunta, respuesta, fuente, idioma, categoria, fecha)
-                   VALUES (?, ?, ?, ?, ?, ?, ?)""",
-                (user_id, pregunta, respuesta, fuente, idioma, categoria, ahora),
-            )
-            conn.commit()
-            conn.close()
+            with self._db.transaccion() as conn:
+                conn.execute(
+                    """INSERT INTO historial_consultas
+                       (user_id, pregunta, respuesta, fuente, idioma, categoria, fecha)
+                       VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                    (user_id, pregunta, respuesta, fuente, idioma, categoria, ahora),
+                )
+                self._sumar_estadisticas(conn, fuente, categoria, ahora)
+                if enviar:
+                    self.bandeja_salida.agregar(conn, user_id, texto_envio, adjuntos)
             logger.debug(f"Consulta registrada [{fuente}]: {pregunta[:50]}")
         except Exception as e:
             logger.error(f"Error registrando consulta: {e}")
+            if enviar:
+                # Sin historial, pero el usuario debe recibir su respuesta
+                self.bandeja_salida.encolar(user_id, texto_envio, adjuntos)
+            return
+        if enviar:
+            self.bandeja_salida.avisar()
 
     def obtener_historial_usuario(self, user_id, limite=10):
-        """Obtiene el historial reciente de un usuario."""
+        """Obtiene el historial reciente de un usuario (incluido el archivado)."""
         try:
-            conn = sqlite3.connect(DB_PATH)
-            cursor = conn.cursor()
+            cursor = self._db.conexion().cursor()
             cursor.execute(
                 """SELECT pregunta, respuesta, fuente, categoria, fecha
                    FROM historial_consultas
@@ -300,7 +973,12 @@ class KnowledgeMemory:
                 (user_id, limite),
             )
             registros = cursor.fetchall()
-            conn.close()
+            if len(registros) < limite:
+                # Completar con los meses archivados
+                registros += [
+                    (r["pregunta"], r["respuesta"], r["fuente"], r["categoria"], r["fecha"])
+                    for r in self.archivo.historial_usuario(user_id, limite - len(registros))
+                ]
             return [
                 {
                     "pregunta": r[0],
@@ -315,23 +993,40 @@ class KnowledgeMemory:
             logger.error(f"Error obteniendo historial: {e}")
             return []
 
+    def obtener_turnos_recientes(self, user_id, limite=3, fuente="openai"):
+        """
+        Últimos turnos (pregunta, respuesta) de un usuario, del más antiguo
+        al más reciente. Sirve para rehidratar el historial de conversación.
+        """
+        try:
+            cursor = self._db.conexion().cursor()
+            cursor.execute(
+                """SELECT pregunta, respuesta FROM historial_consultas
+                   WHERE user_id = ? AND fuente = ?
+                   ORDER BY id DESC
+                   LIMIT ?""",
+                (user_id, fuente, limite),
+            )
+            return cursor.fetchall()[::-1]
+        except Exception as e:
+            logger.error(f"Error obteniendo turnos recientes: {e}")
+            return []
+
     def obtener_temas_populares(self, limite=10, dias=30):
-        """Obtiene los temas más consultados en los últimos N días."""
+        """Obtiene los temas más consultados en los últimos N días (por horas)."""
         try:
-            conn = sqlite3.connect(DB_PATH)
-            cursor = conn.cursor()
-            fecha_limite = (datetime.now() - timedelta(days=dias)).isoformat()
+            cursor = self._db.conexion().cursor()
+            hora_limite = _hora(datetime.now() - timedelta(days=dias))
             cursor.execute(
-                """SELECT categoria, COUNT(*) as total
-                   FROM historial_consultas
-                   WHERE fecha >= ?
+                """SELECT categoria, SUM(total) as total
+                   FROM estadisticas_horarias
+                   WHERE hora >= ?
                    GROUP BY categoria
                    ORDER BY total DESC
                    LIMIT ?""",
-                (fecha_limite, limite),
+                (hora_limite, limite),
             )
             registros = cursor.fetchall()
-            conn.close()
             return [{"categoria": r[0], "total": r[1]} for r in registros]
         except Exception as e:
             logger.error(f"Error obteniendo temas populares: {e}")
@@ -342,8 +1037,7 @@ class KnowledgeMemory:
     def obtener_perfil(self, user_id):
         """Obtiene o crea perfil persistente de usuario."""
         try:
-            conn = sqlite3.connect(DB_PATH)
-            cursor = conn.cursor()
+            cursor = self._db.conexion().cursor()
             cursor.execute(
                 "SELECT * FROM perfiles_usuario WHERE user_id = ?",
                 (user_id,),
@@ -351,7 +1045,6 @@ class KnowledgeMemory:
             registro = cursor.fetchone()
 
             if registro:
-                conn.close()
                 return {
                     "user_id": registro[0],
                     "idioma_preferido": registro[1],
@@ -363,15 +1056,14 @@ class KnowledgeMemory:
 
             # Crear perfil nuevo
             ahora = datetime.now().isoformat()
-            cursor.execute(
-                """INSERT INTO perfiles_usuario
-                   (user_id, idioma_preferido, total_mensajes, temas_frecuentes,
-                    primera_interaccion, ultima_interaccion)
-                   VALUES (?, 'es', 0, '{}', ?, ?)""",
-                (user_id, ahora, ahora),
-            )
-            conn.commit()
-            conn.close()
+            with self._db.transaccion() as conn:
+                conn.execute(
+                    """INSERT OR IGNORE INTO perfiles_usuario
+                       (user_id, idioma_preferido, total_mensajes, temas_frecuentes,
+                        primera_interaccion, ultima_interaccion)
+                       VALUES (?, 'es', 0, '{}', ?, ?)""",
+                    (user_id, ahora, ahora),
+                )
             return {
                 "user_id": user_id,
                 "idioma_preferido": "es",
@@ -387,32 +1079,31 @@ class KnowledgeMemory:
     def actualizar_perfil(self, user_id, idioma=None, tema=None):
         """Actualiza perfil con última interacción, idioma y temas."""
         try:
-            # Asegurar que el perfil existe
-            perfil = self.obtener_perfil(user_id)
-            if not perfil:
-                return
-
-            conn = sqlite3.connect(DB_PATH)
-            ahora = datetime.now().isoformat()
-
-            # Actualizar temas frecuentes
-            temas = perfil["temas_frecuentes"]
-            if tema:
-                temas[tema] = temas.get(tema, 0) + 1
+            # Lectura y escritura en la misma transacción para no perder temas
+            with self._db.transaccion() as conn:
+                # Asegurar que el perfil existe
+                perfil = self.obtener_perfil(user_id)
+                if not perfil:
+                    return
 
-            idioma_actual = idioma or perfil["idioma_preferido"]
+                ahora = datetime.now().isoformat()
 
-            conn.execute(
-                """UPDATE perfiles_usuario
-                   SET idioma_preferido = ?,
-                       total_mensajes = total_mensajes + 1,
-                       temas_frecuentes = ?,
-                       ultima_interaccion = ?
-                   WHERE user_id = ?""",
-                (idioma_actual, json.dumps(temas), ahora, user_id),
-            )
-            conn.commit()
-            conn.close()
+                # Actualizar temas frecuentes
+                temas = perfil["temas_frecuentes"]
+                if tema:
+                    temas[tema] = temas.get(tema, 0) + 1
+
+                idioma_actual = idioma or perfil["idioma_preferido"]
+
+                conn.execute(
+                    """UPDATE perfiles_usuario
+                       SET idioma_preferido = ?,
+                           total_mensajes = total_mensajes + 1,
+                           temas_frecuentes = ?,
+                           ultima_interaccion = ?
+                       WHERE user_id = ?""",
+                    (idioma_actual, json.dumps(temas), ahora, user_id),
+                )
             logger.debug(f"Perfil actualizado para {user_id}")
         except Exception as e:
             logger.error(f"Error actualizando perfil: {e}")
@@ -422,52 +1113,47 @@ class KnowledgeMemory:
     def actualizar_patron(self, pregunta, respuesta, idioma="es", categoria="general"):
         """Crea o actualiza un patrón aprendido a partir de preguntas frecuentes."""
         try:
-            conn = sqlite3.connect(DB_PATH)
-            cursor = conn.cursor()
             ahora = datetime.now().isoformat()
 
             palabras = _tokenizar(pregunta)
             if not palabras:
-                conn.close()
                 return
 
             patron_str = " ".join(sorted(palabras))
 
-            # Buscar patrón similar existente
-            cursor.execute(
-                "SELECT id, patron_palabras, frecuencia FROM patrones_aprendidos WHERE idioma = ?",
-                (idioma,),
-            )
-            registros = cursor.fetchall()
-
-            for reg_id, reg_patron, reg_frecuencia in registros:
-                palabras_guardada = set(reg_patron.split())
-                similitud = _calcular_similitud(palabras, palabras_guardada)
-
-                if similitud >= 0.7:
-                    cursor.execute(
-                        """UPDATE patrones_aprendidos
-                           SET frecuencia = frecuencia + 1,
-                               respuesta_sugerida = ?,
-                               fecha_actualizacion = ?
-                           WHERE id = ?""",
-                        (respuesta, ahora, reg_id),
-                    )
-                    conn.commit()
-                    conn.close()
-                    logger.debug(f"Patrón actualizado (freq={reg_frecuencia + 1}): {patron_str[:50]}")
-                    return
-
-            # Nuevo patrón
-            cursor.execute(
-                """INSERT INTO patrones_aprendidos
-                   (patron_palabras, categoria, respuesta_sugerida, frecuencia,
-                    idioma, fecha_creacion, fecha_actualizacion)
-                   VALUES (?, ?, ?, 1, ?, ?, ?)""",
-                (patron_str, categoria, respuesta, idioma, ahora, ahora),
-            )
-            conn.commit()
-            conn.close()
+            with self._db.transaccion() as conn:
+                cursor = conn.cursor()
+
+                # Buscar patrón similar existente (candidatos LSH)
+                firma = minhash.firma(palabras)
+                for reg_id, reg_patron in self._candidatos_duplicado(cursor, "patrones", firma, idioma):
+                    palabras_guardada = set(reg_patron.split())
+                    similitud = _calcular_similitud(palabras, palabras_guardada)
+
+                    if similitud >= 0.7:
+                        cursor.execute(
+                            """UPDATE patrones_aprendidos
+                               SET frecuencia = frecuencia + 1,
+                                   respuesta_sugerida = ?,
+                                   fecha_actualizacion = ?
+                               WHERE id = ?""",
+                            (respuesta, ahora, reg_id),
+                        )
+                        logger.debug(f"Patrón actualizado (sim={similitud:.2f}): {patron_str[:50]}")
+                        return
+
+                # Nuevo patrón
+                cursor.execute(
+                    """INSERT INTO patrones_aprendidos
+                       (patron_palabras, categoria, respuesta_sugerida, frecuencia,
+                        idioma, fecha_creacion, fecha_actualizacion, firma_minhash)
+                       VALUES (?, ?, ?, 1, ?, ?, ?, ?)""",
+                    (patron_str, categoria, respuesta, idioma, ahora, ahora,
+                     minhash.serializar(firma)),
+                )
+                reg_id = cursor.lastrowid
+                self._indexar_lsh(cursor, "patrones", reg_id, firma, idioma)
+                self._indexar_palabras(cursor, "patrones", reg_id, palabras, idioma)
             logger.debug(f"Nuevo patrón creado: {patron_str[:50]}")
         except Exception as e:
             logger.error(f"Error actualizando patrón: {e}")
@@ -479,45 +1165,27 @@ class KnowledgeMemory:
         Retorna (respuesta, frecuencia, confianza) o (None, 0, 0).
         """
         try:
-            conn = sqlite3.connect(DB_PATH)
-            cursor = conn.cursor()
-            cursor.execute(
-                """SELECT id, patron_palabras, respuesta_sugerida, frecuencia
-                   FROM patrones_aprendidos
-                   WHERE idioma = ? AND frecuencia >= 3""",
-                (idioma,),
-            )
-            registros = cursor.fetchall()
-
             palabras_nueva = _tokenizar(pregunta)
-            mejor_match = None
-            mejor_similitud = 0.0
-
-            for reg_id, reg_patron, reg_respuesta, reg_frecuencia in registros:
-                palabras_guardada = set(reg_patron.split())
-                similitud = _calcular_similitud(palabras_nueva, palabras_guardada)
-
-                if similitud > mejor_similitud:
-                    mejor_similitud = similitud
-                    mejor_match = (reg_id, reg_respuesta, reg_frecuencia)
+            aceptados = self._recuperar("patrones", palabras_nueva, 0.6, idioma)
+            if not aceptados:
+                aceptados = self._recuperar_vectorial("patrones", palabras_nueva, 0.6, idioma)
 
-            if mejor_match and mejor_similitud >= 0.6:
+            if aceptados:
+                similitud, (reg_id, _, reg_respuesta, reg_frecuencia) = aceptados[0]
                 ahora = datetime.now().isoformat()
-                cursor.execute(
-                    """UPDATE patrones_aprendidos
-                       SET frecuencia = frecuencia + 1,
-                           fecha_actualizacion = ?
-                       WHERE id = ?""",
-                    (ahora, mejor_match[0]),
-                )
-                conn.commit()
-                conn.close()
+                with self._db.transaccion() as conn:
+                    conn.execute(
+                        """UPDATE patrones_aprendidos
+                           SET frecuencia = frecuencia + 1,
+                               fecha_actualizacion = ?
+                           WHERE id = ?""",
+                        (ahora, reg_id),
+                    )
                 logger.info(
-                    f"Patrón encontrado (freq={mejor_match[2]}, sim={mejor_similitud:.2f}): {pregunta[:50]}"
+                    f"Patrón encontrado (freq={reg_frecuencia}, sim={similitud:.2f}): {pregunta[:50]}"
                 )
-                return mejor_match[1], mejor_match[2], mejor_similitud
+                return reg_respuesta, reg_frecuencia, similitud
 
-            conn.close()
             return None, 0, 0.0
         except Exception as e:
             logger.error(f"Error buscando patrón: {e}")
@@ -530,12 +1198,20 @@ class KnowledgeMemory:
         Combina memoria + patrones + historial + tendencias para enriquecer
         el prompt de OpenAI con todo el conocimiento disponible.
         """
-        partes = []
+        return formatear_bloques_contexto(self.obtener_bloques_contexto(pregunta, user_id))
+
+    def obtener_bloques_contexto(self, pregunta, user_id):
+        """
+        El contexto enriquecido por piezas: [(tipo, texto, relevancia)], con
+        la relevancia entre 0 y 1 dentro de su tipo (la similitud en el caso
+        del conocimiento aprendido), para que el prompt pueda descartar las
+        menos útiles si no caben.
+        """
+        bloques = []
 
         # 1. Contexto de conocimiento aprendido
-        contexto_memoria = self.obtener_contexto_para_ia(pregunta)
-        if contexto_memoria:
-            partes.append(f"[Conocimiento aprendido]\n{contexto_memoria}")
+        for similitud, texto in self._contextos_conocimiento(pregunta):
+            bloques.append(("conocimiento", texto, min(1.0, similitud)))
 
         # 2. Historial reciente del usuario
         historial = self.obtener_historial_usuario(user_id, limite=5)
@@ -544,13 +1220,13 @@ class KnowledgeMemory:
                 f"- Preguntó: {h['pregunta'][:80]} → Tema: {h['categoria']}"
                 for h in historial
             )
-            partes.append(f"[Historial reciente del usuario]\n{hist_texto}")
+            bloques.append(("historial_usuario", hist_texto, 1.0))
 
         # 3. Temas populares recientes
         temas = self.obtener_temas_populares(limite=5, dias=7)
         if temas:
             temas_texto = ", ".join(f"{t['categoria']}({t['total']})" for t in temas)
-            partes.append(f"[Temas populares esta semana]\n{temas_texto}")
+            bloques.append(("temas_populares", temas_texto, 1.0))
 
         # 4. Perfil del usuario
         perfil = self.obtener_perfil(user_id)
@@ -562,19 +1238,16 @@ class KnowledgeMemory:
             )[:3]
             if top_temas:
                 temas_user = ", ".join(f"{t[0]}" for t in top_temas)
-                partes.append(f"[Intereses del usuario]\nTemas frecuentes: {temas_user}")
+                bloques.append(("intereses", f"Temas frecuentes: {temas_user}", 1.0))
 
-        if partes:
-            return "\n\n".join(partes)
-        return ""
+        return bloques
 
     # ==================== Estadísticas ====================
 
     def obtener_estadisticas(self):
         """Estadísticas completas del sistema de aprendizaje."""
         try:
-            conn = sqlite3.connect(DB_PATH)
-            cursor = conn.cursor()
+            cursor = self._db.conexion().cursor()
 
             stats = {}
 
@@ -582,27 +1255,18 @@ class KnowledgeMemory:
             cursor.execute("SELECT COUNT(*) FROM conocimiento_aprendido")
             stats["conocimientos_aprendidos"] = cursor.fetchone()[0]
 
-            # Total de consultas registradas
-            cursor.execute("SELECT COUNT(*) FROM historial_consultas")
-            stats["total_consultas"] = cursor.fetchone()[0]
-
-            # Consultas por fuente
+            # Totales de consultas desde los contadores acumulados
             cursor.execute(
-                """SELECT fuente, COUNT(*) as total
-                   FROM historial_consultas
-                   GROUP BY fuente
+                """SELECT dimension, valor, total
+                   FROM estadisticas_contadores
                    ORDER BY total DESC"""
             )
-            stats["consultas_por_fuente"] = {r[0]: r[1] for r in cursor.fetchall()}
-
-            # Consultas por categoría
-            cursor.execute(
-                """SELECT categoria, COUNT(*) as total
-                   FROM historial_consultas
-                   GROUP BY categoria
-                   ORDER BY total DESC"""
-            )
-            stats["consultas_por_categoria"] = {r[0]: r[1] for r in cursor.fetchall()}
+            contadores = {"total": {}, "fuente": {}, "categoria": {}}
+            for dimension, valor, total in cursor.fetchall():
+                contadores.setdefault(dimension, {})[valor] = total
+            stats["total_consultas"] = contadores["total"].get("", 0)
+            stats["consultas_por_fuente"] = contadores["fuente"]
+            stats["consultas_por_categoria"] = contadores["categoria"]
 
             # Total de usuarios únicos
             cursor.execute("SELECT COUNT(*) FROM perfiles_usuario")
@@ -629,9 +1293,9 @@ class KnowledgeMemory:
             ]
 
             # Consultas últimas 24 horas
-            hace_24h = (datetime.now() - timedelta(hours=24)).isoformat()
+            hace_24h = _hora(datetime.now() - timedelta(hours=24))
             cursor.execute(
-                "SELECT COUNT(*) FROM historial_consultas WHERE fecha >= ?",
+                "SELECT COALESCE(SUM(total), 0) FROM estadisticas_horarias WHERE hora >= ?",
                 (hace_24h,),
             )
             stats["consultas_24h"] = cursor.fetchone()[0]
@@ -639,8 +1303,62 @@ class KnowledgeMemory:
             # Temas populares última semana
             stats["temas_populares_semana"] = self.obtener_temas_populares(limite=10, dias=7)
 
-            conn.close()
             return stats
         except Exception as e:
             logger.error(f"Error obteniendo estadísticas: {e}")
             return {"error": str(e)}
+
+    def _sumar_estadisticas(self, conn, fuente, categoria, fecha):
+        """Suma una consulta a los contadores y a su franja horaria."""
+        conn.executemany(
+            """INSERT INTO estadisticas_contadores (dimension, valor, total)
+               VALUES (?, ?, 1)
+               ON CONFLICT(dimension, valor) DO UPDATE SET total = total + 1""",
+            (("total", ""), ("fuente", fuente), ("categoria", categoria or "general")),
+        )
+        conn.execute(
+            """INSERT INTO estadisticas_horarias (hora, categoria, total)
+               VALUES (?, ?, 1)
+               ON CONFLICT(hora, categoria) DO UPDATE SET total = total + 1""",
+            (_hora(fecha), categoria or "general"),
+        )
+
+    def _reconstruir_resumenes(self, conn):
+        """Recalcula contadores y franjas horarias desde el historial completo."""
+        conn.execute("DELETE FROM estadisticas_contadores")
+        conn.execute("DELETE FROM estadisticas_horarias")
+        conn.execute(
+            """INSERT INTO estadisticas_contadores (dimension, valor, total)
+               SELECT 'total', '', COUNT(*) FROM historial_consultas
+               UNION ALL
+               SELECT 'fuente', fuente, COUNT(*) FROM historial_consultas GROUP BY fuente
+               UNION ALL
+               SELECT 'categoria', COALESCE(categoria, 'general'), COUNT(*)
+               FROM historial_consultas GROUP BY COALESCE(categoria, 'general')"""
+        )
+        conn.execute(
+            """INSERT INTO estadisticas_horarias (hora, categoria, total)
+               SELECT substr(fecha, 1, 13), COALESCE(categoria, 'general'), COUNT(*)
+               FROM historial_consultas
+               GROUP BY substr(fecha, 1, 13), COALESCE(categoria, 'general')"""
+        )
+        total = conn.execute(
+            "SELECT total FROM estadisticas_contadores WHERE dimension = 'total'"
+        ).fetchone()[0]
+        logger.info(f"Resúmenes de estadísticas reconstruidos ({total} consultas)")
+        return total
+
+    def reconstruir_estadisticas(self):
+        """
+        Reconstruye los resúmenes de estadísticas a partir del historial,
+        incluidos los meses archivados.
+        Retorna el número de consultas contabilizadas.
+        """
+        with self._db.transaccion() as conn:
+            total = self._reconstruir_resumenes(conn)
+            for registro in self.archivo.leer():
+                self._sumar_estadisticas(
+                    conn, registro["fuente"], registro["categoria"], registro["fecha"]
+                )
+                total += 1
+        return total
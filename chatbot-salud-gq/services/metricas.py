@@ -0,0 +1,240 @@
+"""
+Métricas del chatbot en formato de texto de Prometheus (/metrics).
+
+Los contadores e histogramas se crean una sola vez al importar el módulo,
+con todas sus etiquetas ya resueltas: medir una etapa es sumar en una lista
+preasignada bajo un lock, sin crear objetos ni etiquetas por llamada. Las
+métricas que ya calculan otros servicios (cachés, colas...) se leen solo
+cuando Prometheus consulta el endpoint.
+"""
+
+import threading
+from bisect import bisect_left
+
+# Límites de los histogramas de latencia, en segundos (de 100 µs a 30 s)
+LIMITES_SEGUNDOS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+    0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+)
+# Límites del histograma de tamaño del prompt, en tokens
+LIMITES_TOKENS = (100, 250, 500, 750, 1000, 1500, 2000, 3000, 4000, 8000)
+
+
+def _formatear_valor(valor):
+    if valor == float("inf"):
+        return "+Inf"
+    if isinstance(valor, bool):
+        return "1" if valor else "0"
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+def _etiquetas(etiquetas, extra=None):
+    pares = list(etiquetas) + ([extra] if extra else [])
+    if not pares:
+        return ""
+    return "{" + ",".join(f'{nombre}="{valor}"' for nombre, valor in pares) + "}"
+
+
+class Contador:
+    """Contador monótono."""
+
+    def __init__(self, etiquetas=()):
+        self.etiquetas = tuple(etiquetas)
+        self._valor = 0
+        self._lock = threading.Lock()
+
+    def incrementar(self, cantidad=1):
+        with self._lock:
+            self._valor += cantidad
+
+    @property
+    def valor(self):
+        return self._valor
+
+    def _lineas(self, nombre):
+        yield f"{nombre}{_etiquetas(self.etiquetas)} {_formatear_valor(self._valor)}"
+
+
+class Histograma:
+    """Histograma de latencias con cubetas fijas (acumuladas al exponerse)."""
+
+    def __init__(self, etiquetas=(), limites=LIMITES_SEGUNDOS):
+        self.etiquetas = tuple(etiquetas)
+        self.limites = tuple(limites)
+        self._cubetas = [0] * (len(self.limites) + 1)  # la última es +Inf
+        self._suma = 0.0
+        self._lock = threading.Lock()
+
+    def observar(self, segundos):
+        cubeta = bisect_left(self.limites, segundos)
+        with self._lock:
+            self._cubetas[cubeta] += 1
+            self._suma += segundos
+
+    def instantanea(self):
+        """(cubetas, suma, total) copiados de forma consistente."""
+        with self._lock:
+            cubetas = list(self._cubetas)
+            suma = self._suma
+        return cubetas, suma, sum(cubetas)
+
+    def _lineas(self, nombre):
+        cubetas, suma, total = self.instantanea()
+        acumulado = 0
+        for limite, cantidad in zip(self.limites + (float("inf"),), cubetas):
+            acumulado += cantidad
+            etiquetas = _etiquetas(self.etiquetas, ("le", _formatear_valor(limite)))
+            yield f"{nombre}_bucket{etiquetas} {acumulado}"
+        yield f"{nombre}_sum{_etiquetas(self.etiquetas)} {_formatear_valor(suma)}"
+        yield f"{nombre}_count{_etiquetas(self.etiquetas)} {total}"
+
+
+class Familia:
+    """
+    Una métrica sin etiquetas o con una etiqueta cuyos valores se conocen de
+    antemano. Cada valor tiene su hijo ya creado: `familia.hijo("openai")`
+    es una búsqueda en un diccionario, no una asignación.
+    """
+
+    def __init__(self, nombre, ayuda, tipo, etiqueta=None, valores=(), **opciones):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.tipo = tipo
+        clase = Histograma if tipo == "histogram" else Contador
+        if etiqueta is None:
+            self._hijos = {None: clase(**opciones)}
+        else:
+            self._hijos = {valor: clase(((etiqueta, valor),), **opciones) for valor in valores}
+
+    def hijo(self, valor=None):
+        return self._hijos[valor]
+
+    def _lineas(self):
+        yield f"# HELP {self.nombre} {self.ayuda}"
+        yield f"# TYPE {self.nombre} {self.tipo}"
+        for hijo in self._hijos.values():
+            yield from hijo._lineas(self.nombre)
+
+
+class RegistroMetricas:
+    """Métricas propias más colectores que leen las de otros servicios."""
+
+    def __init__(self):
+        self._familias = []
+        self._colectores = []
+        self._lock = threading.Lock()
+
+    def familia(self, nombre, ayuda, tipo, etiqueta, valores, **opciones):
+        familia = Familia(nombre, ayuda, tipo, etiqueta, valores, **opciones)
+        self._familias.append(familia)
+        return familia
+
+    def simple(self, nombre, ayuda, tipo, **opciones):
+        """Métrica sin etiquetas: devuelve directamente el Contador o Histograma."""
+        familia = Familia(nombre, ayuda, tipo, **opciones)
+        self._familias.append(familia)
+        return familia.hijo()
+
+    def agregar_colector(self, colector):
+        """
+        `colector()` devuelve [(nombre, tipo, ayuda, [(etiquetas, valor)])],
+        con etiquetas como tupla de pares (nombre, valor).
+        """
+        with self._lock:
+            self._colectores.append(colector)
+
+    def exponer(self):
+        """Texto de todas las métricas en el formato de Prometheus 0.0.4."""
+        lineas = []
+        for familia in self._familias:
+            lineas.extend(familia._lineas())
+        with self._lock:
+            colectores = list(self._colectores)
+        for colector in colectores:
+            for nombre, tipo, ayuda, muestras in colector():
+                lineas.append(f"# HELP {nombre} {ayuda}")
+                lineas.append(f"# TYPE {nombre} {tipo}")
+                for etiquetas, valor in muestras:
+                    lineas.append(f"{nombre}{_etiquetas(etiquetas)} {_formatear_valor(valor)}")
+        return "\n".join(lineas) + "\n"
+
+
+# ==================== Métricas del chatbot ====================
+
+registro = RegistroMetricas()
+
+ETAPAS = (
+    "emergencia", "busqueda_local", "memoria", "patrones", "openai", "post_procesado",
+)
+FUENTES = ("emergencia", "local", "memoria", "patron", "openai", "openai_parcial", "fallback")
+# Bloques del prompt que el presupuesto de tokens puede recortar o descartar
+BLOQUES_PROMPT = (
+    "contexto_local", "conocimiento", "historial_usuario", "temas_populares",
+    "intereses", "resumen", "turno",
+)
+
+LATENCIA_ETAPAS = registro.familia(
+    "chatbot_etapa_segundos",
+    "Duración de cada etapa de AIService.generar_respuesta",
+    "histogram", "etapa", ETAPAS,
+)
+LATENCIA_MENSAJE = registro.simple(
+    "chatbot_mensaje_segundos",
+    "Duración total de procesar_mensaje",
+    "histogram",
+)
+LATENCIA_SQLITE = registro.simple(
+    "chatbot_sqlite_consulta_segundos",
+    "Duración de cada sentencia SQLite (execute)",
+    "histogram",
+)
+LATENCIA_WHATSAPP = registro.simple(
+    "chatbot_whatsapp_envio_segundos",
+    "Duración de cada llamada a la API de WhatsApp",
+    "histogram",
+)
+RESPUESTAS_POR_FUENTE = registro.familia(
+    "chatbot_respuestas_total",
+    "Respuestas generadas según su origen",
+    "counter", "fuente", FUENTES,
+)
+ERRORES_WHATSAPP = registro.simple(
+    "chatbot_whatsapp_errores_total",
+    "Llamadas a la API de WhatsApp que fallaron",
+    "counter",
+)
+LATENCIA_BANDEJA = registro.simple(
+    "chatbot_bandeja_salida_espera_segundos",
+    "Tiempo desde que una respuesta entra en la bandeja de salida hasta que WhatsApp la acepta",
+    "histogram",
+)
+LATENCIA_PRIMER_FRAGMENTO = registro.simple(
+    "chatbot_openai_primer_fragmento_segundos",
+    "Tiempo hasta encolar el primer fragmento de una respuesta de OpenAI en streaming",
+    "histogram",
+)
+TOKENS_PROMPT = registro.simple(
+    "chatbot_prompt_tokens",
+    "Tokens estimados del prompt de cada llamada a OpenAI, ya ajustado al presupuesto",
+    "histogram", limites=LIMITES_TOKENS,
+)
+TOKENS_PROMPT_SIN_AJUSTAR = registro.simple(
+    "chatbot_prompt_tokens_sin_ajustar",
+    "Tokens estimados que habría tenido el prompt sin presupuesto",
+    "histogram", limites=LIMITES_TOKENS,
+)
+BLOQUES_DESCARTADOS = registro.familia(
+    "chatbot_prompt_bloques_descartados_total",
+    "Bloques del prompt descartados por no caber en el presupuesto",
+    "counter", "bloque", BLOQUES_PROMPT,
+)
+BLOQUES_RECORTADOS = registro.familia(
+    "chatbot_prompt_bloques_recortados_total",
+    "Bloques del prompt recortados para caber en el presupuesto",
+    "counter", "bloque", BLOQUES_PROMPT,
+)
+TOKENS_OPENAI = registro.familia(
+    "chatbot_openai_tokens_total",
+    "Tokens que OpenAI declara haber procesado (campo usage)",
+    "counter", "tipo", ("prompt", "completion"),
+)
@@ -0,0 +1,125 @@
+"""
+Procesador asíncrono de mensajes entrantes.
+El webhook solo valida y encola; un grupo de hilos procesa los mensajes.
+Cada teléfono se asigna siempre al mismo carril (hash del número), así los
+mensajes de un usuario se atienden en orden y usuarios distintos en paralelo.
+"""
+
+import logging
+import queue
+import threading
+import time
+import zlib
+
+from config.settings import (
+    MENSAJES_DRENADO_SEGUNDOS,
+    MENSAJES_MAX_PENDIENTES,
+    MENSAJES_WORKERS,
+)
+
+logger = logging.getLogger(__name__)
+
+# Marca que indica a un carril que debe terminar
+_FIN = object()
+
+
+class ProcesadorMensajes:
+    """Grupo de carriles FIFO, uno por hilo, con reparto por teléfono."""
+
+    def __init__(
+        self,
+        manejador,
+        num_carriles=MENSAJES_WORKERS,
+        max_pendientes=MENSAJES_MAX_PENDIENTES,
+    ):
+        self.manejador = manejador
+        self.num_carriles = max(1, num_carriles)
+        self._colas = [queue.Queue(maxsize=max_pendientes) for _ in range(self.num_carriles)]
+        self._hilos = []
+        self._aceptando = False
+        self._lock = threading.Lock()
+        self._contadores = {"encolados": 0, "procesados": 0, "errores": 0, "rechazados": 0}
+
+    def iniciar(self):
+        """Arranca un hilo por carril."""
+        if self._hilos:
+            return
+        for indice, cola in enumerate(self._colas):
+            hilo = threading.Thread(
+                target=self._bucle, args=(cola,), name=f"carril-mensajes-{indice}", daemon=True
+            )
+            hilo.start()
+            self._hilos.append(hilo)
+        self._aceptando = True
+        logger.info(f"Procesador de mensajes iniciado con {self.num_carriles} carriles")
+
+    def carril(self, telefono):
+        """Carril asignado a un teléfono (estable entre procesos y reinicios)."""
+        return zlib.crc32(telefono.encode("utf-8")) % self.num_carriles
+
+    def encolar(self, telefono, mensaje_info):
+        """
+        Encola un mensaje en el carril de su teléfono.
+        Retorna False si el procesador no acepta mensajes o el carril está lleno.
+        """
+        if not self._aceptando:
+            return False
+        try:
+            self._colas[self.carril(telefono)].put_nowait((mensaje_info, time.monotonic()))
+        except queue.Full:
+            with self._lock:
+                self._contadores["rechazados"] += 1
+            logger.warning(f"Carril lleno, mensaje de {telefono} rechazado")
+            return False
+        with self._lock:
+            self._contadores["encolados"] += 1
+        return True
+
+    def _bucle(self, cola):
+        """Procesa los mensajes de un carril en orden de llegada."""
+        while True:
+            elemento = cola.get()
+            if elemento is _FIN:
+                return
+            mensaje_info, encolado = elemento
+            espera = time.monotonic() - encolado
+            if espera > 5:
+                logger.warning(f"Mensaje esperó {espera:.1f}s en cola")
+            try:
+                self.manejador(mensaje_info)
+                with self._lock:
+                    self._contadores["procesados"] += 1
+            except Exception as e:
+                with self._lock:
+                    self._contadores["errores"] += 1
+                logger.error(f"Error procesando mensaje encolado: {e}", exc_info=True)
+
+    def detener(self, timeout=MENSAJES_DRENADO_SEGUNDOS):
+        """
+        Deja de aceptar mensajes y espera a que los carriles terminen
+        lo pendiente, como máximo `timeout` segundos en total.
+        """
+        self._aceptando = False
+        limite = time.monotonic() + timeout
+        for cola in self._colas:
+            try:
+                cola.put(_FIN, timeout=max(0.01, limite - time.monotonic()))
+            except queue.Full:
+                logger.warning("Carril bloqueado: no se pudo solicitar su parada")
+        for hilo in self._hilos:
+            hilo.join(max(0, limite - time.monotonic()))
+        pendientes = sum(cola.qsize() for cola in self._colas)
+        if pendientes:
+            logger.warning(f"Procesador detenido con {pendientes} mensajes sin procesar")
+        else:
+            logger.info("Procesador de mensajes drenado y detenido")
+        self._hilos = []
+
+    def metricas(self):
+        """Mensajes pendientes por carril y contadores globales."""
+        with self._lock:
+            datos = dict(self._contadores)
+        datos["carriles"] = self.num_carriles
+        datos["pendientes"] = [cola.qsize() for cola in self._colas]
+        datos["pendientes_total"] = sum(datos["pendientes"])
+        return datos
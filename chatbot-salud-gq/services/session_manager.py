@@ -2,42 +2,113 @@
 Gestor de sesiones de usuario.
 Mantiene el estado de la conversación y las preferencias de idioma.
 Persiste perfiles de usuario en la base de datos para sobrevivir reinicios.
+
+Las sesiones son objetos compactos (`__slots__`) y su caducidad se lleva en
+una rueda de tiempo: cada sesión está en la ranura del minuto de su último
+mensaje, y un hilo de limpieza descarta ranuras completas cuando vencen.
+Tocar una sesión es O(1) y la limpieza no recorre las sesiones activas.
 """
 
-import time
 import logging
-from config.settings import SESSION_TIMEOUT_MINUTES
+import sys
+import threading
+import time
+
+from config.settings import SESSION_TIMEOUT_MINUTES, SESIONES_GRANULARIDAD_SEGUNDOS
 
 logger = logging.getLogger(__name__)
 
 
+class Sesion:
+    """Estado de la conversación de un usuario."""
+
+    __slots__ = (
+        "idioma",
+        "estado",
+        "contexto",
+        "ultimo_mensaje",
+        "mensajes_count",
+        "primera_vez",
+        "_ranura",
+    )
+
+    def __init__(self, idioma="es", mensajes_count=0, primera_vez=True, ahora=None):
+        self.idioma = idioma
+        self.estado = "inicio"
+        self.contexto = None  # dict creado solo si hace falta
+        self.ultimo_mensaje = ahora or time.time()
+        self.mensajes_count = mensajes_count
+        self.primera_vez = primera_vez
+        self._ranura = None
+
+
 class SessionManager:
     """Gestiona las sesiones de conversación de cada usuario."""
 
-    def __init__(self, memory=None):
+    def __init__(self, memory=None, granularidad=SESIONES_GRANULARIDAD_SEGUNDOS):
         self.sessions = {}
         self.memory = memory
+        self.timeout = SESSION_TIMEOUT_MINUTES * 60
+        self.granularidad = granularidad
+        # Las sesiones se eliminan tras dos periodos de inactividad
+        self._ranuras_vida = int(self.timeout * 2 // granularidad) + 1
+        self._rueda = {}  # ranura -> set(user_id)
+        self._ultima_barrida = self._ranura(time.time()) - 1
+        self._lock = threading.Lock()
+        self._detener = threading.Event()
+        self._hilo = None
+        self._eliminadas = 0
+
+    def _ranura(self, instante):
+        return int(instante // self.granularidad)
+
+    # ==================== Ciclo de vida ====================
+
+    def iniciar(self):
+        """Arranca el hilo que limpia las sesiones expiradas."""
+        if self._hilo and self._hilo.is_alive():
+            return
+        self._detener.clear()
+        self._hilo = threading.Thread(
+            target=self._bucle_limpieza, name="limpieza-sesiones", daemon=True
+        )
+        self._hilo.start()
+
+    def detener(self, timeout=5):
+        """Detiene el hilo de limpieza."""
+        self._detener.set()
+        if self._hilo:
+            self._hilo.join(timeout)
+            self._hilo = None
+
+    def _bucle_limpieza(self):
+        while not self._detener.wait(self.granularidad):
+            try:
+                self.limpiar_sesiones_expiradas()
+            except Exception as e:
+                logger.error(f"Error limpiando sesiones: {e}")
+
+    # ==================== Sesiones ====================
 
     def obtener_sesion(self, user_id):
         """Obtiene o crea una sesión para el usuario."""
         ahora = time.time()
+        sesion = self.sessions.get(user_id)
 
-        if user_id in self.sessions:
-            sesion = self.sessions[user_id]
-            tiempo_inactivo = (ahora - sesion["ultimo_mensaje"]) / 60
-
-            if tiempo_inactivo > SESSION_TIMEOUT_MINUTES:
-                logger.info(f"Sesión expirada para {user_id}")
-                self._crear_sesion(user_id)
-            else:
-                sesion["ultimo_mensaje"] = ahora
+        if sesion is None:
+            sesion = self._crear_sesion(user_id, ahora)
+        elif ahora - sesion.ultimo_mensaje > self.timeout:
+            logger.info(f"Sesión expirada para {user_id}")
+            sesion = self._crear_sesion(user_id, ahora)
         else:
-            self._crear_sesion(user_id)
+            sesion.ultimo_mensaje = ahora
+            self._mover(user_id, sesion, ahora)
 
-        return self.sessions[user_id]
+        return sesion
 
-    def _crear_sesion(self, user_id):
+    def _crear_sesion(self, user_id, ahora=None):
         """Crea una nueva sesión, cargando perfil persistente si existe."""
+        ahora = ahora or time.time()
         idioma = "es"
         primera_vez = user_id not in self.sessions
         mensajes_count = 0
@@ -52,19 +123,43 @@ class SessionManager:
                 if mensajes_count > 0:
                     primera_vez = False
 
-        self.sessions[user_id] = {
-            "idioma": idioma,
-            "estado": "inicio",
-            "contexto": {},
-            "ultimo_mensaje": time.time(),
-            "mensajes_count": mensajes_count,
-            "primera_vez": primera_vez,
-        }
-
-    def actualizar_idioma(self, user_id, idioma):
-        """Cambia el idioma preferido del usuario y persiste en BD."""
-        sesion = self.obtener_sesion(user_id)
-        sesion["idioma"] = idioma
+        sesion = Sesion(idioma, mensajes_count, primera_vez, ahora)
+        with self._lock:
+            anterior = self.sessions.get(user_id)
+            if anterior is not None:
+                self._quitar_de_rueda(user_id, anterior)
+            self.sessions[user_id] = sesion
+        self._mover(user_id, sesion, ahora)
+        return sesion
+
+    def _mover(self, user_id, sesion, ahora):
+        """Coloca la sesión en la ranura de su último mensaje."""
+        ranura = self._ranura(ahora)
+        if sesion._ranura == ranura:
+            return
+        with self._lock:
+            self._quitar_de_rueda(user_id, sesion)
+            # Si la limpieza la eliminó justo ahora, vuelve a estar activa
+            self.sessions.setdefault(user_id, sesion)
+            self._rueda.setdefault(ranura, set()).add(user_id)
+            sesion._ranura = ranura
+
+    def _quitar_de_rueda(self, user_id, sesion):
+        """Quita la sesión de su ranura actual (con el lock tomado)."""
+        usuarios = self._rueda.get(sesion._ranura)
+        if usuarios is not None:
+            usuarios.discard(user_id)
+            if not usuarios:
+                del self._rueda[sesion._ranura]
+        sesion._ranura = None
+
+    def actualizar_idioma(self, user_id, idioma, sesion=None):
+        """
+        Cambia el idioma preferido del usuario y persiste en BD. Quien ya
+        tiene la sesión del mensaje la pasa para no volver a buscarla.
+        """
+        sesion = sesion or self.obtener_sesion(user_id)
+        sesion.idioma = idioma
         logger.info(f"Idioma cambiado a {idioma} para {user_id}")
 
         # Persistir en BD
@@ -74,40 +169,63 @@ class SessionManager:
     def actualizar_estado(self, user_id, estado, contexto=None):
         """Actualiza el estado de la conversación."""
         sesion = self.obtener_sesion(user_id)
-        sesion["estado"] = estado
+        sesion.estado = estado
         if contexto:
-            sesion["contexto"].update(contexto)
+            if sesion.contexto is None:
+                sesion.contexto = {}
+            sesion.contexto.update(contexto)
 
     def incrementar_mensajes(self, user_id):
         """Incrementa el contador de mensajes."""
         sesion = self.obtener_sesion(user_id)
-        sesion["mensajes_count"] += 1
+        sesion.mensajes_count += 1
 
     def obtener_idioma(self, user_id):
         """Obtiene el idioma preferido del usuario."""
-        sesion = self.obtener_sesion(user_id)
-        return sesion["idioma"]
+        return self.obtener_sesion(user_id).idioma
 
     def es_primera_vez(self, user_id):
         """Verifica si es la primera interacción del usuario."""
-        sesion = self.obtener_sesion(user_id)
-        return sesion["primera_vez"]
+        return self.obtener_sesion(user_id).primera_vez
 
     def marcar_bienvenida_enviada(self, user_id):
         """Marca que ya se envió el mensaje de bienvenida."""
-        sesion = self.obtener_sesion(user_id)
-        sesion["primera_vez"] = False
+        self.obtener_sesion(user_id).primera_vez = False
 
     def limpiar_sesiones_expiradas(self):
-        """Elimina sesiones que han expirado."""
-        ahora = time.time()
-        expiradas = []
-
-        for user_id, sesion in self.sessions.items():
-            tiempo_inactivo = (ahora - sesion["ultimo_mensaje"]) / 60
-            if tiempo_inactivo > SESSION_TIMEOUT_MINUTES * 2:
-                expiradas.append(user_id)
-
-        for user_id in expiradas:
-            del self.sessions[user_id]
-            logger.info(f"Sesión limpiada para {user_id}")
+        """Elimina las sesiones de las ranuras que ya vencieron."""
+        limite = self._ranura(time.time()) - self._ranuras_vida
+        eliminadas = 0
+        with self._lock:
+            for ranura in range(self._ultima_barrida + 1, limite + 1):
+                for user_id in self._rueda.pop(ranura, ()):
+                    if self.sessions.pop(user_id, None) is not None:
+                        eliminadas += 1
+            self._ultima_barrida = max(self._ultima_barrida, limite)
+            self._eliminadas += eliminadas
+        if eliminadas:
+            logger.info(f"{eliminadas} sesiones expiradas eliminadas")
+        return eliminadas
+
+    # ==================== Métricas ====================
+
+    def metricas(self):
+        """Sesiones activas y memoria aproximada que ocupan."""
+        with self._lock:
+            activas = len(self.sessions)
+            ranuras = len(self._rueda)
+            memoria = sys.getsizeof(self.sessions) + sum(
+                sys.getsizeof(usuarios) for usuarios in self._rueda.values()
+            )
+            muestra = next(iter(self.sessions.items()), None)
+            eliminadas = self._eliminadas
+        if muestra:
+            user_id, sesion = muestra
+            # Objeto sesión + clave (el teléfono) por cada sesión activa
+            memoria += activas * (sys.getsizeof(sesion) + sys.getsizeof(user_id))
+        return {
+            "sesiones_activas": activas,
+            "ranuras_ocupadas": ranuras,
+            "sesiones_eliminadas": eliminadas,
+            "memoria_estimada_bytes": memoria,
+        }
@@ -0,0 +1,172 @@
+"""
+Transporte HTTP compartido para la API de WhatsApp.
+Reutiliza conexiones (keep-alive), reintenta con espera exponencial ante
+429/5xx y limita el ritmo de envío con un cubo de fichas (token bucket)
+para respetar la cuota del proveedor. Incluye una variante asíncrona
+opcional si `httpx` está instalado.
+"""
+
+import asyncio
+import logging
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from config.settings import (
+    WHATSAPP_BACKOFF_SEGUNDOS,
+    WHATSAPP_MENSAJES_POR_SEGUNDO,
+    WHATSAPP_POOL_CONEXIONES,
+    WHATSAPP_RAFAGA,
+    WHATSAPP_REINTENTOS,
+    WHATSAPP_TIMEOUT_CONEXION,
+    WHATSAPP_TIMEOUT_LECTURA,
+)
+
+try:
+    import httpx
+except ImportError:  # Dependencia opcional, solo para la variante asíncrona
+    httpx = None
+
+logger = logging.getLogger(__name__)
+
+# Respuestas del proveedor que merecen reintento
+ESTADOS_REINTENTABLES = (429, 500, 502, 503, 504)
+
+
+class LimitadorTokens:
+    """
+    Cubo de fichas: admite ráfagas de hasta `capacidad` envíos y después
+    un ritmo sostenido de `tasa` envíos por segundo.
+    """
+
+    def __init__(self, tasa, capacidad=None):
+        self.tasa = float(tasa)
+        self.capacidad = float(capacidad or tasa)
+        self._fichas = self.capacidad
+        self._ultimo = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reservar(self, fichas=1):
+        """
+        Reserva fichas y devuelve cuántos segundos hay que esperar antes
+        de usarlas (0 si hay fichas disponibles). Las reservas se encadenan,
+        así varios hilos respetan el ritmo sin competir entre sí.
+        """
+        if self.tasa <= 0:
+            return 0.0
+        with self._lock:
+            ahora = time.monotonic()
+            self._fichas = min(self.capacidad, self._fichas + (ahora - self._ultimo) * self.tasa)
+            self._ultimo = ahora
+            self._fichas -= fichas
+            if self._fichas >= 0:
+                return 0.0
+            return -self._fichas / self.tasa
+
+    def adquirir(self, fichas=1):
+        """Bloquea el hilo hasta poder enviar."""
+        espera = self.reservar(fichas)
+        if espera > 0:
+            time.sleep(espera)
+
+    async def adquirir_async(self, fichas=1):
+        """Equivalente asíncrono de adquirir()."""
+        espera = self.reservar(fichas)
+        if espera > 0:
+            await asyncio.sleep(espera)
+
+
+class TransporteHTTP:
+    """Sesión HTTP con pool de conexiones, reintentos y limitador de ritmo."""
+
+    def __init__(
+        self,
+        headers=None,
+        limitador=None,
+        pool=WHATSAPP_POOL_CONEXIONES,
+        reintentos=WHATSAPP_REINTENTOS,
+        backoff=WHATSAPP_BACKOFF_SEGUNDOS,
+        timeout=(WHATSAPP_TIMEOUT_CONEXION, WHATSAPP_TIMEOUT_LECTURA),
+    ):
+        self.timeout = timeout
+        self.limitador = limitador or LimitadorTokens(WHATSAPP_MENSAJES_POR_SEGUNDO, WHATSAPP_RAFAGA)
+        politica = Retry(
+            total=reintentos,
+            connect=reintentos,
+            read=0,  # Un timeout de lectura puede significar que ya se envió
+            status=reintentos,
+            backoff_factor=backoff,
+            status_forcelist=ESTADOS_REINTENTABLES,
+            allowed_methods=frozenset({"POST"}),
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        adaptador = HTTPAdapter(pool_connections=pool, pool_maxsize=pool, max_retries=politica)
+        self.session = requests.Session()
+        self.session.mount("https://", adaptador)
+        self.session.mount("http://", adaptador)
+        if headers:
+            self.session.headers.update(headers)
+
+    def post(self, url, payload, timeout=None):
+        """Envía un POST JSON respetando el ritmo permitido."""
+        self.limitador.adquirir()
+        return self.session.post(url, json=payload, timeout=timeout or self.timeout)
+
+    def cerrar(self):
+        """Cierra las conexiones del pool."""
+        self.session.close()
+
+
+class TransporteHTTPAsync:
+    """
+    Variante asíncrona (requiere `httpx`). Comparte la política del
+    transporte síncrono: pool keep-alive, reintentos 429/5xx y limitador.
+    """
+
+    def __init__(
+        self,
+        headers=None,
+        limitador=None,
+        pool=WHATSAPP_POOL_CONEXIONES,
+        reintentos=WHATSAPP_REINTENTOS,
+        backoff=WHATSAPP_BACKOFF_SEGUNDOS,
+        timeout=(WHATSAPP_TIMEOUT_CONEXION, WHATSAPP_TIMEOUT_LECTURA),
+    ):
+        if httpx is None:
+            raise RuntimeError("El transporte asíncrono requiere instalar 'httpx'")
+        self.reintentos = reintentos
+        self.backoff = backoff
+        self.limitador = limitador or LimitadorTokens(WHATSAPP_MENSAJES_POR_SEGUNDO, WHATSAPP_RAFAGA)
+        self.client = httpx.AsyncClient(
+            headers=headers,
+            timeout=httpx.Timeout(timeout[1], connect=timeout[0]),
+            limits=httpx.Limits(max_connections=pool, max_keepalive_connections=pool),
+        )
+
+    async def post(self, url, payload):
+        """POST JSON con reintentos exponenciales ante 429/5xx y errores de conexión."""
+        for intento in range(self.reintentos + 1):
+            await self.limitador.adquirir_async()
+            try:
+                response = await self.client.post(url, json=payload)
+            except httpx.ConnectError:
+                if intento == self.reintentos:
+                    raise
+            else:
+                if response.status_code not in ESTADOS_REINTENTABLES or intento == self.reintentos:
+                    return response
+                retry_after = response.headers.get("Retry-After")
+                if retry_after and retry_after.isdigit():
+                    await asyncio.sleep(int(retry_after))
+                    continue
+            # Espera exponencial con algo de aleatoriedad
+            await asyncio.sleep(self.backoff * (2 ** intento) * (0.5 + random.random() / 2))
+
+    async def cerrar(self):
+        """Cierra el cliente y sus conexiones."""
+        await self.client.aclose()
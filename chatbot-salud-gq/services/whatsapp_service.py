@@ -4,6 +4,8 @@ Maneja el envío y recepción de mensajes de WhatsApp.
 """
 
 import logging
+import time
+
 import requests
 
 from config.settings import (
@@ -11,27 +13,52 @@ from config.settings import (
     WHATSAPP_PHONE_NUMBER_ID,
     WHATSAPP_API_URL,
 )
+from services.metricas import ERRORES_WHATSAPP, LATENCIA_WHATSAPP
+from services.transporte_http import TransporteHTTP
 
 logger = logging.getLogger(__name__)
 
+# WhatsApp admite 4096 caracteres por mensaje; se deja margen para "(1/n)"
+LIMITE_CARACTERES = 4000
+
 
 class WhatsAppService:
     """Servicio para enviar y recibir mensajes de WhatsApp."""
 
-    def __init__(self):
-        self.api_url = f"{WHATSAPP_API_URL}/{WHATSAPP_PHONE_NUMBER_ID}/messages"
+    def __init__(self, transporte=None, api_url=None):
+        self.api_url = api_url or f"{WHATSAPP_API_URL}/{WHATSAPP_PHONE_NUMBER_ID}/messages"
         self.headers = {
             "Authorization": f"Bearer {WHATSAPP_TOKEN}",
             "Content-Type": "application/json",
         }
+        # Transporte compartido: pool keep-alive, reintentos y limitador
+        self.transporte = transporte or TransporteHTTP(headers=self.headers)
 
-    def enviar_mensaje(self, telefono, mensaje):
-        """Envía un mensaje de texto a un número de WhatsApp."""
-        # WhatsApp tiene límite de 4096 caracteres por mensaje
-        if len(mensaje) > 4000:
-            return self._enviar_mensaje_largo(telefono, mensaje)
+    def _enviar(self, payload, timeout=None):
+        """Envía un payload a la API y lanza excepción si la respuesta es un error."""
+        inicio = time.perf_counter()
+        try:
+            response = self.transporte.post(self.api_url, payload, timeout=timeout)
+            response.raise_for_status()
+        except Exception:
+            ERRORES_WHATSAPP.incrementar()
+            raise
+        finally:
+            LATENCIA_WHATSAPP.observar(time.perf_counter() - inicio)
+        return response
 
-        payload = {
+    def cerrar(self):
+        """Libera las conexiones del transporte."""
+        self.transporte.cerrar()
+
+    def enviar_payload(self, payload):
+        """Envía un payload ya construido; lanza excepción si la API lo rechaza."""
+        return self._enviar(payload)
+
+    @staticmethod
+    def payload_texto(telefono, mensaje):
+        """Payload de un mensaje de texto."""
+        return {
             "messaging_product": "whatsapp",
             "recipient_type": "individual",
             "to": telefono,
@@ -39,39 +66,68 @@ class WhatsAppService:
             "text": {"preview_url": False, "body": mensaje},
         }
 
-        try:
-            response = requests.post(
-                self.api_url,
-                headers=self.headers,
-                json=payload,
-                timeout=30,
-            )
-            response.raise_for_status()
-            logger.info(f"Mensaje enviado a {telefono}")
-            return True
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Error enviando mensaje a {telefono}: {e}")
-            return False
+    @staticmethod
+    def payload_ubicacion(telefono, latitud, longitud, nombre, direccion):
+        """Payload de una ubicación (para centros de salud)."""
+        return {
+            "messaging_product": "whatsapp",
+            "recipient_type": "individual",
+            "to": telefono,
+            "type": "location",
+            "location": {
+                "latitude": latitud,
+                "longitude": longitud,
+                "name": nombre,
+                "address": direccion,
+            },
+        }
 
-    def _enviar_mensaje_largo(self, telefono, mensaje):
-        """Divide y envía mensajes que exceden el límite de caracteres."""
+    @staticmethod
+    def dividir_mensaje(mensaje, limite=LIMITE_CARACTERES):
+        """
+        Parte un mensaje largo por saltos de línea en trozos de como mucho
+        `limite` caracteres, numerados "(1/n)" si hay más de uno.
+        """
         partes = []
         while len(mensaje) > 0:
-            if len(mensaje) <= 4000:
+            if len(mensaje) <= limite:
                 partes.append(mensaje)
                 break
-            corte = mensaje[:4000].rfind("\n")
+            corte = mensaje[:limite].rfind("\n")
             if corte == -1:
-                corte = 4000
+                corte = limite
             partes.append(mensaje[:corte])
             mensaje = mensaje[corte:].lstrip()
 
+        if len(partes) > 1:
+            partes = [f"({i + 1}/{len(partes)})\n\n{parte}" for i, parte in enumerate(partes)]
+        return partes
+
+    def enviar_mensaje(self, telefono, mensaje):
+        """Envía un mensaje de texto a un número de WhatsApp."""
+        if len(mensaje) > LIMITE_CARACTERES:
+            return self._enviar_mensaje_largo(telefono, mensaje)
+
+        try:
+            self._enviar(self.payload_texto(telefono, mensaje))
+            logger.info(f"Mensaje enviado a {telefono}")
+            return True
+        except requests.exceptions.RequestException as e:
+            logger.error(f"Error enviando mensaje a {telefono}: {e}")
+            return False
+
+    def _enviar_mensaje_largo(self, telefono, mensaje):
+        """Divide y envía mensajes que exceden el límite de caracteres."""
         exito = True
-        for i, parte in enumerate(partes):
-            if len(partes) > 1:
-                parte = f"({i + 1}/{len(partes)})\n\n{parte}"
-            if not self.enviar_mensaje(telefono, parte):
+        for parte in self.dividir_mensaje(mensaje):
+            # Directo a _enviar: con el prefijo "(i/n)" la parte puede pasar del límite
+            try:
+                self._enviar(self.payload_texto(telefono, parte))
+            except requests.exceptions.RequestException as e:
+                logger.error(f"Error enviando parte de mensaje a {telefono}: {e}")
                 exito = False
+        if exito:
+            logger.info(f"Mensaje largo enviado a {telefono}")
         return exito
 
     def enviar_menu_interactivo(self, telefono, titulo, cuerpo, botones):
@@ -102,13 +158,7 @@ class WhatsAppService:
             }
 
         try:
-            response = requests.post(
-                self.api_url,
-                headers=self.headers,
-                json=payload,
-                timeout=30,
-            )
-            response.raise_for_status()
+            self._enviar(payload)
             logger.info(f"Menú interactivo enviado a {telefono}")
             return True
         except requests.exceptions.RequestException as e:
@@ -139,13 +189,7 @@ class WhatsAppService:
             }
 
         try:
-            response = requests.post(
-                self.api_url,
-                headers=self.headers,
-                json=payload,
-                timeout=30,
-            )
-            response.raise_for_status()
+            self._enviar(payload)
             logger.info(f"Lista interactiva enviada a {telefono}")
             return True
         except requests.exceptions.RequestException as e:
@@ -154,27 +198,8 @@ class WhatsAppService:
 
     def enviar_ubicacion(self, telefono, latitud, longitud, nombre, direccion):
         """Envía una ubicación (para centros de salud)."""
-        payload = {
-            "messaging_product": "whatsapp",
-            "recipient_type": "individual",
-            "to": telefono,
-            "type": "location",
-            "location": {
-                "latitude": latitud,
-                "longitude": longitud,
-                "name": nombre,
-                "address": direccion,
-            },
-        }
-
         try:
-            response = requests.post(
-                self.api_url,
-                headers=self.headers,
-                json=payload,
-                timeout=30,
-            )
-            response.raise_for_status()
+            self._enviar(self.payload_ubicacion(telefono, latitud, longitud, nombre, direccion))
             return True
         except requests.exceptions.RequestException as e:
             logger.error(f"Error enviando ubicación a {telefono}: {e}")
@@ -189,16 +214,23 @@ class WhatsAppService:
         }
 
         try:
-            response = requests.post(
-                self.api_url,
-                headers=self.headers,
-                json=payload,
-                timeout=10,
-            )
-            response.raise_for_status()
+            self._enviar(payload, timeout=10)
         except requests.exceptions.RequestException:
             pass  # No es crítico si falla
 
+    @staticmethod
+    def parsear_ubicacion(texto):
+        """Convierte 'ubicacion:lat,lng' en (latitud, longitud), o None si no es válida."""
+        if not texto.startswith("ubicacion:"):
+            return None
+        try:
+            latitud, longitud = (float(v) for v in texto[len("ubicacion:"):].split(","))
+        except ValueError:
+            return None
+        if not (-90 <= latitud <= 90 and -180 <= longitud <= 180):
+            return None
+        return latitud, longitud
+
     @staticmethod
     def extraer_mensaje(data):
         """Extrae el mensaje del webhook de WhatsApp."""
@@ -0,0 +1,129 @@
+"""
+Pruebas del gestor de conexiones SQLite (services/database.py).
+
+Uso:
+    python -m pytest tests
+    python -m unittest discover tests
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.database import GestorConexiones  # noqa: E402
+
+HILOS = 200
+
+
+def _descriptores():
+    """Descriptores abiertos del proceso (None fuera de Linux)."""
+    try:
+        return len(os.listdir("/proc/self/fd"))
+    except OSError:
+        return None
+
+
+class TestGestorConexiones(unittest.TestCase):
+    def setUp(self):
+        self.directorio = tempfile.mkdtemp()
+        self.db = GestorConexiones(os.path.join(self.directorio, "prueba.db"))
+        with self.db.transaccion() as conn:
+            conn.execute("CREATE TABLE t (x INTEGER)")
+
+    def tearDown(self):
+        self.db.cerrar()
+        shutil.rmtree(self.directorio, ignore_errors=True)
+
+    def _en_hilo(self, funcion):
+        hilo = threading.Thread(target=funcion)
+        hilo.start()
+        hilo.join()
+
+    def test_hilos_terminados_cierran_su_conexion(self):
+        """Un hilo por petición (como werkzeug) no acumula conexiones ni descriptores."""
+        antes = _descriptores()
+
+        def escribir():
+            with self.db.transaccion() as conn:
+                conn.execute("INSERT INTO t VALUES (1)")
+
+        for _ in range(HILOS):
+            self._en_hilo(escribir)
+
+        # Solo queda la del hilo principal
+        self.assertEqual(self.db.abiertas(), 1)
+        if antes is not None:
+            self.assertLess(_descriptores() - antes, 10)
+        total = self.db.conexion().execute("SELECT COUNT(*) FROM t").fetchone()[0]
+        self.assertEqual(total, HILOS)
+
+    def test_hilos_concurrentes_acotados(self):
+        """Con muchos hilos vivos a la vez hay una conexión por hilo, y se liberan al terminar."""
+        barrera = threading.Barrier(20)
+
+        def leer():
+            self.db.conexion().execute("SELECT COUNT(*) FROM t").fetchone()
+            barrera.wait()
+
+        hilos = [threading.Thread(target=leer) for _ in range(20)]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        self.assertEqual(self.db.abiertas(), 1)
+
+    def test_transaccion_anidada_en_hilo(self):
+        """La reentrancia se mantiene por hilo y el commit es único."""
+        def anidar():
+            with self.db.transaccion() as conn:
+                conn.execute("INSERT INTO t VALUES (2)")
+                with self.db.transaccion() as interna:
+                    self.assertIs(interna, conn)
+                    interna.execute("INSERT INTO t VALUES (3)")
+                self.assertTrue(conn.in_transaction)
+
+        self._en_hilo(anidar)
+        total = self.db.conexion().execute("SELECT COUNT(*) FROM t").fetchone()[0]
+        self.assertEqual(total, 2)
+
+    def test_anidada_fallida_se_deshace_sola(self):
+        """Una operación anidada que falla no deja escrituras a medias en el commit exterior."""
+        with self.db.transaccion() as conn:
+            conn.execute("INSERT INTO t VALUES (1)")
+            try:
+                with self.db.transaccion() as interna:
+                    interna.execute("INSERT INTO t VALUES (2)")
+                    raise RuntimeError("fallo a mitad de la operación")
+            except RuntimeError:
+                pass
+            with self.db.transaccion() as interna:
+                interna.execute("INSERT INTO t VALUES (3)")
+        valores = [fila[0] for fila in self.db.conexion().execute("SELECT x FROM t ORDER BY x")]
+        self.assertEqual(valores, [1, 3])
+
+    def test_cerrar_cierra_las_de_hilos_vivos(self):
+        listo, salir = threading.Event(), threading.Event()
+
+        def esperar():
+            self.db.conexion()
+            listo.set()
+            salir.wait()
+
+        hilo = threading.Thread(target=esperar)
+        hilo.start()
+        listo.wait()
+        self.assertEqual(self.db.abiertas(), 2)
+        self.db.cerrar()
+        self.assertEqual(self.db.abiertas(), 0)
+        salir.set()
+        hilo.join()
+        self.assertEqual(self.db.abiertas(), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,132 @@
+"""
+Detección de palabras clave con un autómata Aho-Corasick.
+Todas las listas de palabras clave (categorías, emergencias, temas de la
+Constitución, OHADA, historia...) se registran en un único autómata que
+recorre el mensaje una sola vez y devuelve todas las claves encontradas.
+
+La semántica es la misma que `any(kw in texto for kw in keywords)`:
+una palabra clave coincide si aparece como subcadena del texto.
+"""
+
+import threading
+from collections import deque
+from functools import lru_cache
+
+
+class AhoCorasick:
+    """Autómata multi-patrón: cada patrón lleva asociadas una o más etiquetas."""
+
+    def __init__(self):
+        self._patrones = {}
+        self._compilado = None
+
+    def agregar(self, patron, etiqueta):
+        """Añade un patrón (se compara en minúsculas) con su etiqueta."""
+        patron = patron.lower()
+        if not patron:
+            return
+        self._patrones.setdefault(patron, set()).add(etiqueta)
+        self._compilado = None
+
+    def compilar(self):
+        """Construye las transiciones, enlaces de fallo y salidas."""
+        transiciones = [{}]
+        salidas = [set()]
+        for patron, etiquetas in self._patrones.items():
+            estado = 0
+            for caracter in patron:
+                siguiente = transiciones[estado].get(caracter)
+                if siguiente is None:
+                    siguiente = len(transiciones)
+                    transiciones[estado][caracter] = siguiente
+                    transiciones.append({})
+                    salidas.append(set())
+                estado = siguiente
+            salidas[estado] |= etiquetas
+
+        # Recorrido en anchura: cada estado hereda las salidas de su fallo
+        fallos = [0] * len(transiciones)
+        cola = deque(transiciones[0].values())
+        while cola:
+            estado = cola.popleft()
+            for caracter, siguiente in transiciones[estado].items():
+                cola.append(siguiente)
+                fallo = fallos[estado]
+                while fallo and caracter not in transiciones[fallo]:
+                    fallo = fallos[fallo]
+                destino = transiciones[fallo].get(caracter, 0)
+                fallos[siguiente] = destino if destino != siguiente else 0
+                salidas[siguiente] |= salidas[fallos[siguiente]]
+
+        self._compilado = (
+            transiciones,
+            fallos,
+            [frozenset(s) if s else None for s in salidas],
+        )
+        return self
+
+    def buscar(self, texto):
+        """Devuelve el conjunto de etiquetas cuyos patrones aparecen en el texto."""
+        if self._compilado is None:
+            self.compilar()
+        transiciones, fallos, salidas = self._compilado
+        encontradas = set()
+        estado = 0
+        for caracter in texto.lower():
+            while estado and caracter not in transiciones[estado]:
+                estado = fallos[estado]
+            estado = transiciones[estado].get(caracter, 0)
+            if salidas[estado]:
+                encontradas |= salidas[estado]
+        return encontradas
+
+    def __len__(self):
+        return len(self._patrones)
+
+
+# ==================== Registro compartido ====================
+
+_automata = AhoCorasick()
+_orden = {}  # grupo -> claves en orden de registro
+_lock = threading.Lock()
+
+
+def registrar_palabras_clave(grupo, mapa):
+    """
+    Registra un diccionario {clave: [palabras]} bajo un grupo.
+    Los módulos de conocimiento lo llaman al importarse.
+    """
+    with _lock:
+        claves = _orden.setdefault(grupo, [])
+        for clave, palabras in mapa.items():
+            if clave not in claves:
+                claves.append(clave)
+            for palabra in palabras:
+                _automata.agregar(palabra, (grupo, clave))
+        _automata.compilar()
+        _detectar.cache_clear()
+
+
+@lru_cache(maxsize=512)
+def _detectar(texto):
+    encontradas = {}
+    for grupo, clave in _automata.buscar(texto):
+        encontradas.setdefault(grupo, set()).add(clave)
+    return {grupo: frozenset(claves) for grupo, claves in encontradas.items()}
+
+
+def detectar(texto):
+    """
+    Una sola pasada sobre el texto: {grupo: frozenset(claves)} con todo
+    lo que coincide. El resultado se cachea para que varias búsquedas
+    sobre el mismo mensaje no repitan el recorrido.
+    """
+    return _detectar(texto.lower())
+
+
+def detectar_grupo(texto, grupo):
+    """Claves de un grupo presentes en el texto, en orden de registro."""
+    encontradas = detectar(texto).get(grupo)
+    if not encontradas:
+        return []
+    return [clave for clave in _orden[grupo] if clave in encontradas]
@@ -0,0 +1,92 @@
+"""
+Árbol k-d para encontrar los puntos (latitud, longitud) más cercanos.
+
+Los puntos se proyectan sobre la esfera unidad en coordenadas cartesianas:
+la distancia euclídea (la cuerda) crece igual que la distancia sobre la
+superficie, así que el árbol puede podar ramas con una simple diferencia
+por eje y la distancia real solo se calcula (haversine) para el resultado.
+Cada consulta visita O(log n) nodos en promedio.
+"""
+
+import heapq
+import math
+
+RADIO_TIERRA_KM = 6371.0088
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    """Distancia en kilómetros sobre la superficie terrestre."""
+    fi1, fi2 = math.radians(lat1), math.radians(lat2)
+    dfi = fi2 - fi1
+    dlambda = math.radians(lng2 - lng1)
+    a = math.sin(dfi / 2) ** 2 + math.cos(fi1) * math.cos(fi2) * math.sin(dlambda / 2) ** 2
+    return 2 * RADIO_TIERRA_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def _cartesianas(latitud, longitud):
+    fi, lam = math.radians(latitud), math.radians(longitud)
+    return (math.cos(fi) * math.cos(lam), math.cos(fi) * math.sin(lam), math.sin(fi))
+
+
+class ArbolKD:
+    """Árbol k-d estático sobre puntos (latitud, longitud, valor)."""
+
+    def __init__(self, puntos):
+        nodos = [(_cartesianas(lat, lng), (lat, lng), valor) for lat, lng, valor in puntos]
+        self._raiz = self._construir(nodos, 0)
+        self._tamano = len(nodos)
+
+    def _construir(self, nodos, profundidad):
+        if not nodos:
+            return None
+        eje = profundidad % 3
+        nodos.sort(key=lambda nodo: nodo[0][eje])
+        medio = len(nodos) // 2
+        xyz, coordenadas, valor = nodos[medio]
+        return (
+            xyz,
+            coordenadas,
+            valor,
+            eje,
+            self._construir(nodos[:medio], profundidad + 1),
+            self._construir(nodos[medio + 1:], profundidad + 1),
+        )
+
+    def __len__(self):
+        return self._tamano
+
+    def cercanos(self, latitud, longitud, k=3, filtro=None):
+        """
+        Los k valores más cercanos que cumplen `filtro(valor)`.
+        Retorna [(distancia_km, (latitud, longitud), valor)] de menor a mayor.
+        """
+        objetivo = _cartesianas(latitud, longitud)
+        mejores = []  # montículo de máximos: (-distancia², contador, nodo)
+        contador = 0
+        pendientes = [(self._raiz, 0.0)]  # (nodo, distancia² mínima a su región)
+        while pendientes:
+            nodo, cota = pendientes.pop()
+            if nodo is None or (len(mejores) == k and cota >= -mejores[0][0]):
+                continue
+            xyz, _, valor, eje, izquierda, derecha = nodo
+            if filtro is None or filtro(valor):
+                distancia2 = sum((a - b) ** 2 for a, b in zip(xyz, objetivo))
+                if len(mejores) < k:
+                    heapq.heappush(mejores, (-distancia2, contador, nodo))
+                elif distancia2 < -mejores[0][0]:
+                    heapq.heapreplace(mejores, (-distancia2, contador, nodo))
+                contador += 1
+
+            diferencia = objetivo[eje] - xyz[eje]
+            cercana, lejana = (izquierda, derecha) if diferencia < 0 else (derecha, izquierda)
+            # La rama lejana solo puede mejorar si el plano de corte está más
+            # cerca que el peor de los k actuales (se comprueba al sacarla)
+            pendientes.append((lejana, max(cota, diferencia ** 2)))
+            pendientes.append((cercana, cota))
+
+        resultado = []
+        for _, _, (_, coordenadas, valor, _, _, _) in mejores:
+            distancia = haversine_km(latitud, longitud, *coordenadas)
+            resultado.append((distancia, coordenadas, valor))
+        resultado.sort(key=lambda r: r[0])
+        return resultado
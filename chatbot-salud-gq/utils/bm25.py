@@ -0,0 +1,44 @@
+"""
+Puntuación BM25 para preguntas y patrones aprendidos.
+
+Los candidatos y sus estadísticas salen del índice invertido persistido en
+SQLite (palabra -> registros, documentos por palabra, total de documentos
+y de palabras); aquí solo se puntúan y se eligen los k mejores.
+
+Cada documento es un conjunto de palabras (las preguntas se tokenizan como
+conjuntos), así que la frecuencia de un término en el documento es 0 o 1 y
+la puntuación de un candidato es la suma de los idf de las palabras que
+comparte con la consulta, normalizada por su longitud.
+"""
+
+import numpy as np
+
+K1 = 1.2
+B = 0.75
+
+
+def idf(documentos, frecuencias):
+    """idf BM25 (siempre positivo) de cada palabra según en cuántos documentos aparece."""
+    frecuencias = np.asarray(frecuencias, dtype=np.float64)
+    return np.log1p((documentos - frecuencias + 0.5) / (frecuencias + 0.5))
+
+
+def puntuar(sumas_idf, longitudes, media_longitud, k1=K1, b=B):
+    """Puntuación BM25 de cada candidato a partir de la suma de idf de sus palabras comunes."""
+    sumas_idf = np.asarray(sumas_idf, dtype=np.float64)
+    longitudes = np.asarray(longitudes, dtype=np.float64)
+    normas = k1 * (1 - b + b * longitudes / max(media_longitud, 1e-9))
+    return sumas_idf * (k1 + 1) / (1 + normas)
+
+
+def mejores(puntuaciones, ids, k):
+    """
+    Posiciones de los k mejores, de mayor a menor puntuación y, a igualdad,
+    del id más antiguo. Selección parcial: el resto no se ordena.
+    """
+    puntuaciones = np.asarray(puntuaciones, dtype=np.float64)
+    ids = np.asarray(ids, dtype=np.int64)
+    posiciones = np.arange(len(puntuaciones))
+    if len(posiciones) > k:
+        posiciones = np.argpartition(-puntuaciones, k - 1)[:k]
+    return posiciones[np.lexsort((ids[posiciones], -puntuaciones[posiciones]))]
@@ -0,0 +1,68 @@
+"""
+Corte de un texto que llega por trozos (streaming) en fragmentos enviables.
+
+Un fragmento termina en una frontera natural: un párrafo ("\\n\\n") o el
+salto de línea que abre una viñeta ("- ", "* ", "• ", "1. "). Se corta en
+la última frontera disponible en cuanto el fragmento alcanza `minimo`
+caracteres, para no partir la respuesta en decenas de mensajes, y nunca se
+supera `limite` (el máximo de un mensaje de WhatsApp). Cada trozo nuevo
+solo se revisa desde donde terminó la revisión anterior.
+"""
+
+import re
+
+_FRONTERA = re.compile(r"\n[ \t]*\n|\n(?=[ \t]*(?:[-*•]|\d{1,2}[.)])[ \t])")
+# Caracteres que se vuelven a revisar: una frontera puede quedar a medias
+# entre dos trozos ("\n" al final de uno y "- " al principio del siguiente)
+_SOLAPE = 8
+
+
+class FragmentadorParrafos:
+    """Acumula texto y devuelve los fragmentos que ya están completos."""
+
+    def __init__(self, limite=4000, minimo=120):
+        self.limite = limite
+        self.minimo = min(minimo, limite)
+        self._buffer = ""
+        self._revisado = 0  # hasta dónde se buscaron fronteras
+        self._corte = None  # última frontera válida encontrada
+
+    def agregar(self, texto):
+        """Añade un trozo y devuelve la lista de fragmentos completos (puede estar vacía)."""
+        self._buffer += texto
+        fragmentos = []
+        while True:
+            corte = self._buscar_corte()
+            if corte is None:
+                return fragmentos
+            fragmento = self._buffer[:corte].strip()
+            self._buffer = self._buffer[corte:].lstrip()
+            self._revisado = 0
+            self._corte = None
+            if fragmento:
+                fragmentos.append(fragmento)
+
+    def _buscar_corte(self):
+        for frontera in _FRONTERA.finditer(self._buffer, max(0, self._revisado - _SOLAPE)):
+            if frontera.start() > self.limite:
+                break
+            if frontera.start() >= self.minimo:
+                self._corte = frontera.start()
+        self._revisado = len(self._buffer)
+        if self._corte is not None:
+            return self._corte
+        if len(self._buffer) > self.limite:
+            # Sin frontera a tiempo: se corta por línea o, si no hay, por palabra
+            corte = self._buffer.rfind("\n", 0, self.limite)
+            if corte <= 0:
+                corte = self._buffer.rfind(" ", 0, self.limite)
+            return corte if corte > 0 else self.limite
+        return None
+
+    def terminar(self):
+        """Devuelve lo que quede en el buffer (el último fragmento) y lo vacía."""
+        resto = self._buffer.strip()
+        self._buffer = ""
+        self._revisado = 0
+        self._corte = None
+        return resto
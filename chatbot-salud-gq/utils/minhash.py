@@ -0,0 +1,68 @@
+"""
+Firmas MinHash y cubos LSH para detectar preguntas casi duplicadas.
+Cada conjunto de palabras se resume en NUM_PERMUTACIONES valores mínimos;
+la firma se divide en BANDAS de FILAS_POR_BANDA valores y cada banda se
+convierte en una clave de cubo. Dos preguntas con Jaccard >= 0.54 (lo que
+implica el umbral 0.7 de similitud por palabras) comparten algún cubo con
+probabilidad >= 99 %, así que los candidatos salen de unas pocas búsquedas
+por clave y la similitud exacta solo se verifica sobre ellos.
+"""
+
+import random
+import struct
+import zlib
+
+NUM_PERMUTACIONES = 32
+BANDAS = 16
+FILAS_POR_BANDA = NUM_PERMUTACIONES // BANDAS
+
+_PRIMO = (1 << 61) - 1
+_MASCARA = 0xFFFFFFFF
+
+# Permutaciones fijas: las firmas guardadas deben seguir siendo válidas
+_rnd = random.Random(20240611)
+_COEFICIENTES = [
+    (_rnd.randrange(1, _PRIMO), _rnd.randrange(0, _PRIMO))
+    for _ in range(NUM_PERMUTACIONES)
+]
+_FORMATO = f"<{NUM_PERMUTACIONES}I"
+
+
+def firma(palabras):
+    """Firma MinHash (tupla de enteros de 32 bits) de un conjunto de palabras."""
+    if not palabras:
+        return None
+    hashes = [zlib.crc32(p.encode("utf-8")) for p in palabras]
+    return tuple(
+        min((a * h + b) % _PRIMO for h in hashes) & _MASCARA
+        for a, b in _COEFICIENTES
+    )
+
+
+def claves_lsh(firma_minhash, espacio=""):
+    """
+    Una clave entera por banda: índice de banda en los bits altos y hash de
+    la banda en los bajos. `espacio` (p. ej. el idioma) separa los cubos.
+    """
+    semilla = zlib.crc32(espacio.encode("utf-8"))
+    claves = []
+    for banda in range(BANDAS):
+        inicio = banda * FILAS_POR_BANDA
+        valores = firma_minhash[inicio:inicio + FILAS_POR_BANDA]
+        cubo = zlib.crc32(struct.pack(f"<{FILAS_POR_BANDA}I", *valores), semilla)
+        claves.append((banda << 32) | cubo)
+    return claves
+
+
+def serializar(firma_minhash):
+    """Firma como BLOB compacto (4 bytes por permutación)."""
+    return struct.pack(_FORMATO, *firma_minhash)
+
+
+def deserializar(blob):
+    return struct.unpack(_FORMATO, blob)
+
+
+def jaccard_estimado(firma_a, firma_b):
+    """Fracción de permutaciones coincidentes (estimación de Jaccard)."""
+    return sum(x == y for x, y in zip(firma_a, firma_b)) / NUM_PERMUTACIONES
@@ -0,0 +1,127 @@
+"""
+Presupuesto de tokens para el prompt de OpenAI.
+
+El prompt se describe como una lista de bloques (instrucciones, contexto
+local, conocimiento aprendido, turnos anteriores, pregunta...) con una
+relevancia cada uno. Si no caben todos en el presupuesto se conservan los
+obligatorios y después los más relevantes; el que no cabe entero se recorta
+por líneas (las primeras son las más importantes) o se descarta. Los
+bloques conservados mantienen su orden original.
+
+Con `tiktoken` instalado los tokens se cuentan con el vocabulario del
+modelo; si no, se aproximan (unos 4 caracteres por token, y nunca menos
+que las palabras y signos del texto).
+"""
+
+import math
+import re
+from collections import namedtuple
+from functools import lru_cache
+
+try:
+    import tiktoken
+except ImportError:  # Dependencia opcional: sin ella se usa la aproximación
+    tiktoken = None
+
+# Tokens que añade cada mensaje del chat (rol y separadores)
+TOKENS_POR_MENSAJE = 4
+# Por debajo de este hueco no merece la pena recortar un bloque
+MINIMO_RECORTE = 40
+
+_PIEZAS = re.compile(r"\w+|[^\w\s]")
+
+Bloque = namedtuple(
+    "Bloque",
+    ["tipo", "texto", "relevancia", "obligatorio", "recortable", "datos"],
+    defaults=(False, True, None),
+)
+
+
+@lru_cache(maxsize=8)
+def _codificador(modelo):
+    if tiktoken is None or not modelo:
+        return None
+    try:
+        return tiktoken.encoding_for_model(modelo)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+    except Exception:
+        return None  # p. ej. sin conexión para descargar el vocabulario
+
+
+def estimar_tokens(texto, modelo=None):
+    """Tokens de un texto (exactos con tiktoken, aproximados si no)."""
+    if not texto:
+        return 0
+    codificador = _codificador(modelo)
+    if codificador is not None:
+        return len(codificador.encode(texto))
+    return max(len(_PIEZAS.findall(texto)), math.ceil(len(texto) / 4))
+
+
+def estimar_mensajes(mensajes, modelo=None):
+    """Tokens de una lista de mensajes de chat, con el envoltorio de cada uno."""
+    return 3 + sum(
+        TOKENS_POR_MENSAJE + estimar_tokens(m.get("content") or "", modelo) for m in mensajes
+    )
+
+
+def recortar(texto, maximo, modelo=None):
+    """Primeras líneas del texto que caben en `maximo` tokens ("" si ninguna)."""
+    conservadas = []
+    usados = 0
+    for linea in texto.split("\n"):
+        coste = estimar_tokens(linea, modelo) + 1
+        if usados + coste > maximo:
+            if not conservadas and maximo > 0:
+                # Ni la primera línea cabe: se corta por palabras
+                palabras = []
+                for palabra in linea.split(" "):
+                    if estimar_tokens(" ".join(palabras + [palabra]), modelo) > maximo - 1:
+                        break
+                    palabras.append(palabra)
+                if palabras:
+                    conservadas.append(" ".join(palabras) + "…")
+            break
+        conservadas.append(linea)
+        usados += coste
+    return "\n".join(conservadas).strip()
+
+
+def ajustar(bloques, maximo, modelo=None):
+    """
+    Ajusta los bloques al presupuesto. Devuelve (bloques, informe): los
+    conservados en su orden original (con el texto recortado si hizo falta)
+    y un diccionario con los tokens usados y los tipos descartados y
+    recortados.
+    """
+    costes = [estimar_tokens(b.texto, modelo) + TOKENS_POR_MENSAJE for b in bloques]
+    orden = sorted(
+        range(len(bloques)),
+        key=lambda i: (not bloques[i].obligatorio, -bloques[i].relevancia),
+    )
+    restante = maximo
+    conservados = {}
+    descartados, recortados = [], []
+    for i in orden:
+        bloque = bloques[i]
+        if bloque.obligatorio or costes[i] <= restante:
+            conservados[i] = bloque
+            restante -= costes[i]
+        elif bloque.recortable and restante >= MINIMO_RECORTE:
+            texto = recortar(bloque.texto, restante - TOKENS_POR_MENSAJE, modelo)
+            if texto:
+                conservados[i] = bloque._replace(texto=texto)
+                restante -= estimar_tokens(texto, modelo) + TOKENS_POR_MENSAJE
+                recortados.append(bloque.tipo)
+            else:
+                descartados.append(bloque.tipo)
+        else:
+            descartados.append(bloque.tipo)
+    informe = {
+        "tokens": maximo - restante,
+        "tokens_sin_ajustar": sum(costes),
+        "descartados": descartados,
+        "recortados": recortados,
+    }
+    return [conservados[i] for i in sorted(conservados)], informe
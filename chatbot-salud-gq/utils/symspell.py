@@ -0,0 +1,179 @@
+"""
+Corrección de faltas de ortografía con un índice de borrados (SymSpell).
+
+Cada término del vocabulario (enfermedades, síntomas, ciudades, regiones...)
+se registra junto con todas las variantes que resultan de borrarle hasta
+dos letras. Para corregir una palabra basta con generar sus propios borrados
+y buscarlos en ese índice: los candidatos se verifican con la distancia de
+Damerau-Levenshtein. No se recorre el vocabulario, así que cada palabra se
+corrige en microsegundos.
+
+Las palabras cortas no se corrigen (salvo acentos): con 4 letras o menos
+una sola falta ya las confunde con otras palabras comunes.
+"""
+
+import re
+import threading
+import unicodedata
+from functools import lru_cache
+
+DISTANCIA_INDICE = 2
+
+_PALABRA = re.compile(r"[^\W\d_]+(?:'[^\W\d_]+)?")
+
+
+def normalizar(palabra):
+    """Minúsculas y sin acentos."""
+    descompuesto = unicodedata.normalize("NFKD", palabra.lower())
+    return "".join(c for c in descompuesto if not unicodedata.combining(c))
+
+
+def distancia_maxima(longitud):
+    """Faltas admitidas según la longitud de la palabra."""
+    if longitud <= 4:
+        return 0
+    if longitud <= 8:
+        return 1
+    return 2
+
+
+def _borrados(palabra, distancia):
+    """La palabra y todas las variantes con hasta `distancia` letras borradas."""
+    resultado = {palabra}
+    frontera = {palabra}
+    for _ in range(distancia):
+        siguiente = set()
+        for variante in frontera:
+            if len(variante) <= 1:
+                continue
+            for i in range(len(variante)):
+                siguiente.add(variante[:i] + variante[i + 1:])
+        resultado |= siguiente
+        frontera = siguiente
+    return resultado
+
+
+def variantes_edicion(palabra, letras="abcdefghijklmnopqrstuvwxyz"):
+    """
+    La palabra y todas las que están a una falta de ella: una letra borrada,
+    cambiada, añadida o traspuesta con la siguiente (Damerau-Levenshtein 1).
+    Para palabras ya normalizadas; unas 55 variantes por letra.
+    """
+    cortes = [(palabra[:i], palabra[i:]) for i in range(len(palabra) + 1)]
+    variantes = {palabra}
+    variantes.update(a + b[1:] for a, b in cortes if b)
+    variantes.update(a + b[1] + b[0] + b[2:] for a, b in cortes if len(b) > 1)
+    variantes.update(a + letra + b[1:] for a, b in cortes if b for letra in letras)
+    variantes.update(a + letra + b for a, b in cortes for letra in letras)
+    return variantes
+
+
+def distancia_edicion(a, b, maximo):
+    """Damerau-Levenshtein (transposiciones adyacentes); maximo + 1 si lo supera."""
+    if abs(len(a) - len(b)) > maximo:
+        return maximo + 1
+    anterior2 = None
+    anterior = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        actual = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            coste = a[i - 1] != b[j - 1]
+            actual[j] = min(anterior[j] + 1, actual[j - 1] + 1, anterior[j - 1] + coste)
+            if (
+                anterior2 is not None
+                and i > 1 and j > 1
+                and a[i - 1] == b[j - 2]
+                and a[i - 2] == b[j - 1]
+            ):
+                actual[j] = min(actual[j], anterior2[j - 2] + 1)
+        if min(actual) > maximo:
+            return maximo + 1
+        anterior2, anterior = anterior, actual
+    return anterior[-1]
+
+
+class DiccionarioSymSpell:
+    """Vocabulario con índice de borrados para corregir palabras sueltas."""
+
+    def __init__(self):
+        self._terminos = {}  # forma normalizada -> (forma canónica, orden)
+        self._borrados = {}  # borrado -> set(formas normalizadas)
+
+    def agregar(self, termino):
+        """Registra un término; la primera grafía registrada es la canónica."""
+        clave = normalizar(termino)
+        if len(clave) < 3 or clave in self._terminos:
+            return
+        self._terminos[clave] = (termino.lower(), len(self._terminos))
+        profundidad = DISTANCIA_INDICE if len(clave) > 4 else 0
+        for borrado in _borrados(clave, profundidad):
+            self._borrados.setdefault(borrado, set()).add(clave)
+
+    def corregir(self, palabra):
+        """(término canónico, distancia) más cercano a la palabra, o None."""
+        clave = normalizar(palabra)
+        termino = self._terminos.get(clave)
+        if termino is not None:
+            return termino[0], 0
+        maximo = distancia_maxima(len(clave))
+        if not maximo:
+            return None
+
+        candidatos = set()
+        for borrado in _borrados(clave, maximo):
+            candidatos |= self._borrados.get(borrado, set())
+        mejor = None
+        for candidato in candidatos:
+            # Una falta por cada 4-8 letras de la más corta de las dos palabras
+            limite = min(maximo, distancia_maxima(len(candidato)))
+            distancia = distancia_edicion(clave, candidato, limite)
+            if distancia > limite:
+                continue
+            orden = self._terminos[candidato][1]
+            if mejor is None or (distancia, orden) < mejor[:2]:
+                mejor = (distancia, orden, candidato)
+        if mejor is None:
+            return None
+        return self._terminos[mejor[2]][0], mejor[0]
+
+    def __len__(self):
+        return len(self._terminos)
+
+
+# ==================== Registro compartido ====================
+
+_diccionario = DiccionarioSymSpell()
+_lock = threading.Lock()
+
+
+def registrar_vocabulario(textos):
+    """
+    Registra las palabras de una lista de textos (nombres, síntomas...).
+    Los módulos de conocimiento lo llaman al importarse.
+    """
+    with _lock:
+        for texto in textos:
+            for palabra in _PALABRA.findall(texto):
+                if len(palabra) >= 4:
+                    _diccionario.agregar(palabra)
+        corregir_texto.cache_clear()
+
+
+@lru_cache(maxsize=2048)
+def corregir_texto(texto):
+    """
+    Sustituye las palabras mal escritas del texto por su término del
+    vocabulario. Retorna (texto_corregido, ((original, término), ...)).
+    """
+    correcciones = []
+
+    def sustituir(coincidencia):
+        palabra = coincidencia.group(0)
+        resultado = _diccionario.corregir(palabra)
+        if resultado is None or resultado[0] == palabra.lower():
+            return palabra
+        correcciones.append((palabra, resultado[0]))
+        return resultado[0]
+
+    corregido = _PALABRA.sub(sustituir, texto)
+    return corregido, tuple(correcciones)
@@ -0,0 +1,54 @@
+"""
+Vectores densos sin red ni modelo: n-gramas de caracteres con feature hashing.
+
+Cada palabra (sin acentos, con marcas de inicio y fin) se parte en bigramas
+y trigramas de caracteres; cada n-grama suma +1 o -1 en la posición que
+indica su hash. Dos preguntas con las mismas palabras mal escritas o con
+variantes de ortografía (español/fang) comparten la mayoría de sus n-gramas,
+así que sus vectores normalizados tienen un coseno alto.
+"""
+
+import unicodedata
+import zlib
+from functools import lru_cache
+
+import numpy as np
+
+N_GRAMAS = (2, 3)
+
+
+def _sin_acentos(texto):
+    descompuesto = unicodedata.normalize("NFKD", texto)
+    return "".join(c for c in descompuesto if not unicodedata.combining(c))
+
+
+@lru_cache(maxsize=65536)
+def _rasgos_palabra(palabra, dimension):
+    """(posiciones, signos) de los n-gramas de una palabra."""
+    marcada = f"^{_sin_acentos(palabra)}$"
+    posiciones = []
+    signos = []
+    for n in N_GRAMAS:
+        for i in range(max(1, len(marcada) - n + 1)):
+            h = zlib.crc32(marcada[i:i + n].encode("utf-8"))
+            posiciones.append(h % dimension)
+            # El bit alto del hash decide el signo: las colisiones se compensan
+            signos.append(1.0 if h & 0x80000000 else -1.0)
+    return posiciones, signos
+
+
+def vectorizar(palabras, dimension):
+    """Vector float32 de norma 1 para un conjunto de palabras (None si está vacío)."""
+    posiciones = []
+    signos = []
+    for palabra in palabras:
+        p, s = _rasgos_palabra(palabra, dimension)
+        posiciones.extend(p)
+        signos.extend(s)
+    if not posiciones:
+        return None
+    vector = np.bincount(posiciones, weights=signos, minlength=dimension).astype(np.float32)
+    norma = np.linalg.norm(vector)
+    if not norma:
+        return None
+    return vector / norma